@@ -8,6 +8,7 @@ import rcf.run
 import rcf.sar
 import rcf.cryption
 import rcf.config
+import rcf.simulate
 
 @click.group()
 @click.option('-c', '--config', default='config', show_default=True,
@@ -31,3 +32,4 @@ cli.add_command(rcf.run.run)
 cli.add_command(rcf.sar.sar)
 cli.add_command(rcf.cryption.encrypt)
 cli.add_command(rcf.cryption.decrypt)
+cli.add_command(rcf.simulate.simulate)
@@ -2,13 +2,21 @@
 This "module" provides the (socket) methods required to access the TaskManager
 using the ComputeFarm JSON RPC protocol.
 
-This "module" is used by both the newTask and queryWorkers tools.
+This "module" is used by both the newTask and queryWorkers tools (and by the
+workers, to transfer blobs).
 """
 
+import base64
+import hashlib
 import json
+import os
+import random
+import shutil
 import socket
 import sys
+import time
 import yaml
+import zlib
 
 def tcpTMConnection(tmRequest, verbose) :
   try :
@@ -36,12 +44,29 @@ def tcpTMSentRequest(tmRequest, tmSocket, verbose) :
     return False
   return True
 
+# the buffered file objects associated with each open taskManager socket
+tmSocketFiles = {}
+
+def tcpTMReadLine(tmSocket) :
+  """
+  Read the next (newline terminated) JSON message sent by the taskManager.
+  Returns None once the connection has been closed.
+
+  (The taskManager may send more than one message in a single packet, so we
+  keep a buffered file object associated with each socket).
+  """
+  if tmSocket not in tmSocketFiles :
+    tmSocketFiles[tmSocket] = tmSocket.makefile('rb')
+  aLine = tmSocketFiles[tmSocket].readline()
+  if not aLine : return None
+  return aLine
+
 def tcpTMGetResult(tmSocket, verbose) :
   # read result
   result = {}
   resultJson = None
   try : 
-    resultJson = tmSocket.recv(4096)
+    resultJson = tcpTMReadLine(tmSocket)
   except Exception as err :
     print("Lost connection to the taskManager while getting a result")
     print(f"Exception({err.__class__.__name__}): {str(err)}")
@@ -51,10 +76,38 @@ def tcpTMGetResult(tmSocket, verbose) :
 
 def tcpTMCloseConnection(tmSocket, verbose) :
   if verbose : print("Closing the connection to the taskManager")
-  tmSocket.shutdown(socket.SHUT_RDWR)
+  if tmSocket in tmSocketFiles :
+    tmSocketFiles.pop(tmSocket).close()
+  try :
+    tmSocket.shutdown(socket.SHUT_RDWR)
+  except OSError :
+    pass  # the taskManager has already closed the connection
   tmSocket.close()
 
-def tcpTMCollectResults(tmSocket, msgArray, verbose) :
+def tcpTMRequest(tmRequest, aMessage, verbose) :
+  """
+  Send the (JSON) message `aMessage` to the taskManager (on its own
+  connection) and return the taskManager's (single) reply (or None if the
+  taskManager could not be reached).
+  """
+  tmSocket = tcpTMConnection(tmRequest, verbose)
+  if not tmSocket : return None
+  result = None
+  if tcpTMSentRequest(aMessage, tmSocket, verbose) :
+    result = tcpTMGetResult(tmSocket, verbose)
+  tcpTMCloseConnection(tmSocket, verbose)
+  return result
+
+def tcpTMCollectResults(tmSocket, msgArray, verbose, taskInfo=None) :
+  """
+  Collect the results of a task request returning the task's return code.
+
+  If the (optional) `taskInfo` dict is provided, it is updated with the
+  `taskId` assigned to this task by the taskManager (and the complete
+  final `result` message). If the taskManager refused the task, the
+  `taskInfo` is instead updated with the number of seconds after which the
+  task should be sent again (`retryAfter`, see `tcpTMSubmitTask`).
+  """
   
   returnCode = 1
   moreToRead = True
@@ -62,21 +115,31 @@ def tcpTMCollectResults(tmSocket, msgArray, verbose) :
     if verbose : print("Reading...")
     data = None
     try : 
-      data = tmSocket.recv(4096)
+      data = tcpTMReadLine(tmSocket)
     except Exception as err :
       print("Lost connection to the taskManager")
       print(f"Exception({err.__class__.__name__}): {str(err)}")
     if data :
      aLine = data.decode().strip()
      #print(f'Received: [{aLine}]')
-     if 'returncode' in aLine :
-       workerJson = json.loads(aLine)
-       if 'returncode' in workerJson :
-         returnCode = workerJson['returncode']
-         moreToRead = False
-       if 'msg' in workerJson :
-        if msgArray : msgArray.append(workerJson['msg'])
-        else        : print(workerJson['msg'])
+     workerJson = json.loads(aLine)
+     if 'type' in workerJson and workerJson['type'] == 'taskAccepted' :
+       if taskInfo is not None : taskInfo['taskId'] = workerJson['taskId']
+       if msgArray is None : print(f"Task id: {workerJson['taskId']}")
+       if msgArray is None and 'sharedWith' in workerJson :
+         print(f"Sharing the run of the identical task {workerJson['sharedWith']}")
+       continue
+     if 'type' in workerJson and workerJson['type'] == 'retryAfter' :
+       print(f"The taskManager refused the task since {workerJson['reason']}")
+       if taskInfo is not None : taskInfo['retryAfter'] = workerJson['retryAfter']
+       break
+     if 'returncode' in workerJson :
+       returnCode = workerJson['returncode']
+       if taskInfo is not None : taskInfo['result'] = workerJson
+       moreToRead = False
+     if 'msg' in workerJson :
+      if msgArray is not None : msgArray.append(workerJson['msg'])
+      else                    : print(workerJson['msg'])
     else : 
       print("Data is empty!")
       moreToRead = False
@@ -84,6 +147,30 @@ def tcpTMCollectResults(tmSocket, msgArray, verbose) :
   tcpTMCloseConnection(tmSocket, verbose)
   return returnCode
 
+def tcpTMSubmitTask(tmRequest, msgArray, verbose, taskInfo) :
+  """
+  Send the task request `tmRequest` to the taskManager and collect its results
+  (see `tcpTMCollectResults`), returning the task's return code (or None if
+  the request could not be sent).
+
+  While the taskManager refuses the task (because too many tasks are
+  pending), we wait for the requested number of seconds (plus a random
+  fraction, so that refused requesters do not all return at once) and send
+  the request again.
+  """
+  while True :
+    taskInfo.pop('retryAfter', None)
+    tmSocket = tcpTMConnection(tmRequest, verbose)
+    if not tmSocket : return None
+    if not tcpTMSentRequest(tmRequest, tmSocket, verbose) :
+      tcpTMCloseConnection(tmSocket, verbose)
+      return None
+    returnCode = tcpTMCollectResults(tmSocket, msgArray, verbose, taskInfo)
+    if 'retryAfter' not in taskInfo : return returnCode
+    delay = taskInfo['retryAfter'] * random.uniform(1.0, 1.5)
+    print(f"Retrying in {delay:.1f} seconds")
+    time.sleep(delay)
+
 def compileActionScript(someAliases, someEnvs, someActions) :
   """
   Create a (unix) shell script which can run the actions specified by the
@@ -117,3 +204,235 @@ def compileActionScript(someAliases, someEnvs, someActions) :
       actionScript.append(" ".join(anAction))
 
   return "\n\n".join(actionScript)
+
+################################################################################
+# The content addressed blob store
+#
+# Blobs are identified by the (hex) SHA-256 hash of their contents. Each of the
+# functions below uses its own (short lived) connection to the taskManager.
+
+blobChunkSize = 1024 * 1024
+
+def fileBlobHash(aPath) :
+  """
+  Return the blob hash of the contents of the file `aPath`.
+  """
+  theHash = hashlib.sha256()
+  with open(aPath, 'rb') as aFile :
+    while True :
+      aChunk = aFile.read(blobChunkSize)
+      if not aChunk : break
+      theHash.update(aChunk)
+  return theHash.hexdigest()
+
+def tcpTMMissingBlobs(tmRequest, someHashes, verbose) :
+  """
+  Return the list of the blobs `someHashes` which are not in the taskManager's
+  blob store (or None if the taskManager could not be asked).
+  """
+  result = tcpTMRequest(tmRequest, {
+    'type' : 'blobHas', 'hashes' : list(someHashes)
+  }, verbose)
+  if result is None : return None
+  return result.get('missing')
+
+def tcpTMPutBlobs(tmRequest, somePaths, verbose) :
+  """
+  Upload the files `somePaths` (which are not already there) to the
+  taskManager's blob store, returning a dict of their blob hashes (indexed by
+  path), or None if the files could not be uploaded.
+  """
+  someHashes = { aPath : fileBlobHash(aPath) for aPath in somePaths }
+  missing = tcpTMMissingBlobs(tmRequest, set(someHashes.values()), verbose)
+  if missing is None : return None
+  if not missing : return someHashes
+
+  toSend = {}
+  for aPath, aHash in someHashes.items() :
+    if aHash in missing and aHash not in toSend : toSend[aHash] = aPath
+  tmSocket = tcpTMConnection(tmRequest, verbose)
+  if not tmSocket : return None
+  result = {}
+  try :
+    someBlobs = [
+      [ aHash, os.path.getsize(aPath) ] for aHash, aPath in toSend.items()
+    ]
+    tmSocket.sendall(json.dumps({
+      'type' : 'blobPut', 'blobs' : someBlobs
+    }).encode() + b"\n")
+    for aHash, aPath in toSend.items() :
+      with open(aPath, 'rb') as aFile :
+        tmSocket.sendfile(aFile)
+    result = tcpTMGetResult(tmSocket, verbose)
+  except OSError as err :
+    print("Lost connection to the taskManager while uploading blobs")
+    print(f"Exception({err.__class__.__name__}): {str(err)}")
+  tcpTMCloseConnection(tmSocket, verbose)
+  if set(toSend) - set(result.get('stored', [])) :
+    print("Could not upload all of the blobs to the taskManager")
+    return None
+  return someHashes
+
+def tcpTMGetBlobs(tmRequest, someHashes, pathFor, verbose) :
+  """
+  Fetch (in bulk, over one connection) the blobs `someHashes` from the
+  taskManager's blob store, writing each blob to the path returned by
+  `pathFor(aHash)`. Returns the list of the blobs which have been fetched
+  (those whose contents match their hash).
+  """
+  someHashes = list(someHashes)
+  if not someHashes : return []
+  tmSocket = tcpTMConnection(tmRequest, verbose)
+  if not tmSocket : return []
+  fetched = []
+  if tcpTMSentRequest({
+    'type' : 'blobGet', 'hashes' : someHashes
+  }, tmSocket, verbose) :
+    try :
+      if tmSocket not in tmSocketFiles :
+        tmSocketFiles[tmSocket] = tmSocket.makefile('rb')
+      socketFile = tmSocketFiles[tmSocket]
+      for _ in someHashes :
+        aHeader = tcpTMReadLine(tmSocket)
+        if not aHeader : break
+        aHeader = json.loads(aHeader.decode())
+        aHash = aHeader['hash']
+        size  = aHeader['size']
+        if size < 0 : continue
+        blobPath = pathFor(aHash)
+        os.makedirs(os.path.dirname(blobPath) or '.', exist_ok=True)
+        tmpPath = f"{blobPath}.{os.getpid()}.tmp"
+        theHash = hashlib.sha256()
+        with open(tmpPath, 'wb') as blobFile :
+          remaining = size
+          while 0 < remaining :
+            aChunk = socketFile.read(min(remaining, blobChunkSize))
+            if not aChunk : raise EOFError("truncated blob")
+            theHash.update(aChunk)
+            blobFile.write(aChunk)
+            remaining -= len(aChunk)
+        if theHash.hexdigest() == aHash :
+          os.replace(tmpPath, blobPath)
+          fetched.append(aHash)
+        else :
+          os.remove(tmpPath)
+    except (OSError, EOFError, ValueError) as err :
+      print("Lost connection to the taskManager while fetching blobs")
+      print(f"Exception({err.__class__.__name__}): {str(err)}")
+  tcpTMCloseConnection(tmSocket, verbose)
+  return fetched
+
+################################################################################
+# Inline (small file) payloads
+#
+# Small input and output files may be sent inline (compressed and base64
+# encoded) in the taskRequest and in the task's final message, so that tiny
+# tasks do not need either the shared filesystem or the blob store.
+
+maxInlineSize  = 64 * 1024    # the largest file sent inline (bytes)
+maxInlineTotal = 1024 * 1024  # the most sent inline in one message (bytes)
+
+def inlinePayload(aPath) :
+  """
+  Return the (compressed and base64 encoded) contents of the file `aPath`.
+  """
+  with open(aPath, 'rb') as aFile :
+    return base64.b64encode(zlib.compress(aFile.read())).decode('ascii')
+
+def writeInlinePayload(aPath, aPayload) :
+  """
+  Write the contents of the inline payload `aPayload` to the file `aPath`.
+  """
+  os.makedirs(os.path.dirname(aPath) or '.', exist_ok=True)
+  with open(aPath, 'wb') as aFile :
+    aFile.write(zlib.decompress(base64.b64decode(aPayload)))
+
+def splitInlineFiles(somePaths) :
+  """
+  Split the (existing) files `somePaths` into those which are small enough to
+  be sent inline (see `maxInlineSize` and `maxInlineTotal`) and the others.
+  """
+  inlinePaths = []
+  otherPaths  = []
+  totalSize   = 0
+  for aPath in somePaths :
+    size = os.path.getsize(aPath)
+    if size <= maxInlineSize and totalSize + size <= maxInlineTotal :
+      inlinePaths.append(aPath)
+      totalSize += size
+    else :
+      otherPaths.append(aPath)
+  return inlinePaths, otherPaths
+
+################################################################################
+# Task input and output files
+#
+# A task's input files are sent inline if they are small, otherwise through
+# the blob store. Its outputs come back the same way (see the worker).
+
+def attachTaskInputs(tmRequest, taskRequest, someFiles, verbose) :
+  """
+  Attach the (local) files `someFiles` (a dict of local paths indexed by
+  their relative path in the task's scratch directory) to the task request
+  `taskRequest` (as `inlineInputs` and `inputBlobs`). Returns False if the
+  larger files could not be uploaded to the blob store.
+  """
+  taskPaths = { aPath : aTaskPath for aTaskPath, aPath in someFiles.items() }
+  inlinePaths, blobPaths = splitInlineFiles(taskPaths.keys())
+  if inlinePaths :
+    taskRequest['inlineInputs'] = {
+      taskPaths[aPath] : inlinePayload(aPath) for aPath in inlinePaths
+    }
+  if blobPaths :
+    someHashes = tcpTMPutBlobs(tmRequest, blobPaths, verbose)
+    if someHashes is None : return False
+    taskRequest['inputBlobs'] = {
+      taskPaths[aPath] : aHash for aPath, aHash in someHashes.items()
+    }
+  return True
+
+def collectTaskOutputs(tmRequest, taskResult, pathFor, verbose) :
+  """
+  Write the outputs returned in the task's final message `taskResult` (its
+  `inlineOutputs` and, fetched from the blob store, its `outputBlobs`) to the
+  local paths returned by `pathFor(aTaskPath)`. Returns the list of the
+  (relative) task paths which could not be written.
+  """
+  for aTaskPath, aPayload in taskResult.get('inlineOutputs', {}).items() :
+    writeInlinePayload(pathFor(aTaskPath), aPayload)
+  someTaskPaths = {}
+  for aTaskPath, aHash in (taskResult.get('outputBlobs') or {}).items() :
+    someTaskPaths.setdefault(aHash, []).append(aTaskPath)
+  if not someTaskPaths : return []
+  fetched = tcpTMGetBlobs(
+    tmRequest, someTaskPaths.keys(),
+    lambda aHash : pathFor(someTaskPaths[aHash][0]), verbose
+  )
+  for aHash in fetched :
+    for aTaskPath in someTaskPaths[aHash][1:] :
+      shutil.copyfile(pathFor(someTaskPaths[aHash][0]), pathFor(aTaskPath))
+  missing = []
+  for aHash in set(someTaskPaths) - set(fetched) :
+    missing.extend(someTaskPaths[aHash])
+  return missing
+
+################################################################################
+# The action cache (of the results of deterministic tasks)
+
+def tcpTMCacheGet(tmRequest, aKey, verbose) :
+  """
+  Return the taskManager's action cache entry for the key `aKey` (or None).
+  """
+  result = tcpTMRequest(tmRequest, { 'type' : 'cacheGet', 'key' : aKey }, verbose)
+  if not result or not result.get('found') : return None
+  return result['entry']
+
+def tcpTMCachePut(tmRequest, aKey, anEntry, verbose) :
+  """
+  Store the entry `anEntry` (whose outputs MUST already be in the blob store)
+  in the taskManager's action cache. Returns True if the entry was stored.
+  """
+  result = tcpTMRequest(tmRequest, {
+    'type' : 'cachePut', 'key' : aKey, 'entry' : anEntry
+  }, verbose)
+  return bool(result and result.get('stored'))
@@ -0,0 +1,493 @@
+"""
+This "module" provides the (high resolution) sampling of a host's load
+information used by the computeFarm's monitors (and load reporting workers).
+
+On Linux the samples are computed from `/proc/stat`, `/proc/meminfo`,
+`/proc/diskstats`, `/proc/net/dev`, `/proc/vmstat` and (where the kernel
+supports pressure stall information) `/proc/pressure/*`. Elsewhere we fall back
+to `os.getloadavg` and `os.sysconf` (and the other values are not reported).
+
+Each sample is a (JSON-able) dict with the following keys:
+
+  - numCpus      : number of cpu/cores
+
+  - wlOne        : work load average over the last minute
+  - wlFive       : work load average over the last five minutes
+  - wlFifteen    : work load average over the last fifteen minutes
+
+  - wlNow        : the instantaneous work load (the number of busy cpus, or the
+                   number of runnable or blocked processes if that is larger)
+
+  - cpuUtil      : the fraction of the cpus busy since the last sample
+  - runnable     : the (smoothed) number of runnable processes
+  - blocked      : the (smoothed) number of processes blocked on I/O
+
+  - memTotal     : the total memory (MB)
+  - memAvailable : the memory (MB) currently available
+
+  - psiCpu       : the fraction of the time since the last sample during which
+  - psiMemory      some task was stalled waiting for a cpu, for memory or for
+  - psiIo          I/O (only if the kernel provides pressure stall information)
+
+  - diskRead     : the rate (MB/s) at which the (physical) disks were read
+  - diskWrite    : the rate (MB/s) at which the (physical) disks were written
+  - diskBusy     : the fraction of the time the busiest disk was busy
+
+  - netRx        : the rate (MB/s) at which the network interfaces (other than
+  - netTx          the loopback) received and transmitted data
+
+  - swapUsed     : the swap space (MB) currently used
+  - swapIn       : the rate (pages/s) at which pages were swapped in and out
+  - swapOut
+
+  - speed        : the (calibrated) speed of one of this host's cores relative
+                   to the reference machine (see `calibrationBenchmark`)
+
+This "module" MUST be concatinated BEFORE the `monitor.py` (or `worker.py`)
+"module".
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import time
+import zlib
+
+def readProcFile(aPath) :
+  """
+  Return the lines of the (/proc) file `aPath` (or an empty list if this file
+  can not be read).
+  """
+  try :
+    with open(aPath) as procFile :
+      return procFile.readlines()
+  except OSError :
+    return []
+
+def memoryInfo() :
+  """
+  Return the total and available memory (both in MB) of this machine.
+
+  On Linux we use /proc/meminfo (whose `MemAvailable` includes the reclaimable
+  page cache), elsewhere we fall back to `os.sysconf` (where available).
+  """
+  memTotal     = 0
+  memAvailable = 0
+  for aLine in readProcFile('/proc/meminfo') :
+    aKey, aValue = aLine.split(':', 1)
+    if aKey == 'MemTotal' :
+      memTotal = int(aValue.split()[0]) // 1024
+    elif aKey == 'MemAvailable' :
+      memAvailable = int(aValue.split()[0]) // 1024
+  if not memTotal :
+    try :
+      pageSize     = os.sysconf('SC_PAGE_SIZE')
+      memTotal     = os.sysconf('SC_PHYS_PAGES') * pageSize // (1024 * 1024)
+      memAvailable = os.sysconf('SC_AVPHYS_PAGES') * pageSize // (1024 * 1024)
+    except (AttributeError, OSError, ValueError) :
+      pass
+  return memTotal, memAvailable
+
+def diskDevices() :
+  """
+  Return the set of the names of the physical disks (excluding partitions,
+  loop, ram and device-mapper devices which would otherwise double count the
+  disk traffic).
+  """
+  try :
+    someDevices = os.listdir('/sys/block')
+  except OSError :
+    return set()
+  virtualPrefixes = ( 'loop', 'ram', 'zram', 'dm-', 'md', 'sr', 'fd' )
+  return {
+    aDevice for aDevice in someDevices
+      if not aDevice.startswith(virtualPrefixes)
+  }
+
+def diskCounters(someDevices) :
+  """
+  Return a dict (indexed by disk) of the (sectors read, sectors written,
+  milli-seconds busy) counters from /proc/diskstats.
+  """
+  someCounters = {}
+  for aLine in readProcFile('/proc/diskstats') :
+    someFields = aLine.split()
+    if len(someFields) < 13 or someFields[2] not in someDevices : continue
+    someCounters[someFields[2]] = (
+      int(someFields[5]), int(someFields[9]), int(someFields[12])
+    )
+  return someCounters
+
+def networkCounters() :
+  """
+  Return the total (bytes received, bytes transmitted) by all of the network
+  interfaces (other than the loopback) from /proc/net/dev (or None).
+  """
+  someLines = readProcFile('/proc/net/dev')
+  if not someLines : return None
+  rxBytes = 0
+  txBytes = 0
+  for aLine in someLines[2:] :
+    anInterface, someFields = aLine.split(':', 1)
+    if anInterface.strip() == 'lo' : continue
+    someFields = someFields.split()
+    rxBytes += int(someFields[0])
+    txBytes += int(someFields[8])
+  return (rxBytes, txBytes)
+
+def swapCounters() :
+  """
+  Return the (pages swapped in, pages swapped out) counters from /proc/vmstat
+  (or None).
+  """
+  swapIn  = None
+  swapOut = None
+  for aLine in readProcFile('/proc/vmstat') :
+    if aLine.startswith('pswpin ') :
+      swapIn = int(aLine.split()[1])
+    elif aLine.startswith('pswpout ') :
+      swapOut = int(aLine.split()[1])
+  if swapIn is None or swapOut is None : return None
+  return (swapIn, swapOut)
+
+def swapUsed() :
+  """
+  Return the swap space (MB) currently used (or None).
+  """
+  swapTotal = None
+  swapFree  = None
+  for aLine in readProcFile('/proc/meminfo') :
+    if aLine.startswith('SwapTotal:') :
+      swapTotal = int(aLine.split()[1])
+    elif aLine.startswith('SwapFree:') :
+      swapFree = int(aLine.split()[1])
+  if swapTotal is None or swapFree is None : return None
+  return (swapTotal - swapFree) // 1024
+
+def pressureTotal(aResource) :
+  """
+  Return the total time (micro-seconds) during which some task was stalled on
+  the resource `aResource` (`cpu`, `memory` or `io`), or None if the kernel
+  does not provide pressure stall information.
+  """
+  for aLine in readProcFile(f"/proc/pressure/{aResource}") :
+    if aLine.startswith('some') :
+      return int(aLine.rsplit('total=', 1)[1])
+  return None
+
+# The time (seconds) taken by one run of the calibration benchmark on the
+# reference machine (one core of a 2.1GHz x86_64 server), whose speed is 1.0.
+calibrationReference = 0.04
+
+# The file in which the host's calibrated speed is persisted (and shared by
+# the monitor and all of the workers on this host).
+hostSpeedPath = '~/.local/pyComputeFarm/hostSpeed.json'
+
+def calibrationBenchmark(repeats=5) :
+  """
+  Return the speed of one core of this host relative to the reference machine.
+
+  The benchmark is a short, fixed (and so reproducible) mix of interpreted
+  integer arithmetic, compression and hashing (roughly the mix of a compiler).
+  The fastest of `repeats` runs is used to reduce the noise from other
+  processes.
+  """
+  someData = bytes((i * 7919) & 0xff for i in range(1 << 16))
+  bestTime = None
+  for aRepeat in range(repeats) :
+    startTime = time.perf_counter()
+    aValue = 0
+    for i in range(200000) : aValue = (aValue * 31 + i) & 0xffffffff
+    for i in range(20) : zlib.compress(someData, 6)
+    aHash = hashlib.sha256()
+    for i in range(64) : aHash.update(someData)
+    aTime = time.perf_counter() - startTime
+    if bestTime is None or aTime < bestTime : bestTime = aTime
+  return round(calibrationReference / bestTime, 3)
+
+def hardwareState() :
+  """
+  Return a dict describing the hardware conditions under which a calibration
+  was made: the number of cpus, the (thermal or policy) limit on the cpu
+  frequency (kHz) and the number of times the cpus have been thermally
+  throttled (where the kernel reports these).
+  """
+  maxFrequency = 0
+  throttles    = 0
+  for aCpu in range(os.cpu_count()) :
+    cpuDir = f"/sys/devices/system/cpu/cpu{aCpu}"
+    for aLine in readProcFile(f"{cpuDir}/cpufreq/scaling_max_freq") :
+      maxFrequency = max(maxFrequency, int(aLine))
+    for aLine in readProcFile(f"{cpuDir}/thermal_throttle/core_throttle_count") :
+      throttles += int(aLine)
+  return {
+    'numCpus'      : os.cpu_count(),
+    'maxFrequency' : maxFrequency,
+    'throttles'    : throttles
+  }
+
+class HostSampler :
+  """
+  Sample this host's load information. The rates (cpu utilisation, pressure
+  stalls, disk, network and swap traffic) are computed over the time since the
+  previous sample.
+
+  - `smoothing` : the weight given to the latest (instantaneous) runnable and
+                  blocked process counts.
+
+  - `recalibrateInterval` : the interval (seconds) between re-calibrations of
+                  this host's speed (0 disables the calibration).
+
+  - `speedPath` : the file in which the host's calibrated speed is persisted.
+
+  The host's speed is also re-calibrated whenever its hardware conditions (see
+  `hardwareState`) change. Since a calibration on a busy host measures the
+  contention rather than the host, calibrations (including the first) are
+  postponed until the host is (at least half) idle. Until then no speed is
+  reported (unless a speed has already been persisted).
+
+  All of the samplers on a host (the monitor's and those of the, short lived,
+  load reporting workers) share the persisted speed. Only one of them
+  calibrates at a time (the others adopt its speed once it is persisted), so
+  a restarted worker does not re-run the calibration.
+  """
+
+  __slots__ = (
+    'numCpus', 'smoothing', 'lastTime', 'lastCpu', 'lastPressure', 'runnable',
+    'blocked', 'disks', 'lastDisks', 'lastNetwork', 'lastSwap',
+    'recalibrateInterval', 'speedPath', 'speed', 'calibratedState',
+    'lastCalibration'
+  )
+
+  pressureResources = ( 'cpu', 'memory', 'io' )
+
+  def __init__(
+    self, smoothing=0.5, recalibrateInterval=3600, speedPath=hostSpeedPath
+  ) :
+    self.numCpus      = os.cpu_count()
+    self.smoothing    = smoothing
+    self.lastTime     = time.monotonic()
+    self.lastCpu      = self.cpuTimes()
+    self.lastPressure = {
+      aResource : pressureTotal(aResource)
+        for aResource in self.pressureResources
+    }
+    self.runnable     = None
+    self.blocked      = None
+    self.disks        = diskDevices()
+    self.lastDisks    = diskCounters(self.disks)
+    self.lastNetwork  = networkCounters()
+    self.lastSwap     = swapCounters()
+    self.recalibrateInterval = recalibrateInterval
+    self.speedPath           = os.path.expanduser(speedPath)
+    self.speed               = None
+    self.calibratedState     = None
+    self.lastCalibration     = 0
+    self.loadSpeed()
+
+  def cpuTimes(self) :
+    """
+    Return the (busy, total) cpu time (in clock ticks) from /proc/stat (or
+    None if /proc/stat can not be read).
+    """
+    for aLine in readProcFile('/proc/stat') :
+      if aLine.startswith('cpu ') :
+        someTimes = [ int(aTime) for aTime in aLine.split()[1:] ]
+        idleTime  = sum(someTimes[3:5])    # idle + iowait
+        totalTime = sum(someTimes[:8])     # (guest time is already in user)
+        return (totalTime - idleTime, totalTime)
+    return None
+
+  def processCounts(self) :
+    """
+    Return the number of (runnable, blocked) processes (excluding this
+    monitor) from /proc/stat (or None if /proc/stat can not be read).
+    """
+    runnable = None
+    blocked  = None
+    for aLine in readProcFile('/proc/stat') :
+      if aLine.startswith('procs_running') :
+        runnable = max(int(aLine.split()[1]) - 1, 0)
+      elif aLine.startswith('procs_blocked') :
+        blocked = int(aLine.split()[1])
+    if runnable is None or blocked is None : return None
+    return (runnable, blocked)
+
+  def loadSpeed(self) :
+    """
+    Adopt the host's persisted speed (if any, and if it is more recent than
+    our own calibration).
+    """
+    try :
+      with open(self.speedPath) as speedFile :
+        speedData = json.load(speedFile)
+    except (OSError, ValueError) :
+      return
+    if not isinstance(speedData, dict) : return
+    if speedData.get('calibrated', 0) <= self.lastCalibration : return
+    self.speed           = speedData.get('speed')
+    self.calibratedState = speedData.get('state')
+    self.lastCalibration = speedData['calibrated']
+
+  def calibrate(self) :
+    """
+    (Re)calibrate the speed of this host, and persist it, unless another
+    sampler on this host is already calibrating.
+    """
+    try :
+      os.makedirs(os.path.dirname(self.speedPath), exist_ok=True)
+      lockFile = open(self.speedPath + '.lock', 'w')
+    except OSError :
+      return
+    with lockFile :
+      try :
+        fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except OSError :
+        return  # (we adopt the other sampler's speed once it is persisted)
+      lastCalibration = self.lastCalibration
+      self.loadSpeed()
+      if lastCalibration < self.lastCalibration : return  # (just calibrated)
+      self.calibratedState = hardwareState()
+      self.speed           = calibrationBenchmark()
+      self.lastCalibration = time.time()
+      print(f"Calibrated speed: {self.speed} ({self.calibratedState})")
+      try :
+        with open(self.speedPath + '.tmp', 'w') as speedFile :
+          json.dump({
+            'speed'      : self.speed,
+            'state'      : self.calibratedState,
+            'calibrated' : self.lastCalibration
+          }, speedFile)
+        os.replace(self.speedPath + '.tmp', self.speedPath)
+      except OSError as err :
+        print(f"Could not persist the calibrated speed: {err}")
+
+  def checkCalibration(self, aSample) :
+    """
+    Calibrate this host's speed if it has not yet been calibrated, or
+    re-calibrate it if its hardware conditions have changed or the
+    `recalibrateInterval` has elapsed (but only if the host is not too busy).
+    """
+    if self.recalibrateInterval <= 0 : return
+    sinceCalibration = time.time() - self.lastCalibration
+    if self.speed is not None and \
+      sinceCalibration < min(60, self.recalibrateInterval) : return
+    if self.numCpus / 2 < aSample['wlNow'] : return
+    self.loadSpeed()
+    sinceCalibration = time.time() - self.lastCalibration
+    if self.speed is None or \
+      self.recalibrateInterval < sinceCalibration or \
+      hardwareState() != self.calibratedState :
+      self.calibrate()
+
+  def smooth(self, oldValue, newValue) :
+    if oldValue is None : return float(newValue)
+    return oldValue + self.smoothing * (newValue - oldValue)
+
+  def sample(self) :
+    """
+    Return a new sample (dict) of this host's load information.
+    """
+    now     = time.monotonic()
+    elapsed = max(now - self.lastTime, 1e-6)
+    self.lastTime = now
+    self.numCpus  = os.cpu_count()   # (cpus may be taken off/on line)
+
+    wlOne, wlFive, wlFifteen = os.getloadavg()
+    memTotal, memAvailable   = memoryInfo()
+    aSample = {
+      'numCpus'      : self.numCpus,
+      'wlOne'        : wlOne,
+      'wlFive'       : wlFive,
+      'wlFifteen'    : wlFifteen,
+      'wlNow'        : wlOne,
+      'memTotal'     : memTotal,
+      'memAvailable' : memAvailable
+    }
+
+    cpuTimes = self.cpuTimes()
+    if cpuTimes and self.lastCpu and self.lastCpu[1] < cpuTimes[1] :
+      aSample['cpuUtil'] = round(
+        (cpuTimes[0] - self.lastCpu[0]) / (cpuTimes[1] - self.lastCpu[1]), 3
+      )
+    self.lastCpu = cpuTimes
+
+    processCounts = self.processCounts()
+    if processCounts :
+      self.runnable = self.smooth(self.runnable, processCounts[0])
+      self.blocked  = self.smooth(self.blocked, processCounts[1])
+      aSample['runnable'] = round(self.runnable, 2)
+      aSample['blocked']  = round(self.blocked, 2)
+
+    if 'cpuUtil' in aSample and 'runnable' in aSample :
+      aSample['wlNow'] = round(max(
+        aSample['cpuUtil'] * self.numCpus,
+        aSample['runnable'] + aSample['blocked']
+      ), 2)
+
+    for aResource in self.pressureResources :
+      aTotal = pressureTotal(aResource)
+      lastTotal = self.lastPressure[aResource]
+      self.lastPressure[aResource] = aTotal
+      if aTotal is None or lastTotal is None : continue
+      aKey = 'psi' + aResource.capitalize()
+      aSample[aKey] = round(
+        min((aTotal - lastTotal) / (elapsed * 1000000), 1.0), 3
+      )
+
+    someDisks = diskCounters(self.disks)
+    if someDisks :
+      sectorsRead    = 0
+      sectorsWritten = 0
+      diskBusy       = 0
+      for aDisk, someCounters in someDisks.items() :
+        if aDisk not in self.lastDisks : continue
+        lastCounters = self.lastDisks[aDisk]
+        sectorsRead    += someCounters[0] - lastCounters[0]
+        sectorsWritten += someCounters[1] - lastCounters[1]
+        diskBusy = max(diskBusy, someCounters[2] - lastCounters[2])
+      # (diskstats sectors are always 512 bytes)
+      aSample['diskRead']  = round(sectorsRead * 512 / (elapsed * 1048576), 3)
+      aSample['diskWrite'] = round(sectorsWritten * 512 / (elapsed * 1048576), 3)
+      aSample['diskBusy']  = round(min(diskBusy / (elapsed * 1000), 1.0), 3)
+    self.lastDisks = someDisks
+
+    someNetwork = networkCounters()
+    if someNetwork and self.lastNetwork :
+      aSample['netRx'] = round(
+        (someNetwork[0] - self.lastNetwork[0]) / (elapsed * 1048576), 3
+      )
+      aSample['netTx'] = round(
+        (someNetwork[1] - self.lastNetwork[1]) / (elapsed * 1048576), 3
+      )
+    self.lastNetwork = someNetwork
+
+    someSwap = swapCounters()
+    if someSwap and self.lastSwap :
+      aSample['swapIn']  = round((someSwap[0] - self.lastSwap[0]) / elapsed, 1)
+      aSample['swapOut'] = round((someSwap[1] - self.lastSwap[1]) / elapsed, 1)
+    self.lastSwap = someSwap
+    swapSpace = swapUsed()
+    if swapSpace is not None : aSample['swapUsed'] = swapSpace
+
+    self.checkCalibration(aSample)
+    if self.speed is not None : aSample['speed'] = self.speed
+
+    return aSample
+
+def changedMetrics(lastSample, aSample, threshold) :
+  """
+  Return the list of the keys of `aSample` whose values have changed (since
+  the `lastSample`) by more than the (relative) `threshold`. Small values
+  (below one) are compared absolutely.
+  """
+  someKeys = []
+  for aKey, aValue in aSample.items() :
+    if aKey not in lastSample :
+      someKeys.append(aKey)
+      continue
+    lastValue = lastSample[aKey]
+    if threshold * max(abs(lastValue), 1.0) < abs(aValue - lastValue) :
+      someKeys.append(aKey)
+  return someKeys
@@ -1,6 +1,11 @@
 """
 Provide a regular source of load information so that the taskManager can do some
 rudementary load balancing.
+
+The load information is sampled using the `HostSampler` (see the `hostMetrics`
+"module").
+
+This "module" MUST be concatinated to the END of the `hostMetrics` "module".
 """
 
 import asyncio
@@ -8,6 +13,7 @@ import json
 import platform
 import os
 import sys
+import time
 
 def usage() :
   '''
@@ -21,6 +27,13 @@ optional arguments
   -p, --port     TaskManager port
   -s, --scale    Normalized load scaling factor
   -i, --interval Reporting interval (seconds)
+  -l, --load     Maximum (scaled) load for this host
+  -f, --fast     Sample the load every FAST seconds (for example 0.25)
+                 sending only the values which have changed (by more than
+                 the threshold), with a full report every interval
+  -t, --threshold The relative change which is reported (default 0.2)
+  -c, --calibrate Re-calibrate this host's speed every CALIBRATE seconds
+                 (default 3600, 0 disables the calibration)
       --help     Show this help message and exit
 
   '''
@@ -32,6 +45,14 @@ def runMonitor() :
   """
   Connect to the specified task manager and provide load information every
   reporting interval (seconds).
+
+  In the fast mode the load is sampled every `fast` seconds, but only the
+  values which have changed significantly are sent (the taskManager merges
+  these into the last full report). A full report is still sent every
+  reporting interval as a keepalive.
+
+  Each report also includes this host's (calibrated) speed, which the
+  taskManager uses to give faster hosts proportionally more work.
   
   Among other things this acts as a heart beat for the computeFarm.
   """
@@ -41,6 +62,9 @@ def runMonitor() :
   wScale    = 0.8
   maxLoad   = 1.0
   rInterval = 60
+  sInterval = 0
+  threshold = 0.2
+  cInterval = 3600
 
   i = 1
   while i < len(sys.argv) :
@@ -61,6 +85,15 @@ def runMonitor() :
     elif anArg == '-l' or anArg == '--load' :
       maxLoad = float(sys.argv[i+1])
       i += 1
+    elif anArg == '-f' or anArg == '--fast' :
+      sInterval = float(sys.argv[i+1])
+      i += 1
+    elif anArg == '-t' or anArg == '--threshold' :
+      threshold = float(sys.argv[i+1])
+      i += 1
+    elif anArg == '-c' or anArg == '--calibrate' :
+      cInterval = int(sys.argv[i+1])
+      i += 1
     elif anArg == '-h' or anArg == '--help' :
       usage()
     i += 1
@@ -70,6 +103,9 @@ def runMonitor() :
   print(f"          Scale: {wScale}")
   print(f"       Max Load: {maxLoad}")
   print(f"Report interval: {rInterval}")
+  if 0 < sInterval :
+    print(f"Sample interval: {sInterval}")
+    print(f"      Threshold: {threshold}")
 
   async def workLoadMonitor(tmHost, thPort, wScale, rInterval) :
     for attempt in range(60) :
@@ -103,37 +139,54 @@ def runMonitor() :
     writer.write(b"\n")
     await writer.drain()
 
-    numCpus = os.cpu_count()
+    sampler    = HostSampler(recalibrateInterval=cInterval)
+    lastSent   = {}
+    lastReport = None
 
     while True :
-      wlOne, wlFive, wlFifteen = os.getloadavg()
-
-      normOne = wlOne/(numCpus*wScale)
-      normFive = wlFive/(numCpus*wScale)
-      normFifteen = wlFifteen/(numCpus*wScale)
-
-      print(f"               Num CPUs: {numCpus}")
-      print(f"    One minute workload: {wlOne} ({wlOne/numCpus}) <{normOne}>")
-      print(f"   Five minute workload: {wlFive} ({wlFive/numCpus}) <{normFive}>")
-      print(f"Fifteen minute workload: {wlFifteen} ({wlFifteen/numCpus}) <{normFifteen}>")
-
-      print("Sending workload update")
-      writer.write(json.dumps({
-        'type'      : 'monitor',
-        'host'      : hostName,
-        'numCpus'   : numCpus,
-        'wlOne'     : wlOne,
-        'wlFive'    : wlFive,
-        'wlFifteen' : wlFifteen,
-        'scale'     : wScale
-      }).encode())
+      aSample = sampler.sample()
+      now     = time.monotonic()
+
+      if 0 < sInterval and lastReport and now - lastReport < rInterval :
+        # only send the values which have changed significantly
+        someKeys = changedMetrics(lastSent, aSample, threshold)
+        if not someKeys :
+          await asyncio.sleep(sInterval)
+          continue
+        anUpdate = { aKey : aSample[aKey] for aKey in someKeys }
+        print(f"Sending workload changes: {anUpdate}")
+      else :
+        numCpus     = aSample['numCpus']
+        wlOne       = aSample['wlOne']
+        wlFive      = aSample['wlFive']
+        wlFifteen   = aSample['wlFifteen']
+        normOne     = wlOne/(numCpus*wScale)
+        normFive    = wlFive/(numCpus*wScale)
+        normFifteen = wlFifteen/(numCpus*wScale)
+        print(f"               Num CPUs: {numCpus}")
+        print(f"    One minute workload: {wlOne} ({wlOne/numCpus}) <{normOne}>")
+        print(f"   Five minute workload: {wlFive} ({wlFive/numCpus}) <{normFive}>")
+        print(f"Fifteen minute workload: {wlFifteen} ({wlFifteen/numCpus}) <{normFifteen}>")
+        print(f" Instantaneous workload: {aSample['wlNow']}")
+        print(f"             Host speed: {aSample.get('speed', 'uncalibrated')}")
+        print(f"       Available memory: {aSample['memAvailable']} of {aSample['memTotal']} MB")
+        print("Sending workload update")
+        anUpdate = dict(aSample)
+        anUpdate['scale'] = wScale
+        lastReport = now
+
+      lastSent.update(anUpdate)
+      anUpdate['type'] = 'monitor'
+      anUpdate['host'] = hostName
+      writer.write(json.dumps(anUpdate).encode())
       writer.write(b"\n")
+      sys.stdout.flush()
       try :
         await writer.drain()
       except :
         break
 
-      await asyncio.sleep(rInterval)
+      await asyncio.sleep(sInterval if 0 < sInterval else rInterval)
 
     # close things down
     try :
@@ -3,16 +3,24 @@
  run that task sending the output back to the taskManager (over the open tcp
  channel).
 
+ This "module" MUST be concatinated AFTER the `hostMetrics` "module" (which
+ is used to report the host's load, see `loadReports`).
+
  Initial interaction with the taskManager is via JSON RPC over a single open tcp
  channel.
 
 """
 
 import asyncio
+import glob
+import hashlib
 import importlib
 import json
 import os
 import platform
+import resource
+import shutil
+import signal
 import sys
 import tempfile
 import time
@@ -38,6 +46,285 @@ options:
   print(usage.__doc__)
   sys.exit(1)
 
+def taskResources(startTime) :
+  """
+  Return a (JSON-able) dict of the resources used by the task's process tree.
+
+  Since each worker process runs exactly one task, the `RUSAGE_CHILDREN`
+  resource usage of this process is the resource usage of all of the
+  (waited for) processes started by the task.
+
+  - wallTime            : elapsed (wall clock) time (seconds)
+  - userTime            : user CPU time (seconds)
+  - sysTime             : system CPU time (seconds)
+  - offCpuTime          : wall time not spent on a CPU (seconds; for single
+                          threaded tasks this is mostly time spent waiting for
+                          (sshfs) I/O)
+  - maxRss              : peak resident set size of the largest process (MB)
+  - inBlocks            : block input operations
+  - outBlocks           : block output operations
+  - voluntarySwitches   : voluntary context switches (mostly waiting for I/O)
+  - involuntarySwitches : involuntary context switches (mostly CPU contention)
+  """
+  wallTime = time.monotonic() - startTime
+  usage    = resource.getrusage(resource.RUSAGE_CHILDREN)
+  maxRss   = usage.ru_maxrss / 1024         # KB on Linux...
+  if sys.platform == 'darwin' : maxRss /= 1024 # ... but bytes on MacOS
+  return {
+    'wallTime'            : round(wallTime, 3),
+    'userTime'            : round(usage.ru_utime, 3),
+    'sysTime'             : round(usage.ru_stime, 3),
+    'offCpuTime'          :
+      round(max(wallTime - usage.ru_utime - usage.ru_stime, 0), 3),
+    'maxRss'              : round(maxRss, 1),
+    'inBlocks'            : usage.ru_inblock,
+    'outBlocks'           : usage.ru_oublock,
+    'voluntarySwitches'   : usage.ru_nvcsw,
+    'involuntarySwitches' : usage.ru_nivcsw
+  }
+
+def killTask(proc) :
+  """
+  Kill the task's (still running) process together with any processes it has
+  started (the task is run in its own process group).
+  """
+  if proc is None or proc.returncode is not None : return
+  try :
+    os.killpg(proc.pid, signal.SIGKILL)
+  except ProcessLookupError :
+    pass
+
+async def killWhenAbandoned(reader, proc) :
+  """
+  Kill the task's process if the taskManager closes the connection while the
+  task is running (the taskManager abandons the losing run of a
+  speculatively duplicated task this way).
+  """
+  try :
+    while await reader.read(4096) : pass
+  except ConnectionError :
+    pass
+  print("The taskManager has abandoned the task... killing it")
+  killTask(proc)
+
+def blobCachePath(cacheDir, aHash) :
+  """
+  Return the path of the blob `aHash` in the local blob cache `cacheDir`.
+  """
+  return os.path.join(cacheDir, aHash[:2], aHash[2:])
+
+def scratchPath(scratchDir, aPath) :
+  """
+  Return the path of the (relative) task path `aPath` in the task's scratch
+  directory (refusing any path which would escape the scratch directory).
+  """
+  scratchPath = os.path.normpath(os.path.join(scratchDir, aPath))
+  if not scratchPath.startswith(scratchDir + os.sep) :
+    raise ValueError(f"The path {aPath} is not inside the scratch directory")
+  return scratchPath
+
+def materialiseInputs(tmConfig, cacheDir, scratchDir, inputBlobs) :
+  """
+  Fetch (in bulk) those of the task's `inputBlobs` which are not already in
+  the local blob cache, and then place each input at its (relative) path in
+  the task's scratch directory.
+
+  The cached blobs are read only, so the inputs are hard linked (rather than
+  copied) whenever possible.
+  """
+  missing = [
+    aHash for aHash in set(inputBlobs.values())
+      if not os.path.exists(blobCachePath(cacheDir, aHash))
+  ]
+  if missing :
+    fetched = tcpTMGetBlobs(
+      tmConfig, missing, lambda aHash : blobCachePath(cacheDir, aHash), False
+    )
+    for aHash in fetched : os.chmod(blobCachePath(cacheDir, aHash), 0o444)
+    if len(fetched) < len(missing) :
+      raise FileNotFoundError(
+        f"Could not fetch the input blobs {sorted(set(missing)-set(fetched))}"
+      )
+  for aPath, aHash in inputBlobs.items() :
+    inputPath = scratchPath(scratchDir, aPath)
+    os.makedirs(os.path.dirname(inputPath), exist_ok=True)
+    cachePath = blobCachePath(cacheDir, aHash)
+    try :
+      os.link(cachePath, inputPath)
+    except OSError :
+      shutil.copyfile(cachePath, inputPath)
+    os.utime(cachePath)  # this blob has been (recently) used
+
+def writeInlineInputs(scratchDir, inlineInputs) :
+  """
+  Write each of the task's (small) `inlineInputs` to its (relative) path in
+  the task's scratch directory.
+  """
+  for aPath, aPayload in inlineInputs.items() :
+    writeInlinePayload(scratchPath(scratchDir, aPath), aPayload)
+
+def returnOutputs(tmConfig, scratchDir, outputs) :
+  """
+  Return those of the task's `outputs` which exist, as a dict of the (small)
+  `inlineOutputs` (their compressed contents) and a dict of the `outputBlobs`
+  (their hashes, once they have been uploaded to the taskManager's blob
+  store). Both dicts are indexed by the outputs' relative paths.
+  """
+  somePaths = {}
+  for aPath in outputs :
+    outputPath = scratchPath(scratchDir, aPath)
+    if os.path.isfile(outputPath) : somePaths[outputPath] = aPath
+  inlinePaths, blobPaths = splitInlineFiles(somePaths.keys())
+  inlineOutputs = {
+    somePaths[aPath] : inlinePayload(aPath) for aPath in inlinePaths
+  }
+  outputBlobs = {}
+  if blobPaths :
+    someHashes = tcpTMPutBlobs(tmConfig, blobPaths, False)
+    if someHashes is not None :
+      outputBlobs = {
+        somePaths[aPath] : aHash for aPath, aHash in someHashes.items()
+      }
+  return inlineOutputs, outputBlobs
+
+def trimCache(cacheDir, maxBytes) :
+  """
+  Remove the least recently used files from the local cache `cacheDir` (the
+  blob cache or the artifact cache) until the cache uses no more than
+  `maxBytes`.
+  """
+  someBlobs  = []
+  totalBytes = 0
+  for aDir, someDirs, someFiles in os.walk(cacheDir) :
+    for aFile in someFiles :
+      aPath = os.path.join(aDir, aFile)
+      try :
+        aStat = os.stat(aPath)
+      except OSError :
+        continue
+      someBlobs.append((aStat.st_mtime, aStat.st_size, aPath))
+      totalBytes += aStat.st_size
+  if totalBytes <= maxBytes : return
+  for mtime, size, aPath in sorted(someBlobs) :
+    if totalBytes <= maxBytes : break
+    try :
+      os.remove(aPath)
+      totalBytes -= size
+    except OSError :
+      pass
+
+def artifactCachePath(cacheDir, anAffinity) :
+  """
+  Return the directory, in the local artifact cache, which holds the
+  artifacts of the document `anAffinity`.
+  """
+  return os.path.join(cacheDir, hashlib.sha256(anAffinity.encode()).hexdigest())
+
+def restoreArtifacts(cacheDir, anAffinity, taskDir) :
+  """
+  Copy the artifacts cached for the document `anAffinity` into the task's
+  directory (unless the task's directory already holds a newer copy, for
+  example one written by a later run on another host). Returns the number of
+  artifacts restored.
+  """
+  docDir = artifactCachePath(cacheDir, anAffinity)
+  if not os.path.isdir(docDir) : return 0
+  restored = 0
+  for aName in os.listdir(docDir) :
+    cachedPath = os.path.join(docDir, aName)
+    taskPath   = os.path.join(taskDir, aName)
+    try :
+      if os.path.exists(taskPath) and \
+        os.path.getmtime(cachedPath) <= os.path.getmtime(taskPath) :
+        continue
+      shutil.copy2(cachedPath, taskPath)
+      os.utime(cachedPath)  # this artifact has been (recently) used
+      restored += 1
+    except OSError :
+      pass
+  return restored
+
+def saveArtifacts(cacheDir, anAffinity, taskDir, somePatterns) :
+  """
+  Replace the artifacts cached for the document `anAffinity` with the files
+  in the task's directory which match one of the (glob) `somePatterns`.
+  """
+  docDir = artifactCachePath(cacheDir, anAffinity)
+  os.makedirs(docDir, exist_ok=True)
+  someNames = set()
+  for aPattern in somePatterns :
+    for aPath in glob.glob(os.path.join(glob.escape(taskDir), aPattern)) :
+      if os.path.isfile(aPath) : someNames.add(os.path.basename(aPath))
+  for aName in os.listdir(docDir) :
+    if aName not in someNames : os.remove(os.path.join(docDir, aName))
+  for aName in someNames :
+    shutil.copyfile(os.path.join(taskDir, aName), os.path.join(docDir, aName))
+
+# the most output lines stored with a cached task
+maxCachedLogLines = 1000
+
+def cachedLogMsg(taskRequest, aLogMsg, logParserFunc) :
+  """
+  Return the log message to replay for the cached log entry `aLogMsg` (the
+  message parsed when the task was run, or the raw output line stored in an
+  older entry).
+  """
+  if isinstance(aLogMsg, str) : return logParserFunc(taskRequest, aLogMsg)
+  aLogMsg = dict(aLogMsg)
+  aLogMsg['name'] = taskRequest['taskName']
+  return aLogMsg
+
+def taskCacheKey(taskCacheFunc, taskRequest, taskDir, taskEnv) :
+  """
+  Return the (cache key, outputs) computed by the `taskCache` plugin for the
+  task `taskRequest` (or (None, None) if the task can not be cached).
+  """
+  try :
+    cacheInfo = taskCacheFunc(taskRequest, taskDir, taskEnv)
+  except Exception :
+    print("The taskCache plugin failed")
+    print(traceback.format_exc())
+    cacheInfo = None
+  if not cacheInfo : return None, None
+  return cacheInfo
+
+def restoreCachedTask(tmConfig, cacheKey, taskDir) :
+  """
+  Look up the task's `cacheKey` in the taskManager's action cache and, on a
+  hit, fetch the cached outputs into the task's directory. Returns the cache
+  entry (or None on a miss, or if the outputs could not all be fetched).
+  """
+  anEntry = tcpTMCacheGet(tmConfig, cacheKey, False)
+  if not anEntry : return None
+  somePaths = {}
+  for aPath, aHash in anEntry['outputs'].items() :
+    somePaths.setdefault(aHash, []).append(os.path.join(taskDir, aPath))
+  fetched = tcpTMGetBlobs(
+    tmConfig, somePaths.keys(), lambda aHash : somePaths[aHash][0], False
+  )
+  if len(fetched) < len(somePaths) : return None
+  for aHash in fetched :
+    for aPath in somePaths[aHash][1:] :
+      shutil.copyfile(somePaths[aHash][0], aPath)
+  return anEntry
+
+def storeCachedTask(tmConfig, cacheKey, taskDir, outputs, taskLog) :
+  """
+  Upload the outputs of a successful task to the taskManager's blob store and
+  then store the task's entry (its log and outputs) in the action cache.
+  """
+  somePaths = { os.path.join(taskDir, aPath) : aPath for aPath in outputs }
+  if not all(os.path.isfile(aPath) for aPath in somePaths) : return False
+  someHashes = tcpTMPutBlobs(tmConfig, somePaths.keys(), False)
+  if someHashes is None : return False
+  return tcpTMCachePut(tmConfig, cacheKey, {
+    'returncode' : 0,
+    'log'        : taskLog[:maxCachedLogLines],
+    'outputs'    : {
+      somePaths[aPath] : aHash for aPath, aHash in someHashes.items()
+    }
+  }, False)
+
 def runWorker() :
   """
   Run a single worker by opening a tcp connection to the taskManager, register
@@ -45,7 +332,35 @@ def runWorker() :
   and then wait for a return JSON RPC message detailing the task.
 
   Run the requested task and send back the task command's output/stderr in
-  semi-realtime.
+  semi-realtime, followed by the task's returncode and the resources used by
+  the task (see `taskResources`).
+
+  If this worker has a `taskCache` plugin, the plugin computes a cache key for
+  each task (together with the task's outputs). If the taskManager's action
+  cache holds an entry for this key, the cached outputs are fetched and the
+  cached (parsed) log messages are replayed, without running the task at all
+  (the final message then contains `cached: True`). Otherwise the task is run
+  and, if it succeeds, its outputs and parsed log messages are stored in the
+  action cache.
+
+  A task which has `inputBlobs`, `inlineInputs` or `outputs` is run in a fresh
+  scratch directory (rather than in its `dir`). Its `inputBlobs` are fetched
+  from the taskManager's blob store (unless they are in the local blob cache)
+  and, together with its (small) `inlineInputs`, placed in the scratch
+  directory before the task is run. Once the task has finished, its small
+  `outputs` are sent back inline (as the `inlineOutputs` of the final
+  message) and the others are uploaded to the blob store (and their hashes are
+  sent back as the `outputBlobs` of the final message). The scratch directory
+  is then removed.
+
+  If this worker has an `artifactCache`, the intermediate files (for example
+  ConTeXt's `.tuc` files) kept from this host's last successful run of the
+  task's document (its `affinity`) are restored into the task's directory
+  before the task is run, and replaced by the new ones once it succeeds.
+
+  If the taskManager closes the connection while the task is running (for
+  example, to abandon the losing run of a speculatively duplicated task), the
+  task's process group is killed (see `killWhenAbandoned`).
 
   Once the task has been completed, exit and let the systemctl restart a new
   worker.
@@ -62,6 +377,10 @@ def runWorker() :
   - logParser: (the (python) log parser to use to parse the task's command
                 output)
 
+  - taskCache: (optional, the (python) plugin whose `cacheKey(taskRequest,
+                taskDir, taskEnv)` function returns the (cache key, list of
+                output paths) of a cacheable task, or None)
+
   - workerType: (the name/type of this worker)
 
   - availableTools: (a set of commands which this worker understands/supports)
@@ -75,6 +394,37 @@ def runWorker() :
 
   - verbose: (a boolean which if True ensures the worker's actions are logged as
               well as the task's command output)
+
+  - blobCache: (the directory of the local blob cache, default
+                ~/.local/pyComputeFarm/blobCache)
+
+  - blobCacheSize: (the size, in MB, of the local blob cache, default 1024)
+
+  - loadReports: (optional, if present this worker reports its host's load to
+                  the taskManager over its own connection, so that a separate
+                  monitor is not required)
+      interval:  (the full reporting interval in seconds, default 60)
+
+      sample:    (the sampling interval in seconds, default 1)
+
+      threshold: (the relative change which is reported, default 0.2)
+
+      scale:     (the normalized load scaling factor, default 0.8)
+
+      maxLoad:   (the maximum (scaled) load for this host, default 1.0)
+
+      calibrate: (the re-calibration interval in seconds, default 3600)
+
+  - artifactCache: (optional, if present this worker keeps a local cache of
+                    the intermediate files of each document, identified by
+                    the task's `affinity`, so that a later run of the same
+                    document on this host starts from them)
+      patterns: (the (glob) patterns of the intermediate files kept)
+
+      path:     (the directory of the cache, default
+                 ~/.local/pyComputeFarm/artifactCache)
+
+      maxSize:  (the size, in MB, of the cache, default 1024)
   """
 
   for anArg in sys.argv :
@@ -133,6 +483,17 @@ def runWorker() :
     print("Using the default logParser")
     logParserFunc = defaultLogParser
 
+  taskCacheFunc = None
+  if 'taskCache' in config :
+    try :
+      thePlugin = importlib.import_module(config['taskCache'])
+      if thePlugin and hasattr(thePlugin, 'cacheKey') :
+        print(f"Using taskCache loaded from {config['taskCache']}")
+        taskCacheFunc = thePlugin.cacheKey
+    except Exception :
+      print(f"Could not load taskCache from [{config['taskCache']}]")
+      print(traceback.format_exc())
+
   if 'availableTools' not in config :
     config['availableTools'] = {}
 
@@ -145,6 +506,40 @@ def runWorker() :
   if 'workerName' not in config :
     config['workerName'] = config['workerType']
 
+  if 'blobCache' not in config :
+    config['blobCache'] = '~/.local/pyComputeFarm/blobCache'
+  config['blobCache'] = os.path.abspath(os.path.expanduser(config['blobCache']))
+  if 'blobCacheSize' not in config :
+    config['blobCacheSize'] = 1024
+
+  loadReports = config.get('loadReports')
+  if loadReports is not None :
+    if not isinstance(loadReports, dict) : loadReports = {}
+    for aKey, aDefault in {
+      'interval'  : 60,
+      'sample'    : 1,
+      'threshold' : 0.2,
+      'scale'     : 0.8,
+      'maxLoad'   : 1.0,
+      'calibrate' : 3600
+    }.items() :
+      if aKey not in loadReports : loadReports[aKey] = aDefault
+    config['loadReports'] = loadReports
+
+  artifactCache = config.get('artifactCache')
+  if artifactCache is not None :
+    if not isinstance(artifactCache, dict) : artifactCache = {}
+    for aKey, aDefault in {
+      'patterns' : [],
+      'path'     : '~/.local/pyComputeFarm/artifactCache',
+      'maxSize'  : 1024
+    }.items() :
+      if aKey not in artifactCache : artifactCache[aKey] = aDefault
+    artifactCache['path'] = os.path.abspath(
+      os.path.expanduser(artifactCache['path'])
+    )
+    config['artifactCache'] = artifactCache
+
   if 'verbose' in config :
     print("Worker configuration:\n---")
     print(yaml.dump(config))
@@ -159,6 +554,43 @@ def runWorker() :
     writer.write(b'\n')
     await writer.drain()
 
+  async def reportLoad(writer, loadReports) :
+    """
+    Report this host's load to the taskManager (as `load` messages) until
+    cancelled.
+
+    The load is sampled every `sample` seconds, but only the values which have
+    changed significantly are sent, with a full report every `interval`
+    seconds.
+
+    The host's speed is the one persisted by the host's samplers (so a
+    restarted worker does not re-run the calibration, see `HostSampler`).
+    The samples are taken in a thread, since a sample may (re)calibrate the
+    host's speed, which must not block the task's log messages.
+    """
+    sampler    = HostSampler(recalibrateInterval=loadReports['calibrate'])
+    lastSent   = {}
+    lastReport = None
+    while True :
+      aSample = await asyncio.to_thread(sampler.sample)
+      now     = time.monotonic()
+      if lastReport and now - lastReport < loadReports['interval'] :
+        someKeys = changedMetrics(lastSent, aSample, loadReports['threshold'])
+        anUpdate = { aKey : aSample[aKey] for aKey in someKeys }
+      else :
+        anUpdate = dict(aSample)
+        anUpdate['scale'] = loadReports['scale']
+        lastReport = now
+      if anUpdate :
+        lastSent.update(anUpdate)
+        # the message is written in one go so that it can not be interleaved
+        # with the task's log messages
+        writer.write(json.dumps(
+          { 'type' : 'load', 'host' : hostName, **anUpdate }
+        ).encode() + b"\n")
+        await writer.drain()
+      await asyncio.sleep(loadReports['sample'])
+
   async def tcpWorker(config) :
     workerType = config['workerType']
     print(f"Starting [{workerType}] worker")
@@ -167,7 +599,8 @@ def runWorker() :
       try :
         reader, writer = await asyncio.open_connection(
           config['taskManager']['host'],
-          int(config['taskManager']['port'])
+          int(config['taskManager']['port']),
+          limit=16 * 1024 * 1024  # (a taskRequest may carry inline files)
         )
         print(f"Connected to taskManager on the {attempt} attempt")
         sys.stdout.flush()
@@ -186,23 +619,46 @@ def runWorker() :
 
     # send task specialty
     print("Sending task description to taskManager")
-    writer.write(json.dumps({
+    workerDescription = {
       'type'           : 'worker',
       'taskType'       : workerType,
       'host'           : hostName,
       'workerName'     : workerName,
-      'availableTools' : config['availableTools']
-    }).encode())
+      'availableTools' : config['availableTools'],
+      'heartbeat'      : True
+    }
+    loadReports = config.get('loadReports')
+    if loadReports :
+      workerDescription['reportLoad'] = {
+        'platform' : platform.system().lower(),
+        'cpuType'  : platform.machine().lower(),
+        'maxLoad'  : loadReports['maxLoad']
+      }
+    writer.write(json.dumps(workerDescription).encode())
     await writer.drain()
     writer.write(b"\n")
     await writer.drain()
 
-    # wait for task request
+    loadReporter = None
+    if loadReports :
+      loadReporter = asyncio.create_task(reportLoad(writer, loadReports))
+
+    # wait for task request (answering any heartbeat pings while we wait)
     print("Waiting for responses...")
-    taskRequestJson = await reader.readuntil()
     taskRequest = {}
-    if taskRequestJson :
+    while True :
+      try :
+        taskRequestJson = await reader.readuntil()
+      except asyncio.IncompleteReadError :
+        print("The taskManager closed the connection")
+        break
       taskRequest = json.loads(taskRequestJson.decode())
+      if 'type' in taskRequest and taskRequest['type'] == 'ping' :
+        writer.write(json.dumps({ 'type' : 'pong' }).encode())
+        writer.write(b"\n")
+        await writer.drain()
+        continue
+      break
 
     if 'type' in taskRequest and taskRequest['type'] == 'taskRequest' :
       if 'taskName' not in taskRequest :
@@ -218,6 +674,14 @@ def runWorker() :
       if 'dir' in taskRequest and taskRequest['dir'] :
         taskDir = taskRequest['dir']
 
+      inputBlobs   = taskRequest.get('inputBlobs') or {}
+      inlineInputs = taskRequest.get('inlineInputs') or {}
+      outputs      = taskRequest.get('outputs') or []
+      scratchDir   = None
+      if inputBlobs or inlineInputs or outputs :
+        scratchDir = tempfile.mkdtemp(prefix='cfdoit-scratch-')
+        taskDir    = scratchDir
+
       taskEnv = None
       if ('env' in taskRequest and
          taskRequest['env'] and
@@ -259,36 +723,116 @@ def runWorker() :
         print("current working dir:")
         print(yaml.dump(os.getcwd()))
 
+      proc = None
       try :
-        proc = await asyncio.create_subprocess_exec(
-          taskCmd,
-          stdout=asyncio.subprocess.PIPE,
-          stderr=asyncio.subprocess.STDOUT,
-          cwd=taskDir,
-          env=taskEnv
-        )
-
-        ###################################################################
-        # echo results
-        if 'verbose' in config :
-          print("Process stdout/stderr: ")
-        procStdOut = proc.stdout
-        while not procStdOut.at_eof() :
-          aLine = await procStdOut.readline()
-          aLine = aLine.decode().strip()
-          print(f'Sending: [{aLine}]')
-          logMsg = logParserFunc(taskRequest, aLine)
-          print(yaml.dump(logMsg))
-          await jsonLog(writer, logMsg)
-        await proc.wait()
-        print(f"Finished task for [{workerType}] returncode = {proc.returncode}")
+        startTime = time.monotonic()
+        if inputBlobs :
+          await asyncio.to_thread(
+            materialiseInputs,
+            config['taskManager'], config['blobCache'], scratchDir, inputBlobs
+          )
+        if inlineInputs :
+          writeInlineInputs(scratchDir, inlineInputs)
+
+        anAffinity = None
+        if artifactCache and taskRequest.get('affinity') :
+          anAffinity = str(taskRequest['affinity'])
+          restored = await asyncio.to_thread(
+            restoreArtifacts, artifactCache['path'], anAffinity, taskDir
+          )
+          print(f"Restored {restored} cached artifacts of {anAffinity}")
+
+        cacheKey   = None
+        cacheEntry  = None
+        if taskCacheFunc :
+          cacheKey, cacheOutputs = await asyncio.to_thread(
+            taskCacheKey, taskCacheFunc, taskRequest, taskDir, taskEnv
+          )
+        if cacheKey :
+          cacheEntry = await asyncio.to_thread(
+            restoreCachedTask, config['taskManager'], cacheKey, taskDir
+          )
+
+        if cacheEntry :
+          ###################################################################
+          # replay the cached results
+          print(f"Using the cached results of {cacheKey}")
+          for aLogMsg in cacheEntry['log'] :
+            await jsonLog(
+              writer, cachedLogMsg(taskRequest, aLogMsg, logParserFunc)
+            )
+          returncode = cacheEntry['returncode']
+        else :
+          proc = await asyncio.create_subprocess_exec(
+            taskCmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            cwd=taskDir,
+            env=taskEnv,
+            start_new_session=True
+          )
+          abandonWatcher = asyncio.create_task(killWhenAbandoned(reader, proc))
+
+          ###################################################################
+          # echo results
+          if 'verbose' in config :
+            print("Process stdout/stderr: ")
+          taskLog    = []
+          procStdOut = proc.stdout
+          while not procStdOut.at_eof() :
+            aLine = await procStdOut.readline()
+            aLine = aLine.decode().strip()
+            print(f'Sending: [{aLine}]')
+            logMsg = logParserFunc(taskRequest, aLine)
+            if cacheKey :
+              # (store the parsed message, so that a stateful logParser's
+              # results are replayed exactly)
+              taskLog.append({
+                aKey : aValue for aKey, aValue in logMsg.items()
+                  if aKey != 'time'
+              })
+            print(yaml.dump(logMsg))
+            await jsonLog(writer, logMsg)
+          await proc.wait()
+          abandonWatcher.cancel()
+          returncode = proc.returncode
+          if reader.at_eof() :
+            raise ConnectionAbortedError("the taskManager abandoned the task")
+          if cacheKey and returncode == 0 :
+            await asyncio.to_thread(
+              storeCachedTask,
+              config['taskManager'], cacheKey, taskDir, cacheOutputs, taskLog
+            )
+          if anAffinity and returncode == 0 :
+            await asyncio.to_thread(
+              saveArtifacts, artifactCache['path'], anAffinity, taskDir,
+              artifactCache['patterns']
+            )
+            await asyncio.to_thread(
+              trimCache, artifactCache['path'],
+              artifactCache['maxSize'] * 1024 * 1024
+            )
+        print(f"Finished task for [{workerType}] returncode = {returncode}")
         msgDict = {
           'name'       : taskRequest['taskName'],
-          'msg'        : f"Task competed: {proc.returncode}",
-          'returncode' : proc.returncode
+          'msg'        : f"Task competed: {returncode}",
+          'returncode' : returncode,
+          'resources'  : taskResources(startTime)
         }
+        if cacheEntry : msgDict['cached'] = True
+        if outputs :
+          inlineOutputs, outputBlobs = await asyncio.to_thread(
+            returnOutputs, config['taskManager'], scratchDir, outputs
+          )
+          if inlineOutputs : msgDict['inlineOutputs'] = inlineOutputs
+          if outputBlobs   : msgDict['outputBlobs']   = outputBlobs
         print(yaml.dump(msgDict))
         await jsonLog(writer, msgDict)
+      except ConnectionError as err :
+        # (the taskManager has closed the connection, for example to abandon
+        # the losing run of a speculatively duplicated task)
+        killTask(proc)
+        print(f"Abandoned the task ({err})")
       except Exception as err :
         msgDict =  {
           'level'      : 'critical',
@@ -299,9 +843,23 @@ def runWorker() :
         print(yaml.dump(msgDict))
         await jsonLog(writer, msgDict)
 
+      if scratchDir :
+        shutil.rmtree(scratchDir, ignore_errors=True)
+        trimCache(config['blobCache'], config['blobCacheSize'] * 1024 * 1024)
+
+    if loadReporter :
+      loadReporter.cancel()
+      try :
+        await loadReporter
+      except (asyncio.CancelledError, ConnectionError) :
+        pass
+
     print("Closing the connection")
     writer.close()
-    await writer.wait_closed()
+    try :
+      await writer.wait_closed()
+    except ConnectionError :
+      pass
 
   asyncio.run(tcpWorker(config))
 
@@ -3,11 +3,13 @@ Request a new task and then echo the results as they come back...
 
 To keep this script as self contained as possible, we use a fairly simple
 command line argument parser (consisting of `checkNextArg`, `popArg`,
-`popIntArg`, `setArg`, and `setEnv`)
+`popIntArg`, `appendArg`, `setArg`, and `setEnv`)
 
 This "module" MUST be concatinated to the END of the `taskManagerAccess` module.
 """
 
+import importlib
+
 def usage(optArgsList) :
   '''
 usage: newTask [options] -- taskName workerType [cmdWord ...]
@@ -20,7 +22,9 @@ positional arguments:
                           cutelogActions to categorize
                           any log information comming from
                           this task
-  workerType              Worker type
+  workerType              Worker type (or `any` to use any
+                          worker which provides the
+                          required tools)
   cmdWord                 Command for the worker to do
 
 options:
@@ -80,6 +84,71 @@ optArgsList.append({
   'msg' : "The required platform-cpu",
   'fnc' : lambda : popArg('requiredPlatform', taskRequest, optArgsList)
 })
+optArgsList.append({
+  'key' : [ '-T', '--tool' ],
+  'msg' : "A tool required by this task (may be repeated)",
+  'fnc' : lambda : appendArg('requiredTools', taskRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-c', '--cores' ],
+  'msg' : "The number of cores required by this task (default 1)",
+  'fnc' : lambda : popIntArg('cores', taskRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-M', '--memory' ],
+  'msg' : "The memory (MB) required by this task (default 0)",
+  'fnc' : lambda : popIntArg('memory', taskRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-I', '--input' ],
+  'msg' : "An input file read by this task (may be repeated)",
+  'fnc' : lambda : appendArg('inputs', taskRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-B', '--blob' ],
+  'msg' : "An input file sent (inline if small, otherwise through the blob store) to the task's scratch directory (may be repeated)",
+  'fnc' : lambda : appendArg('blobInputs', taskRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-O', '--output' ],
+  'msg' : "An output file returned (inline if small, otherwise through the blob store) from the task's scratch directory (may be repeated)",
+  'fnc' : lambda : appendArg('outputs', taskRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-A', '--affinity' ],
+  'msg' : "A key (for example a document's path) whose intermediate files the workers cache (the task is preferably sent to the host which last ran this key)",
+  'fnc' : lambda : popArg('affinity', taskRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-C', '--cache' ],
+  'msg' : "The taskCache plugin used to compute the task's cache key (so that the taskManager can answer a cached task without running it)",
+  'fnc' : lambda : popArg('taskCache', taskRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-s', '--shared' ],
+  'msg' : "Share the results of an identical task which is already pending or running (rather than running the task again, the default for idempotent tasks)",
+  'fnc' : lambda : setArg('shareable', True, taskRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-U', '--unshared' ],
+  'msg' : "Always run the task (even an idempotent task, rather than sharing the results of an identical task which is already pending or running)",
+  'fnc' : lambda : setArg('shareable', False, taskRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-i', '--idempotent' ],
+  'msg' : "The task may safely be run more than once (so the taskManager may speculatively duplicate it, on a faster host, if it straggles)",
+  'fnc' : lambda : setArg('idempotent', True, taskRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-X', '--tests' ],
+  'msg' : "A file listing (one per line) the tests of a test suite which the taskManager splits into shards (the command word `{tests}` is replaced by each shard's tests)",
+  'fnc' : lambda : popArg('testsFile', taskRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-S', '--shards' ],
+  'msg' : "The number of shards into which a test suite is split (default 4)",
+  'fnc' : lambda : popIntArg('shards', taskRequest, optArgsList)
+})
 optArgsList.append({
   'key' : [ '-d', '--dir' ],
   'msg' : "Task directory",
@@ -123,6 +192,43 @@ def remainingArgs(requestDict, optArgsList) :
     cmdLine.append(anArg)
   requestDict['actions'].append(cmdLine)
 
+def blobTaskPath(aPath) :
+  """
+  Return the (relative) path, in the task's scratch directory, of the local
+  (input or output) file `aPath`.
+  """
+  aPath = os.path.normpath(aPath)
+  if os.path.isabs(aPath) or aPath.startswith('..') :
+    return os.path.basename(aPath)
+  return aPath
+
+def taskCacheKey(taskRequest) :
+  """
+  Return the cache key computed by the `cacheKey` function of the taskCache
+  plugin named by the task's `taskCache` (or None if the plugin can not be
+  loaded, or the task can not be cached).
+  """
+  pluginName = taskRequest.pop('taskCache')
+  sys.path.append(os.path.expanduser('~/.local/pyComputeFarm/lib'))
+  try :
+    thePlugin = importlib.import_module(pluginName)
+  except Exception as err :
+    print(f"Could not load the taskCache plugin [{pluginName}] ({err})")
+    return None
+  taskEnv = None
+  if taskRequest['env'] :
+    taskEnv = dict(os.environ)
+    taskEnv.update(taskRequest['env'])
+  try :
+    cacheInfo = thePlugin.cacheKey(
+      taskRequest, taskRequest['dir'] or '.', taskEnv
+    )
+  except Exception as err :
+    print(f"The taskCache plugin [{pluginName}] failed ({err})")
+    return None
+  if not cacheInfo : return None
+  return cacheInfo[0]
+
 def runNewTask() :
   """
   Compile a JSON taskRequest structure from the command line arguments and then
@@ -134,7 +240,11 @@ def runNewTask() :
 
   print(f"Task name: {taskRequest['taskName']}")
   print(f"Task type: {taskRequest['taskType']}")
-  taskRequest['workers'] = [ taskRequest['taskType'] ]
+  if taskRequest['taskType'] != 'any' :
+    taskRequest['workers'] = [ taskRequest['taskType'] ]
+  elif 'requiredTools' not in taskRequest :
+    print("A task for `any` worker MUST require at least one tool")
+    usage(optArgsList)
   verbose = False
   if 'verbose' in taskRequest : verbose = taskRequest['verbose']
   if verbose :
@@ -142,10 +252,57 @@ def runNewTask() :
     print(yaml.dump(taskRequest))
     print("---")
 
-  tmSocket = tcpTMConnection(taskRequest, verbose)
-  if tmSocket :
-    if tcpTMSentRequest(taskRequest, tmSocket, verbose) :
-      workerReturnCode = tcpTMCollectResults(tmSocket, None, verbose)  
+  if 'testsFile' in taskRequest :
+    with open(taskRequest.pop('testsFile')) as testsFile :
+      taskRequest['tests'] = [
+        aLine.strip() for aLine in testsFile
+          if aLine.strip() and not aLine.startswith('#')
+      ]
+    taskRequest['type']    = 'testSuite'
+    taskRequest['command'] = taskRequest.pop('actions')[0]
+    print(f"Test suite of {len(taskRequest['tests'])} tests")
+
+  if 'taskCache' in taskRequest :
+    cacheKey = taskCacheKey(taskRequest)
+    if cacheKey : taskRequest['cacheKey'] = cacheKey
+    if verbose : print(f"Cache key: {cacheKey}")
+
+  if 'blobInputs' in taskRequest :
+    someFiles = {
+      blobTaskPath(aPath) : aPath for aPath in taskRequest.pop('blobInputs')
+    }
+    if not attachTaskInputs(taskRequest, taskRequest, someFiles, verbose) :
+      print("Could not send the input files to the blob store")
+      return 1
+  if 'outputs' in taskRequest :
+    taskRequest['outputs'] = [
+      blobTaskPath(aPath) for aPath in taskRequest['outputs']
+    ]
+
+  taskInfo = {}
+  workerReturnCode = tcpTMSubmitTask(taskRequest, None, verbose, taskInfo)
+  if workerReturnCode is None :
+    workerReturnCode = 1
+  else :
+    if taskInfo.get('result', {}).get('speculative') :
+      print("(the results of a speculative duplicate of the task)")
+    if verbose and 'resources' in taskInfo.get('result', {}) :
+      print("Resources used:\n---")
+      print(yaml.dump(taskInfo['result']['resources']))
+      print("---")
+    # (the outputs of a task which was not run in a scratch directory, but
+    # whose cached results were replayed by the taskManager, belong in the
+    # task's directory)
+    outputDir = '' if 'outputs' in taskRequest else taskRequest['dir']
+    missing = collectTaskOutputs(
+      taskRequest, taskInfo.get('result', {}),
+      lambda aPath : os.path.join(outputDir, aPath), verbose
+    )
+    if missing :
+      print(f"Could not fetch the output(s) {', '.join(missing)}")
+    someTests = taskInfo.get('result', {}).get('tests', {})
+    for aTest in someTests.get('failed', []) : print(f"FAILED:  {aTest}")
+    for aTest in someTests.get('missing', []) : print(f"MISSING: {aTest}")
 
   print(f"Return code: {workerReturnCode}")
   return workerReturnCode
@@ -15,6 +15,8 @@ def usage(optArgsList) :
 usage: queryWorkers [options]
 
 Ask the TaskManager for its current list of available workers and platforms
+(or, with the --task option, for the state of one task, or, with the --history
+option, for the recent load of one or all of the hosts)
 
 options:
 '''
@@ -69,6 +71,26 @@ optArgsList.append({
   'msg' : "Interval between information refresh (default 0 == no refresh)",
   'fnc' : lambda : popIntArg('interval', queryRequest, optArgsList)
 })
+optArgsList.append({
+  'key' : [ '-t', '--task' ],
+  'msg' : "Query the state of the task with this taskId",
+  'fnc' : lambda : popArg('taskId', queryRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-H', '--history' ],
+  'msg' : "Query the load history of this host (or `all` hosts)",
+  'fnc' : lambda : popArg('historyHost', queryRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-w', '--window' ],
+  'msg' : "The length (seconds) of the load history (default 3600)",
+  'fnc' : lambda : popIntArg('window', queryRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-n', '--points' ],
+  'msg' : "The number of points in the load history (default 60)",
+  'fnc' : lambda : popIntArg('points', queryRequest, optArgsList)
+})
 optArgsList.append({
   'key' : [ '-r', '--raw' ],
   'msg' : "Print the *raw* information structure",
@@ -88,6 +110,27 @@ def getPrintRequest(queryRequest) :
       tcpTMCloseConnection(tmSocket, verbose)
       if queryRequest['raw'] :
         print(yaml.dump(result))
+      elif 'taskId' in queryRequest :
+        if result['found'] :
+          print(yaml.dump(result['task']))
+        else :
+          print(f"  the task {queryRequest['taskId']} is not known")
+      elif queryRequest['type'] == 'hostHistory' :
+        if not result['hosts'] :
+          print("  no load history for these hosts")
+        for aHost, aWindow in result['hosts'].items() :
+          print(f"\nLoad history of {aHost}:\n")
+          someMetrics = [ aKey for aKey in aWindow if aKey != 'times' ]
+          print("time     " + " ".join(aKey.rjust(12) for aKey in someMetrics))
+          for anIndex, aTime in enumerate(aWindow['times']) :
+            print(
+              time.strftime('%H:%M:%S', time.localtime(aTime)) + " " +
+              " ".join(
+                ('-' if aWindow[aKey][anIndex] is None else
+                  f"{aWindow[aKey][anIndex]:.3f}").rjust(12)
+                for aKey in someMetrics
+              )
+            )
       else :
         print("\nHost information:\n")
         #for aHost, someHostData in result['hostData'].items() :
@@ -115,6 +158,13 @@ def runQueryWorkers() :
 
   parseCli(queryRequest, optArgsList, remainingArgs)
 
+  if 'taskId' in queryRequest :
+    queryRequest['type'] = 'taskQuery'
+  elif 'historyHost' in queryRequest :
+    queryRequest['type'] = 'hostHistory'
+    if queryRequest['historyHost'] != 'all' :
+      queryRequest['hostName'] = queryRequest['historyHost']
+
   if queryRequest['verbose'] :
     print("Query Request:\n---")
     print(yaml.dump(queryRequest))
@@ -0,0 +1,295 @@
+"""
+Compile a C or C++ translation unit on a gcc worker, having preprocessed it
+locally (in the style of distcc).
+
+Remote gcc workers would otherwise resolve every `#include` (along every `-I`
+search path) through their sshfs mounts, which costs a round trip for each
+lookup. Instead we run the preprocessor here, send the single preprocessed
+file to the worker (inline if small, otherwise through the blob store), and
+the worker compiles it in a scratch directory with no other filesystem
+dependencies. The object file is sent back and written to the requested
+output path.
+
+Any dependency file (`-MD`/`-MMD`) is written locally by the preprocessor.
+
+Commands which are not a simple compilation (`-c`) of one C or C++ source
+(for example links, `-E`, `-S` or `-x`) are run locally, as are compilations
+which can not be sent to the taskManager.
+
+This "module" MUST be concatinated to the END of the `taskCli` module.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+def usage(optArgsList) :
+  '''
+usage: remoteCompile [options] -- compiler [compilerArg ...]
+
+Preprocess a C or C++ source locally and compile it on a gcc worker
+
+positional arguments:
+
+  compiler                The compiler (gcc, g++, cc, c++
+                          or a cross compiler)
+  compilerArg             The compiler's usual arguments
+
+options:
+'''
+  print(usage.__doc__)
+
+  optHelp = {}
+  optKeyLen = 0
+  for anOptArg in optArgsList :
+    hKeys = ", ".join(anOptArg['key'])
+    if optKeyLen < len(hKeys) : optKeyLen = len(hKeys)
+    optHelp[hKeys] = anOptArg['msg']
+  for anOptKey in sorted(optHelp.keys()) :
+    print(f"  {anOptKey.ljust(optKeyLen)} {optHelp[anOptKey]}")
+  sys.exit(1)
+
+taskRequest = {
+  'progName' : "",
+  'host'     : "127.0.0.1",
+  'port'     : 8888,
+  'type'     : "taskRequest",
+  'taskName' : "",
+  'taskType' : "gcc",
+  'actions'  : [],
+  'env'      : {},
+  'dir'      : '',
+  'timeOut'  : 100,
+  'logPath'  : 'stdout',
+  'verbose'  : False
+}
+
+optArgsList = []
+
+optArgsList.append({
+  'key' : [ '--help' ],
+  'msg' : "Show this help message and exit",
+  'fnc' : lambda : usage(optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-h', '--host' ],
+  'msg' : "TaskManager's host",
+  'fnc' : lambda : popArg('host', taskRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-p', '--port' ],
+  'msg' : "TaskManager's port",
+  'fnc' : lambda : popIntArg('port', taskRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-n', '--name' ],
+  'msg' : "The task's name (default `compile.<source>`)",
+  'fnc' : lambda : popArg('taskName', taskRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-w', '--worker' ],
+  'msg' : "The worker type (default `gcc`)",
+  'fnc' : lambda : popArg('taskType', taskRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-P', '--platform' ],
+  'msg' : "The required platform-cpu",
+  'fnc' : lambda : popArg('requiredPlatform', taskRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-t', '-timeout', '--timeOut' ],
+  'msg' : "Task time out in seconds",
+  'fnc' : lambda : popIntArg('timeOut', taskRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-l', '--log' ],
+  'msg' : "Path to the log file",
+  'fnc' : lambda : popArg('logPath', taskRequest, optArgsList)
+})
+optArgsList.append({
+  'key' : [ '-v', '--verbose' ],
+  'msg' : "Echo the complete task request and the task's messages",
+  'fnc' : lambda : setArg('verbose', True, taskRequest, optArgsList)
+})
+
+def remainingArgs(requestDict, optArgsList) :
+  if len(sys.argv) < 1 :
+    print("Missing compiler command")
+    usage(optArgsList)
+  requestDict['compilerCmd'] = list(sys.argv)
+  sys.argv.clear()
+
+# the source suffixes we can preprocess (and the suffix of the preprocessed
+# source, which tells the remote compiler not to preprocess it again)
+preprocessedSuffixes = {
+  '.c'   : '.i',
+  '.cc'  : '.ii',
+  '.cp'  : '.ii',
+  '.cpp' : '.ii',
+  '.cxx' : '.ii',
+  '.c++' : '.ii',
+  '.CPP' : '.ii',
+  '.C'   : '.ii'
+}
+
+# flags (whose value is the next word) which only affect preprocessing
+preprocessorFlags = ( '-I', '-D', '-U', '-include', '-imacros', '-isystem',
+  '-iquote', '-idirafter', '-iprefix', '-iwithprefix', '-isysroot' )
+
+# dependency generation flags (which are only passed to the preprocessor)
+dependencyFlags = ( '-MD', '-MMD', '-MP', '-MG' )
+dependencyValueFlags = ( '-MF', '-MT', '-MQ' )
+
+# flags which this tool can not (yet) compile remotely
+localOnlyFlags = ( '-E', '-S', '-M', '-MM', '-x', '-', '-save-temps' )
+
+def splitCompileCommand(compilerCmd) :
+  """
+  Split the compiler command `compilerCmd` into a dict of the `compiler`, the
+  `source`, the `output`, the `cppFlags` (passed to the local preprocessor)
+  and the `compileFlags` (passed to the remote compiler). Returns None if the
+  command is not a simple compilation of one C or C++ source.
+  """
+  compiler     = compilerCmd[0]
+  sources      = []
+  output       = None
+  compileOnly  = False
+  makeDeps     = False
+  depFile      = None
+  depTargets   = False
+  cppFlags     = []
+  compileFlags = []
+  someWords    = compilerCmd[1:]
+  i = 0
+  while i < len(someWords) :
+    aWord = someWords[i]
+    nextWord = someWords[i+1] if i+1 < len(someWords) else None
+    if aWord in localOnlyFlags or aWord.startswith(('@', '-x', '-save-temps')) :
+      return None
+    elif aWord == '-o' :
+      output = nextWord
+      i += 1
+    elif aWord == '-c' :
+      compileOnly = True
+    elif aWord in dependencyFlags :
+      if aWord in ( '-MD', '-MMD' ) : makeDeps = True
+      cppFlags.append(aWord)
+    elif aWord in dependencyValueFlags :
+      if aWord == '-MF' : depFile = nextWord
+      else              : depTargets = True
+      cppFlags.extend([aWord, nextWord])
+      i += 1
+    elif aWord in preprocessorFlags :
+      cppFlags.extend([aWord, nextWord])
+      i += 1
+    elif aWord.startswith(('-I', '-D', '-U')) :
+      cppFlags.append(aWord)
+    elif not aWord.startswith('-') :
+      sources.append(aWord)
+    else :
+      # flags such as -O2, -g, -std=... or -m... affect both steps
+      cppFlags.append(aWord)
+      compileFlags.append(aWord)
+    i += 1
+  if not compileOnly or len(sources) != 1 or None in cppFlags : return None
+  source = sources[0]
+  suffix = os.path.splitext(source)[1]
+  if suffix not in preprocessedSuffixes : return None
+  if not output :
+    output = os.path.splitext(os.path.basename(source))[0] + '.o'
+  if makeDeps :
+    # the preprocessor's default dependency file and target would otherwise
+    # be named after the preprocessed (rather than the object) file
+    if not depFile :
+      cppFlags.extend([ '-MF', os.path.splitext(output)[0] + '.d' ])
+    if not depTargets :
+      cppFlags.extend([ '-MT', output ])
+  return {
+    'compiler'     : compiler,
+    'source'       : source,
+    'output'       : output,
+    'suffix'       : preprocessedSuffixes[suffix],
+    'cppFlags'     : cppFlags,
+    'compileFlags' : compileFlags
+  }
+
+def compileLocally(compilerCmd) :
+  """
+  Run the compiler command `compilerCmd` locally, returning its returncode.
+  """
+  return subprocess.run(compilerCmd).returncode
+
+def runRemoteCompile() :
+  """
+  Preprocess the source named in the compiler command locally, send a
+  taskRequest (with the preprocessed source) to compile it on a gcc worker,
+  and write the returned object file to the requested output.
+  """
+
+  parseCli(taskRequest, optArgsList, remainingArgs)
+  compilerCmd = taskRequest.pop('compilerCmd')
+  verbose     = taskRequest['verbose']
+
+  aCompile = splitCompileCommand(compilerCmd)
+  if aCompile is None : return compileLocally(compilerCmd)
+
+  sourceName = os.path.splitext(os.path.basename(aCompile['source']))[0]
+  tuPath  = sourceName + aCompile['suffix']
+  objPath = sourceName + '.o'
+  if not taskRequest['taskName'] :
+    taskRequest['taskName'] = f"compile.{sourceName}"
+  taskRequest['workers'] = [ taskRequest['taskType'] ]
+  taskRequest['actions'].append(
+    [ aCompile['compiler'] ] + aCompile['compileFlags'] +
+    [ '-c', tuPath, '-o', objPath ]
+  )
+  taskRequest['outputs'] = [ objPath ]
+
+  tmpDir = tempfile.mkdtemp(prefix='cfRemoteCompile-')
+  try :
+    localTuPath = os.path.join(tmpDir, tuPath)
+    preprocessed = subprocess.run(
+      [ aCompile['compiler'] ] + aCompile['cppFlags'] +
+      [ '-E', aCompile['source'], '-o', localTuPath ]
+    )
+    if preprocessed.returncode != 0 : return preprocessed.returncode
+
+    if not attachTaskInputs(
+      taskRequest, taskRequest, { tuPath : localTuPath }, verbose
+    ) :
+      print("Could not send the preprocessed source, compiling locally")
+      return compileLocally(compilerCmd)
+    if verbose :
+      print("Task Request:\n---")
+      print(yaml.dump(taskRequest))
+      print("---")
+
+    taskInfo = {}
+    someMsgs = []
+    workerReturnCode = tcpTMSubmitTask(taskRequest, someMsgs, verbose, taskInfo)
+    if workerReturnCode is None :
+      print("Compiling locally")
+      return compileLocally(compilerCmd)
+    # (the compiler's warnings are shown, as they would be locally)
+    if someMsgs : print("\n".join(someMsgs))
+    if workerReturnCode != 0 :
+      print(f"Remote compilation of {aCompile['source']} failed")
+      return workerReturnCode
+    localObjPath = os.path.join(tmpDir, objPath)
+    missing = collectTaskOutputs(
+      taskRequest, taskInfo.get('result', {}),
+      lambda aPath : os.path.join(tmpDir, aPath), verbose
+    )
+    if missing or not os.path.exists(localObjPath) :
+      print(f"Could not fetch the object file of {aCompile['source']}")
+      return 1
+    outputDir = os.path.dirname(aCompile['output'])
+    if outputDir : os.makedirs(outputDir, exist_ok=True)
+    shutil.move(localObjPath, aCompile['output'])
+    return 0
+  finally :
+    shutil.rmtree(tmpDir, ignore_errors=True)
+
+if __name__ == "__main__" :
+  sys.exit(runRemoteCompile())
@@ -1,13 +1,14 @@
 """
-To keep the `newTask` and `queryWorkers` tools as self contained as possible, we
-use a fairly simple command line argument parser (consisting of `checkNextArg`,
-`popArg`, `popIntArg`, `setArg`, and `setEnv`).
+To keep the `newTask`, `queryWorkers` and `remoteCompile` tools as self
+contained as possible, we use a fairly simple command line argument parser
+(consisting of `checkNextArg`, `popArg`, `popIntArg`, `appendArg`, `setArg`,
+and `setEnv`).
 
 This "cli" uses command line arguments to build up / alter a task dict which is
 eventualy sent to the taskManager.
 
 This "module" MUST be concatinated BETWEEN the `taskManagerAccess.py` and the
-respective `newTask.py` or `queryWorkers.py` "modules".
+respective `newTask.py`, `queryWorkers.py` or `remoteCompile.py` "modules".
 
 """
 
@@ -42,6 +43,15 @@ def popIntArg(aKey, requestDict, optArgsList) :
   popArg(aKey, requestDict, optArgsList)
   requestDict[aKey] = int(requestDict[aKey])
 
+def appendArg(aKey, requestDict, optArgsList) :
+  """
+  Check the next argument for a value to be appended to the taskRequest's list
+  `aKey`.
+  """
+  checkNextArg(aKey, requestDict, optArgsList)
+  if aKey not in requestDict : requestDict[aKey] = []
+  requestDict[aKey].append(sys.argv.pop(0))
+
 #def addMmh3(requestDict, optArgsList) :
 #  checkNextArg('mmh3', requestDict, optArgsList)
 #  requestDict['mmh3'].append(sys.argv.pop(0))
@@ -0,0 +1,125 @@
+"""
+Provide the taskManager's action cache (a farm wide cache of the results of
+deterministic tasks, for example compilations).
+
+A worker which has a `taskCache` plugin computes a key for each task it is
+given (for gcc: the hash of the preprocessed source, the compiler's identity
+and the flags). Before running the task, the worker asks the taskManager for
+the entry stored under this key. An entry contains:
+
+- returncode : the task's returncode (only successful tasks are cached)
+
+- log        : the task's (parsed) log messages (for example the compiler's
+               warnings)
+
+- outputs    : a dict of the (relative) paths, and blob hashes, of the task's
+               outputs (the outputs themselves are held in the `blobStore`)
+
+On a hit, the worker fetches the outputs and replays the log without running
+the task. On a miss, the worker runs the task and then stores its outputs and
+entry.
+
+A task originator which can compute the same key (for example `newTask
+--cache z3Cache`) sends it as the taskRequest's `cacheKey`. The taskManager
+then answers a hit itself, without dispatching the task to a worker at all.
+
+The entries are persisted (as compact JSON) in a local file, and the least
+recently used entries are forgotten once there are more than `maxEntries`.
+
+This "module" MUST be concatinated AFTER the `taskManager_2_blobStore.py`
+"module".
+"""
+
+class ActionCache :
+  """
+  The cached task results indexed by the (worker computed) cache key.
+  """
+
+  __slots__ = ( 'entries', 'path', 'maxEntries', 'hits', 'misses', 'changed' )
+
+  def __init__(self, path=None, maxEntries=100000) :
+    self.entries    = OrderedDict()
+    self.path       = path
+    self.maxEntries = maxEntries
+    self.hits       = 0
+    self.misses     = 0
+    self.changed    = False
+
+  def get(self, aKey) :
+    """
+    Return the entry stored under `aKey` (or None if there is no such entry, or
+    if any of its outputs are no longer in the blobStore).
+    """
+    anEntry = self.entries.get(aKey)
+    if anEntry is not None and \
+      not all(blobStore.has(aHash) for aHash in anEntry['outputs'].values()) :
+      del self.entries[aKey]
+      self.changed = True
+      anEntry = None
+    if anEntry is None :
+      self.misses += 1
+      return None
+    self.hits += 1
+    self.entries.move_to_end(aKey)
+    return anEntry
+
+  def put(self, aKey, anEntry) :
+    """
+    Store the entry `anEntry` under `aKey` (if it is a successful task, whose
+    outputs are all in the blobStore). Returns True if the entry was stored.
+    """
+    if not isinstance(anEntry, dict) or anEntry.get('returncode') != 0 :
+      return False
+    someOutputs = anEntry.get('outputs') or {}
+    if not all(blobStore.has(aHash) for aHash in someOutputs.values()) :
+      return False
+    self.entries[aKey] = {
+      'returncode' : 0,
+      'log'        : list(anEntry.get('log') or []),
+      'outputs'    : dict(someOutputs)
+    }
+    self.entries.move_to_end(aKey)
+    while self.maxEntries < len(self.entries) :
+      self.entries.popitem(last=False)
+    self.changed = True
+    return True
+
+  def load(self) :
+    """
+    Load the persisted entries (if any).
+    """
+    if not self.path : return
+    try :
+      with open(self.path) as cacheFile :
+        someEntries = json.load(cacheFile)
+    except FileNotFoundError :
+      return
+    except (OSError, ValueError) as err :
+      print(f"Could not load the action cache from {self.path} ({err})")
+      return
+    self.entries = OrderedDict(someEntries)
+    print(f"Loaded {len(self.entries)} action cache entries")
+
+  def save(self) :
+    """
+    Persist the entries (if they have changed).
+    """
+    if not self.path or not self.changed : return
+    tmpPath = self.path + '.tmp'
+    try :
+      with open(tmpPath, 'w') as cacheFile :
+        json.dump(self.entries, cacheFile, separators=(',', ':'))
+      os.replace(tmpPath, self.path)
+      self.changed = False
+    except OSError as err :
+      print(f"Could not save the action cache to {self.path} ({err})")
+
+async def actionCacheSaver(saveInterval) :
+  """
+  Periodically persist the action cache.
+  """
+  while True :
+    await asyncio.sleep(saveInterval)
+    actionCache.save()
+
+actionCache = ActionCache()
@@ -0,0 +1,152 @@
+"""
+Provide the taskManager's content addressed blob store.
+
+Task inputs and outputs may be transferred as blobs (rather than through the
+sshfs mount of the `files.orig` directory). Each blob is stored (once) under
+the (hex) SHA-256 hash of its contents:
+
+  <path>/<first two hex digits>/<remaining hex digits>
+
+The clients (newTask) upload a task's inputs before requesting the task, the
+workers fetch (in bulk) those inputs which are not already in their local
+caches, and upload the task's outputs which the clients then fetch (see the
+blob functions in the `computeFarmTools` "module").
+
+The store is bounded: once the blobs use more than `maxBytes`, the least
+recently used blobs are removed.
+
+This "module" MUST be concatinated AFTER the `taskManager_2_state.py` "module".
+"""
+
+import hashlib
+
+blobChunkSize = 1024 * 1024
+
+def isBlobHash(aHash) :
+  """
+  Return True if `aHash` is a (lower case hex) SHA-256 hash.
+  """
+  return isinstance(aHash, str) and len(aHash) == 64 and \
+    all(aChar in '0123456789abcdef' for aChar in aHash)
+
+class BlobStore :
+  """
+  The blobs stored in the directory `path`.
+
+  - `maxBytes`   : the total size of the blobs kept.
+
+  - `totalBytes` : the current total size of the blobs.
+  """
+
+  __slots__ = ( 'path', 'maxBytes', 'totalBytes' )
+
+  def __init__(self, path=None, maxBytes=10*1024*1024*1024) :
+    self.path       = path
+    self.maxBytes   = maxBytes
+    self.totalBytes = 0
+
+  def blobPath(self, aHash) :
+    return os.path.join(self.path, aHash[:2], aHash[2:])
+
+  def has(self, aHash) :
+    return isBlobHash(aHash) and os.path.exists(self.blobPath(aHash))
+
+  def load(self) :
+    """
+    Create the store's directory (if required) and total the size of the
+    blobs already stored.
+    """
+    if not self.path : return
+    os.makedirs(self.path, exist_ok=True)
+    self.totalBytes = 0
+    for aDir, someDirs, someFiles in os.walk(self.path) :
+      for aFile in someFiles :
+        try :
+          self.totalBytes += os.path.getsize(os.path.join(aDir, aFile))
+        except OSError :
+          pass
+    print(f"Blob store {self.path} holds {self.totalBytes} bytes")
+
+  async def receive(self, reader, aHash, size) :
+    """
+    Read a blob of `size` bytes from `reader` and store it (if its contents
+    match the hash `aHash`). Returns True if the blob has been stored.
+    """
+    blobPath = self.blobPath(aHash)
+    tmpPath  = f"{blobPath}.{id(reader):x}.tmp"
+    os.makedirs(os.path.dirname(blobPath), exist_ok=True)
+    theHash = hashlib.sha256()
+    try :
+      with open(tmpPath, 'wb') as blobFile :
+        remaining = size
+        while 0 < remaining :
+          aChunk = await reader.readexactly(min(remaining, blobChunkSize))
+          theHash.update(aChunk)
+          blobFile.write(aChunk)
+          remaining -= len(aChunk)
+    except BaseException :
+      os.remove(tmpPath)
+      raise
+    if theHash.hexdigest() != aHash :
+      os.remove(tmpPath)
+      return False
+    if os.path.exists(blobPath) :
+      os.remove(tmpPath)
+    else :
+      os.replace(tmpPath, blobPath)
+      self.totalBytes += size
+      self.evict()
+    return True
+
+  async def send(self, writer, aHash) :
+    """
+    Send the blob `aHash` (as a JSON header line, containing the blob's `hash`
+    and `size`, followed by its contents) to `writer`. A missing blob is sent
+    with a `size` of -1 (and no contents).
+    """
+    blobPath = self.blobPath(aHash) if isBlobHash(aHash) else None
+    try :
+      blobFile = open(blobPath, 'rb')
+    except (OSError, TypeError) :
+      writer.write(json.dumps({ 'hash' : aHash, 'size' : -1 }).encode() + b"\n")
+      await writer.drain()
+      return
+    with blobFile :
+      size = os.fstat(blobFile.fileno()).st_size
+      writer.write(json.dumps({ 'hash' : aHash, 'size' : size }).encode() + b"\n")
+      while True :
+        aChunk = blobFile.read(blobChunkSize)
+        if not aChunk : break
+        writer.write(aChunk)
+        await writer.drain()
+      await writer.drain()
+    os.utime(blobPath)  # this blob has been (recently) used
+
+  def evict(self) :
+    """
+    Remove the least recently used blobs until the blobs use no more than
+    `maxBytes`.
+    """
+    if self.totalBytes <= self.maxBytes : return
+    someBlobs = []
+    for aDir, someDirs, someFiles in os.walk(self.path) :
+      for aFile in someFiles :
+        if aFile.endswith('.tmp') : continue
+        aPath = os.path.join(aDir, aFile)
+        try :
+          aStat = os.stat(aPath)
+        except OSError :
+          continue
+        someBlobs.append((aStat.st_mtime, aStat.st_size, aPath))
+    someBlobs.sort()
+    # evict down to 90% so that we do not walk the store for every new blob
+    target = self.maxBytes * 0.9
+    for mtime, size, aPath in someBlobs :
+      if self.totalBytes <= target : break
+      try :
+        os.remove(aPath)
+        self.totalBytes -= size
+      except OSError :
+        pass
+
+blobStore = BlobStore()
@@ -0,0 +1,171 @@
+"""
+Provide the taskManager's (learned) model of the cost of running a task.
+
+Each finished task is observed using a normalised signature of its taskRequest:
+
+- the client provided `costKey` (if any), otherwise
+
+- the acceptable workers (or the required tools) together with the first word
+  of the task's command (without any path, or leading environment settings).
+
+For each signature we keep an exponentially weighted moving average of the
+task's observed duration, CPU time and peak RSS (MB). The durations and CPU
+times are normalised (by the caller) to a host with a (calibrated) speed of
+1.0.
+
+These statistics are used to predict the cost of new tasks which do not provide
+their own estimates:
+
+- estimatedDuration : the predicted duration (used by the scheduling policies
+                      to order the pending tasks)
+
+- cores             : the predicted parallelism (CPU time / duration)
+
+- memory            : the predicted peak RSS
+
+The statistics are persisted (as a compact JSON dict of lists) in a local file
+so that they survive restarts of the taskManager.
+
+This "module" MUST be concatinated AFTER the `taskManager_2_state.py` "module".
+"""
+
+import os
+
+@dataclass(slots=True, eq=False)
+class CostStats :
+  count    : int   = 0
+  duration : float = None   # seconds
+  cpuTime  : float = None   # seconds (user + system)
+  maxRss   : float = None   # MB
+  lastUsed : float = 0
+
+  def toList(self) :
+    return [
+      self.count, self.duration, self.cpuTime, self.maxRss, self.lastUsed
+    ]
+
+class CostModel :
+  """
+  The learned cost statistics indexed by task signature.
+
+  - `alpha`      : the weight given to each new observation.
+
+  - `maxEntries` : the number of signatures kept (the least recently used
+                   signatures are forgotten first).
+  """
+
+  __slots__ = ( 'stats', 'path', 'alpha', 'maxEntries', 'changed' )
+
+  def __init__(self, path=None, alpha=0.3, maxEntries=10000) :
+    self.stats      = {}
+    self.path       = path
+    self.alpha      = alpha
+    self.maxEntries = maxEntries
+    self.changed    = False
+
+  def taskSignature(self, aTaskRequest) :
+    """
+    Return the normalised signature of the taskRequest `aTaskRequest`.
+    """
+    if aTaskRequest.get('costKey') : return str(aTaskRequest['costKey'])
+
+    someWorkers = aTaskRequest.get('workers') or \
+      sorted(aTaskRequest.get('requiredTools') or [])
+    firstWord = ''
+    for anAction in aTaskRequest.get('actions') or [] :
+      for aWord in ' '.join(anAction).split() :
+        if '=' in aWord and not aWord.startswith('-') : continue
+        firstWord = os.path.basename(aWord)
+        break
+      if firstWord : break
+    return f"{'+'.join(someWorkers)}:{firstWord}"
+
+  def ewma(self, oldValue, newValue) :
+    if newValue is None : return oldValue
+    if oldValue is None : return float(newValue)
+    return oldValue + self.alpha * (newValue - oldValue)
+
+  def observe(self, signature, duration, cpuTime=None, maxRss=None) :
+    """
+    Record the observed cost of one (successfully) finished task.
+    """
+    if signature not in self.stats : self.stats[signature] = CostStats()
+    someStats = self.stats[signature]
+    someStats.count   += 1
+    someStats.duration = self.ewma(someStats.duration, duration)
+    someStats.cpuTime  = self.ewma(someStats.cpuTime, cpuTime)
+    someStats.maxRss   = self.ewma(someStats.maxRss, maxRss)
+    someStats.lastUsed = time.time()
+    self.changed = True
+
+  def predict(self, aTaskRequest) :
+    """
+    Add (predicted) `estimatedDuration`, `cores` and `memory` keys to the
+    taskRequest `aTaskRequest` (unless they have been provided by the client),
+    and return the task's signature.
+    """
+    signature = self.taskSignature(aTaskRequest)
+    someStats = self.stats.get(signature)
+    if not someStats or someStats.duration is None : return signature
+
+    if 'estimatedDuration' not in aTaskRequest :
+      aTaskRequest['estimatedDuration'] = round(someStats.duration, 3)
+    if 'cores' not in aTaskRequest and someStats.cpuTime is not None and \
+      0 < someStats.duration :
+      aTaskRequest['cores'] = \
+        max(1, round(someStats.cpuTime / someStats.duration))
+    if 'memory' not in aTaskRequest and someStats.maxRss is not None :
+      aTaskRequest['memory'] = int(someStats.maxRss)
+    return signature
+
+  def load(self) :
+    """
+    Load the persisted statistics (if any).
+    """
+    if not self.path : return
+    try :
+      with open(self.path) as costFile :
+        someStats = json.load(costFile)
+    except FileNotFoundError :
+      return
+    except (OSError, ValueError) as err :
+      print(f"Could not load the task costs from {self.path} ({err})")
+      return
+    for signature, someValues in someStats.items() :
+      self.stats[signature] = CostStats(*someValues)
+    print(f"Loaded the costs of {len(self.stats)} task signatures")
+
+  def save(self) :
+    """
+    Persist the statistics (if they have changed), forgetting the least
+    recently used signatures if there are more than `maxEntries`.
+    """
+    if not self.path or not self.changed : return
+    if self.maxEntries < len(self.stats) :
+      someSignatures = sorted(
+        self.stats, key=lambda aSignature : self.stats[aSignature].lastUsed
+      )
+      for aSignature in someSignatures[:len(self.stats) - self.maxEntries] :
+        del self.stats[aSignature]
+    tmpPath = self.path + '.tmp'
+    try :
+      with open(tmpPath, 'w') as costFile :
+        json.dump(
+          { aSignature : someStats.toList()
+            for aSignature, someStats in self.stats.items() },
+          costFile, separators=(',', ':')
+        )
+      os.replace(tmpPath, self.path)
+      self.changed = False
+    except OSError as err :
+      print(f"Could not save the task costs to {self.path} ({err})")
+
+async def costModelSaver(saveInterval) :
+  """
+  Periodically persist the cost model.
+  """
+  while True :
+    await asyncio.sleep(saveInterval)
+    costModel.save()
+
+costModel = CostModel()
@@ -0,0 +1,264 @@
+"""
+Provide the taskManager's (bounded) time series of each host's load.
+
+For each host we keep a fixed size ring buffer (of `array`s of doubles) of
+the host's load samples. At most one sample is recorded every `interval`
+seconds (however often the host's monitor reports), so the buffers cover the
+last `size * interval` seconds (by default one day). Once a buffer is full the
+oldest samples are overwritten, so the memory used does not grow with the
+taskManager's uptime.
+
+The metrics recorded for each sample are listed in `historyMetrics`:
+
+  - score        : the host's load score (see `FarmState.hostScore`)
+  - wlScaled     : the scaled work load
+  - cpuUtil      : the fraction of the cpus which were busy
+  - memAvailable : the available memory (MB)
+  - psiCpu       : the pressure stall information (see the `hostMetrics`
+  - psiMemory      "module")
+  - psiIo
+  - runningTasks : the number of tasks running on the host
+
+Values which the host's monitor does not report are recorded as NaN (and are
+ignored when a window is downsampled).
+
+The buffers can (optionally) be snapshotted to a compact binary file when the
+taskManager shuts down, and reloaded when it restarts.
+
+This "module" MUST be concatinated AFTER the `taskManager_2_state.py` "module".
+"""
+
+from array import array
+import bisect
+import math
+import os
+import struct
+
+historyMetrics = (
+  'score', 'wlScaled', 'cpuUtil', 'memAvailable',
+  'psiCpu', 'psiMemory', 'psiIo', 'runningTasks'
+)
+
+snapshotMagic = b'CFHM'
+
+class MetricRing :
+  """
+  A fixed size ring buffer of the (time stamped) samples of one host.
+
+  - `times`  : the (unix) times of the samples.
+
+  - `values` : one array for each of the `historyMetrics`.
+
+  - `next`   : the slot to which the next sample will be written.
+
+  - `count`  : the number of slots in use.
+  """
+
+  __slots__ = ( 'size', 'times', 'values', 'next', 'count' )
+
+  def __init__(self, size) :
+    self.size   = size
+    self.times  = array('d', [0.0]) * size
+    self.values = [
+      array('d', [math.nan]) * size for aMetric in historyMetrics
+    ]
+    self.next   = 0
+    self.count  = 0
+
+  def oldest(self) :
+    return (self.next - self.count) % self.size
+
+  def lastTime(self) :
+    if not self.count : return 0
+    return self.times[(self.next - 1) % self.size]
+
+  def append(self, when, someValues) :
+    """
+    Add the sample `someValues` (one value for each of the `historyMetrics`)
+    taken at the time `when`, overwriting the oldest sample if the buffer is
+    full.
+    """
+    slot = self.next
+    self.times[slot] = when
+    for aMetricArray, aValue in zip(self.values, someValues) :
+      aMetricArray[slot] = aValue
+    self.next  = (slot + 1) % self.size
+    self.count = min(self.count + 1, self.size)
+
+  def window(self, start, end, points, someMetrics) :
+    """
+    Return the samples taken between the times `start` and `end`, downsampled
+    into (at most) `points` equal length time buckets, as a dict of lists (the
+    `times` of the buckets and the mean of each of the metrics `someMetrics`
+    in each bucket). Empty buckets are left out.
+
+    Only the slots inside the window are visited (they are found by bisection)
+    so a query never copies the whole history.
+    """
+    oldest  = self.oldest()
+    size    = self.size
+    times   = self.times
+    slotKey = lambda anIndex : times[(oldest + anIndex) % size]
+    first   = bisect.bisect_left(range(self.count), start, key=slotKey)
+    last    = bisect.bisect_right(range(self.count), end, key=slotKey)
+
+    metricIndexes = [ historyMetrics.index(aMetric) for aMetric in someMetrics ]
+    aWindow = { 'times' : [] }
+    for aMetric in someMetrics : aWindow[aMetric] = []
+    if last <= first or points < 1 : return aWindow
+
+    width   = max(end - start, 1e-9) / points
+    bucket  = None
+    count   = 0
+    sumTime = 0.0
+    sums    = [ 0.0 ] * len(metricIndexes)
+    counts  = [ 0 ] * len(metricIndexes)
+
+    def closeBucket() :
+      aWindow['times'].append(round(sumTime / count, 3))
+      for anIndex, aMetric in enumerate(someMetrics) :
+        aWindow[aMetric].append(
+          round(sums[anIndex] / counts[anIndex], 4) if counts[anIndex] else None
+        )
+
+    for anIndex in range(first, last) :
+      slot     = (oldest + anIndex) % size
+      when     = times[slot]
+      aBucket  = min(int((when - start) / width), points - 1)
+      if aBucket != bucket :
+        if count : closeBucket()
+        bucket  = aBucket
+        count   = 0
+        sumTime = 0.0
+        sums    = [ 0.0 ] * len(metricIndexes)
+        counts  = [ 0 ] * len(metricIndexes)
+      count   += 1
+      sumTime += when
+      for aPosition, aMetricIndex in enumerate(metricIndexes) :
+        aValue = self.values[aMetricIndex][slot]
+        if math.isnan(aValue) : continue
+        sums[aPosition]   += aValue
+        counts[aPosition] += 1
+    if count : closeBucket()
+    return aWindow
+
+class HostHistory :
+  """
+  The `MetricRing`s of all of the (monitored) hosts, indexed by host name.
+
+  - `size`     : the number of samples kept for each host.
+
+  - `interval` : the minimum time (in seconds) between two recorded samples.
+
+  - `path`     : (optional) the file to which the buffers are snapshotted.
+  """
+
+  __slots__ = ( 'rings', 'size', 'interval', 'path' )
+
+  def __init__(self, size=8640, interval=10, path=None) :
+    self.rings    = {}
+    self.size     = size
+    self.interval = interval
+    self.path     = path
+
+  def record(self, aHost, when=None) :
+    """
+    Record the latest load information of the Host `aHost` (unless a sample
+    has been recorded for this host within the last `interval` seconds).
+    """
+    if self.size < 1 : return
+    if when is None : when = time.time()
+    aRing = self.rings.get(aHost.name)
+    if aRing is None :
+      aRing = MetricRing(self.size)
+      self.rings[aHost.name] = aRing
+    elif when - aRing.lastTime() < self.interval :
+      return
+    hostData = aHost.data or {}
+    someValues = []
+    for aMetric in historyMetrics :
+      if aMetric == 'runningTasks' :
+        someValues.append(aHost.runningTasks)
+      else :
+        someValues.append(float(hostData.get(aMetric, math.nan)))
+    aRing.append(when, someValues)
+
+  def window(self, hostName, start, end, points, someMetrics=None) :
+    """
+    Return the downsampled window (see `MetricRing.window`) of the history of
+    the host `hostName` (or None if this host has no history).
+    """
+    if hostName not in self.rings : return None
+    if not someMetrics : someMetrics = historyMetrics
+    someMetrics = [ aMetric for aMetric in someMetrics
+      if aMetric in historyMetrics ]
+    return self.rings[hostName].window(start, end, points, someMetrics)
+
+  def save(self) :
+    """
+    Snapshot the buffers to the `path` file (if any).
+
+    The file starts with the `snapshotMagic`, the length of a (small) JSON
+    header describing the buffers, and the header itself. This is followed by
+    the raw (native) doubles of each host's `times` and `values` arrays (in
+    the order listed in the header).
+    """
+    if not self.path or not self.rings : return
+    header = json.dumps({
+      'metrics' : historyMetrics,
+      'size'    : self.size,
+      'hosts'   : [
+        [ hostName, aRing.next, aRing.count ]
+          for hostName, aRing in self.rings.items()
+      ]
+    }, separators=(',', ':')).encode()
+    tmpPath = self.path + '.tmp'
+    try :
+      with open(tmpPath, 'wb') as snapshotFile :
+        snapshotFile.write(snapshotMagic)
+        snapshotFile.write(struct.pack('<I', len(header)))
+        snapshotFile.write(header)
+        for aRing in self.rings.values() :
+          aRing.times.tofile(snapshotFile)
+          for aMetricArray in aRing.values : aMetricArray.tofile(snapshotFile)
+      os.replace(tmpPath, self.path)
+    except OSError as err :
+      print(f"Could not save the host history to {self.path} ({err})")
+
+  def load(self) :
+    """
+    Reload the buffers snapshotted in the `path` file (if any). A snapshot
+    with a different size or collection of metrics is ignored.
+    """
+    if not self.path : return
+    try :
+      with open(self.path, 'rb') as snapshotFile :
+        if snapshotFile.read(4) != snapshotMagic :
+          print(f"The host history {self.path} is not a snapshot")
+          return
+        headerLen = struct.unpack('<I', snapshotFile.read(4))[0]
+        header    = json.loads(snapshotFile.read(headerLen))
+        if header['size'] != self.size or \
+          tuple(header['metrics']) != historyMetrics :
+          print(f"Ignoring the (incompatible) host history in {self.path}")
+          return
+        someRings = {}
+        for hostName, nextSlot, count in header['hosts'] :
+          aRing = MetricRing(self.size)
+          aRing.times = array('d')
+          aRing.times.fromfile(snapshotFile, self.size)
+          for anIndex in range(len(historyMetrics)) :
+            aRing.values[anIndex] = array('d')
+            aRing.values[anIndex].fromfile(snapshotFile, self.size)
+          aRing.next  = nextSlot
+          aRing.count = count
+          someRings[hostName] = aRing
+    except FileNotFoundError :
+      return
+    except (OSError, ValueError, EOFError, KeyError, struct.error) as err :
+      print(f"Could not load the host history from {self.path} ({err})")
+      return
+    self.rings = someRings
+    print(f"Loaded the history of {len(self.rings)} hosts")
+
+hostHistory = HostHistory()
@@ -0,0 +1,732 @@
+"""
+Provide the taskManager's model of the current state of the computeFarm.
+
+The state is held in a collection of small (slotted) objects:
+
+- `Platform` : a `platform`-`cpu` combination, the monitored hosts of that type
+               and the taskRequests pending on that platform.
+
+- `Host`     : a machine in the computeFarm, its latest load information (and
+               load score), its capacity (cores and memory), the capacity
+               reserved by its running tasks, the input files recently used
+               by its tasks (and so likely to be in its sshfs cache) and its
+               idle workers.
+
+- `Worker`   : an idle worker connection waiting for a task (together with
+               the task watching the idle connection for EOF). A worker may
+               also report its host's load (in place of a separate monitor).
+
+- `Task`     : a taskRequest which is either pending or running. Each task is
+               identified by a (server assigned) unique `taskId`. A pending
+               task is held compactly, as its request and its requester's
+               connection (its coroutine is only started, and its request
+               only encoded for the worker, once it is dispatched). A running
+               (idempotent) task may have a speculative duplicate running on
+               another host (see `FarmState.duplicateTask`). A task may also
+               be shared by the later (identical) requests which follow it
+               (see `FarmState.followTask`).
+
+Once a task has finished, a (dict) record of it is kept in the bounded
+`TaskHistory` ring buffer.
+
+All of the cross-indexes between these objects are owned (and kept consistent)
+by the single `FarmState` instance, `farmState`. The connection handlers MUST
+only change the state through the `FarmState` methods.
+"""
+
+from collections import deque, OrderedDict
+from dataclasses import dataclass, field
+import itertools
+
+# The load given to hosts which are not (yet) monitored so that they are only
+# used when no monitored host is available.
+unmonitoredLoad = 1000
+
+# The (default) fraction of a host's total memory which may be reserved by
+# running tasks.
+maxMemoryFraction = 0.9
+
+# The (default) number of recently used input files remembered for each host
+# (and of documents whose host is remembered, see `FarmState.affinityHosts`).
+defaultInputCacheSize = 10000
+
+# The (default) weights used to combine a host's monitored values into its
+# load score (see `FarmState.hostScore`). A host which is stalled on memory or
+# I/O (or is swapping) looks more loaded than one which is only busy.
+defaultScoreWeights = {
+  'wlScaled'  : 1.0,     # the scaled work load
+  'psiMemory' : 1.0,     # the fraction of time stalled on memory
+  'psiIo'     : 1.0,     # the fraction of time stalled on I/O
+  'swapOut'   : 0.001    # per page/s swapped out
+}
+
+@dataclass(slots=True, eq=False)
+class Platform :
+  name    : str
+  hosts   : dict = field(default_factory=dict) # hostName -> monitored Host
+  pending : dict = field(default_factory=dict) # Task -> True (in submit order)
+
+@dataclass(slots=True, eq=False)
+class Host :
+  name           : str
+  platform       : Platform = None
+  maxLoad        : float    = 0
+  load           : float    = unmonitoredLoad              # the load score
+  data           : dict     = None                       # latest monitor data
+  samples        : dict     = field(default_factory=dict) # merged raw samples
+  loadSources    : int      = 0                          # monitors + workers
+  numCpus        : int      = 0                          # 0 if not known
+  speed          : float    = 1.0                        # (calibrated) speed
+  memTotal       : int      = 0                          # MB (0 if not known)
+  memAvailable   : int      = 0                          # MB
+  reservedCores  : int      = 0                          # by running tasks
+  reservedMemory : int      = 0                          # MB by running tasks
+  runningTasks   : int      = 0
+  recentFiles    : OrderedDict = field(default_factory=OrderedDict) # LRU
+  idleWorkers    : dict     = field(default_factory=dict) # workerType -> deque
+
+@dataclass(slots=True, eq=False)
+class Worker :
+  workerType : str
+  workerName : str
+  host       : Host
+  addr       : tuple
+  reader     : object
+  writer     : object
+  heartbeat  : bool   = False  # does this worker answer pings?
+  reportsLoad : bool  = False  # does this worker report its host's load?
+  lastSeen   : float  = 0
+  watcher    : object = None   # asyncio.Task watching the idle connection
+
+@dataclass(slots=True, eq=False)
+class Task :
+  taskId           : str
+  name             : str
+  request          : dict
+  requestJson      : bytes
+  requiredPlatform : str
+  estimatedLoad    : float
+  submitted        : float
+  cores            : int    = 1
+  memory           : int    = 0                          # MB
+  costKey          : str    = None                       # (see CostModel)
+  state            : str    = 'pending'
+  event            : object = None                       # set when finished
+  platforms        : list   = field(default_factory=list)
+  workerType       : str    = None
+  workerName       : str    = None
+  host             : Host   = None
+  started          : float  = None
+  duplicateOf      : str    = None                       # (original taskId)
+  requestKey       : str    = None                       # (when shared)
+  followers        : list   = field(default_factory=list)
+  sharedWith       : str    = None                       # (leader's taskId)
+  finalMessage     : dict   = None                       # (for followers)
+  client           : str    = None                       # requester's host
+  reader           : object = None                       # from the requester
+  writer           : object = None                       # to the requester
+  addr             : tuple  = None                       # of the requester
+  logSink          : object = None                       # (see runTask)
+  runner           : object = None                       # asyncio.Task
+
+  def summary(self) :
+    """
+    Return a (JSON-able) dict summarising this task.
+    """
+    aSummary = {
+      'taskId'        : self.taskId,
+      'taskName'      : self.name,
+      'state'         : self.state,
+      'estimatedLoad' : self.estimatedLoad,
+      'cores'         : self.cores,
+      'memory'        : self.memory,
+      'costKey'       : self.costKey,
+      'submitted'     : self.submitted
+    }
+    if 'estimatedDuration' in self.request :
+      aSummary['estimatedDuration'] = self.request['estimatedDuration']
+    if self.duplicateOf :
+      aSummary['duplicateOf'] = self.duplicateOf
+    if self.sharedWith :
+      aSummary['sharedWith'] = self.sharedWith
+    if self.followers :
+      aSummary['followers'] = len(self.followers)
+    if self.host :
+      aSummary['worker']     = self.workerType
+      aSummary['workerName'] = self.workerName
+      aSummary['host']       = self.host.name
+      aSummary['started']    = self.started
+    return aSummary
+
+class TaskHistory :
+  """
+  A bounded ring buffer of the (dict) records of the most recently finished
+  tasks, together with an index (by `taskId`) of the records still in the
+  buffer.
+  """
+
+  __slots__ = ( 'records', 'index' )
+
+  def __init__(self, size=1000) :
+    self.records = deque(maxlen=size)
+    self.index   = {}
+
+  def add(self, aRecord) :
+    """
+    Add the record `aRecord`, forgetting the oldest record if the buffer is
+    full.
+    """
+    if self.records.maxlen < 1 : return
+    if len(self.records) == self.records.maxlen :
+      self.index.pop(self.records[0]['taskId'], None)
+    self.records.append(aRecord)
+    self.index[aRecord['taskId']] = aRecord
+
+  def get(self, taskId) :
+    """
+    Return the record of the finished task `taskId` (or None).
+    """
+    return self.index.get(taskId)
+
+class FarmState :
+  """
+  The single owner of the taskManager's state.
+
+  - `platforms`   : Platforms indexed by `platform`-`cpu`.
+
+  - `hosts`       : Hosts indexed by host name. A host is known while it is
+                    either monitored or has idle workers.
+
+  - `workerTypes` : a dict indexed by `workerType`. Each entry is a dict of the
+                    tools supported by this `workerType`.
+
+  - `idleHosts`   : a dict indexed by `workerType`. Each entry is a dict of the
+                    Hosts which currently have idle workers of this type.
+
+  - `workerTools` : a dict indexed by (`workerType`, host name). Each entry is
+                    the (frozen) set of tools provided by the workers of that
+                    type on that host.
+
+  - `toolIndex`   : a dict indexed by tool. Each entry is the set of
+                    (`workerType`, host name) pairs which provide that tool.
+
+  - `tasks`       : the pending and running Tasks indexed by `taskId`.
+
+  - `numPending`  : the number of pending Tasks.
+
+  - `clientPending` : the number of pending Tasks indexed by the requester's
+                      host (see the connections' `admission` limits).
+
+  - `inFlight`    : the shared (pending or running) Tasks indexed by the
+                    canonical hash of their requests (see `shareTask`).
+
+  - `taskHistory` : the TaskHistory of recently finished tasks.
+
+  - `memoryFraction` : the fraction of a host's total memory which may be
+                       reserved by running tasks.
+
+  - `scoreWeights`   : the weights used to compute each host's load score.
+
+  - `inputCacheSize` : the number of recently used input files remembered for
+                       each host.
+
+  - `affinityHosts`  : the name of the host which last ran a task with each
+                       (recently used) `affinity` (for example a ConTeXt
+                       document), and so holds that affinity's local caches.
+
+  The `capacityChanged` event is set whenever a worker becomes idle or a
+  running task releases its reserved capacity.
+  """
+
+  __slots__ = (
+    'platforms', 'hosts', 'workerTypes', 'idleHosts', 'workerTools',
+    'toolIndex', 'tasks', 'numPending', 'clientPending', 'inFlight',
+    'taskHistory', 'taskIds', 'memoryFraction', 'scoreWeights',
+    'inputCacheSize', 'affinityHosts', 'capacityChanged'
+  )
+
+  def __init__(self) :
+    self.platforms      = {}
+    self.hosts          = {}
+    self.workerTypes    = {}
+    self.idleHosts      = {}
+    self.workerTools    = {}
+    self.toolIndex      = {}
+    self.tasks          = {}
+    self.numPending     = 0
+    self.clientPending  = {}
+    self.inFlight       = {}
+    self.taskHistory     = TaskHistory()
+    self.memoryFraction  = maxMemoryFraction
+    self.scoreWeights    = dict(defaultScoreWeights)
+    self.inputCacheSize  = defaultInputCacheSize
+    self.affinityHosts   = OrderedDict()
+    self.capacityChanged = asyncio.Event()
+
+    # task ids are unique across taskManager restarts as they are prefixed
+    # with the (hex) time at which this taskManager started
+    self.taskIds = ( f"{int(time.time()):x}-{n}" for n in itertools.count(1) )
+
+  def getHost(self, hostName) :
+    """
+    Return the Host named `hostName` (creating it if it is not yet known).
+    """
+    if hostName not in self.hosts : self.hosts[hostName] = Host(hostName)
+    return self.hosts[hostName]
+
+  def forgetHostIfUnused(self, aHost) :
+    """
+    Remove the Host `aHost` if it is neither monitored nor has idle workers.
+    """
+    if aHost.platform or aHost.idleWorkers : return
+    if self.hosts.get(aHost.name) is aHost : del self.hosts[aHost.name]
+
+  ##########################################################################
+  # monitors
+
+  def addMonitor(self, hostName, platformName, maxLoad) :
+    """
+    Record that the host `hostName` (of the given platform) is now monitored
+    (by one more monitor or load reporting worker).
+    """
+    if platformName not in self.platforms :
+      self.platforms[platformName] = Platform(platformName)
+    thePlatform = self.platforms[platformName]
+    aHost = self.getHost(hostName)
+    if aHost.platform and aHost.platform is not thePlatform :
+      aHost.platform.hosts.pop(hostName, None)
+    aHost.platform = thePlatform
+    aHost.maxLoad  = maxLoad
+    aHost.loadSources += 1
+    thePlatform.hosts[hostName] = aHost
+    return aHost
+
+  def hostScore(self, hostData) :
+    """
+    Return the load score of a host: the weighted sum of the host's monitored
+    values (see `scoreWeights`). Values which the host's monitor does not
+    report count as zero.
+    """
+    return sum(
+      aWeight * hostData.get(aKey, 0)
+        for aKey, aWeight in self.scoreWeights.items()
+    )
+
+  def updateLoad(self, aHost, hostData) :
+    """
+    Record the latest load information from the host's monitor (and update
+    the host's load score).
+    """
+    hostData['score'] = self.hostScore(hostData)
+    aHost.load = hostData['score']
+    aHost.data = hostData
+    aHost.numCpus      = hostData.get('numCpus', 0)
+    aHost.speed        = hostData.get('speed', 1.0)
+    aHost.memTotal     = hostData.get('memTotal', 0)
+    aHost.memAvailable = hostData.get('memAvailable', 0)
+
+  def removeMonitor(self, aHost) :
+    """
+    Record that one of the monitors (or load reporting workers) of the host
+    `aHost` has gone. Once the host has no more monitors it is no longer
+    monitored, and its workers (if any) remain usable but are only chosen as a
+    last resort.
+    """
+    aHost.loadSources = max(aHost.loadSources - 1, 0)
+    if aHost.loadSources : return
+    if aHost.platform :
+      aHost.platform.hosts.pop(aHost.name, None)
+    aHost.platform = None
+    aHost.load     = unmonitoredLoad
+    aHost.data     = None
+    aHost.samples  = {}
+    aHost.numCpus  = 0
+    self.forgetHostIfUnused(aHost)
+
+  def freeCapacity(self, aHost) :
+    """
+    Return the (cores, memory) of the host `aHost` which are not reserved by
+    its running tasks (or None if the host's capacity is not known).
+
+    The free memory is limited both by the memory which has not been reserved
+    (as a fraction of the host's total memory) and by the memory which the
+    host's monitor last reported as available (which accounts for processes
+    which are not managed by the computeFarm).
+    """
+    if aHost.numCpus < 1 : return None
+    freeCores = aHost.numCpus - aHost.reservedCores
+    if aHost.memTotal < 1 : return (freeCores, float('inf'))
+    freeMemory = min(
+      self.maxMemory(aHost) - aHost.reservedMemory, aHost.memAvailable
+    )
+    return (freeCores, freeMemory)
+
+  def maxMemory(self, aHost) :
+    """
+    Return the memory of the host `aHost` which may be reserved by its
+    running tasks (when none of it is reserved).
+    """
+    if aHost.memTotal < 1 : return float('inf')
+    return aHost.memTotal * self.memoryFraction
+
+  ##########################################################################
+  # workers
+
+  def addWorker(self, aWorker, someTools) :
+    """
+    Add the (idle) worker `aWorker` (which supports the tools `someTools`).
+    """
+    workerType = aWorker.workerType
+    if workerType not in self.workerTypes : self.workerTypes[workerType] = {}
+    for aTool in someTools : self.workerTypes[workerType][aTool] = True
+
+    aHost = aWorker.host
+    self.indexTools(workerType, aHost.name, someTools)
+    if self.hosts.get(aHost.name) is not aHost : self.hosts[aHost.name] = aHost
+    if workerType not in aHost.idleWorkers :
+      aHost.idleWorkers[workerType] = deque()
+    aHost.idleWorkers[workerType].append(aWorker)
+
+    if workerType not in self.idleHosts : self.idleHosts[workerType] = {}
+    self.idleHosts[workerType][aHost.name] = aHost
+
+    self.capacityChanged.set()
+
+  def removeWorker(self, aWorker) :
+    """
+    Remove the idle worker `aWorker` (if it is still idle), pruning any
+    now empty worker queues.
+    """
+    aHost      = aWorker.host
+    workerType = aWorker.workerType
+    someWorkers = aHost.idleWorkers.get(workerType)
+    if someWorkers is None : return False
+    try :
+      someWorkers.remove(aWorker)
+    except ValueError :
+      return False
+    if not someWorkers :
+      del aHost.idleWorkers[workerType]
+      del self.idleHosts[workerType][aHost.name]
+      if not self.idleHosts[workerType] : del self.idleHosts[workerType]
+    self.forgetHostIfUnused(aHost)
+    return True
+
+  def indexTools(self, workerType, hostName, someTools) :
+    """
+    Record (in the toolIndex) the tools provided by the workers of the type
+    `workerType` on the host `hostName`.
+    """
+    aKey      = (workerType, hostName)
+    someTools = frozenset(someTools)
+    oldTools  = self.workerTools.get(aKey)
+    if oldTools == someTools : return
+    if oldTools :
+      for aTool in oldTools - someTools :
+        self.toolIndex[aTool].discard(aKey)
+        if not self.toolIndex[aTool] : del self.toolIndex[aTool]
+    self.workerTools[aKey] = someTools
+    for aTool in someTools :
+      if aTool not in self.toolIndex : self.toolIndex[aTool] = set()
+      self.toolIndex[aTool].add(aKey)
+
+  def capableWorkers(self, requiredTools, someWorkerTypes=None) :
+    """
+    Return the set of (`workerType`, host name) pairs which provide all of the
+    `requiredTools` (restricted to the `someWorkerTypes`, if given).
+    """
+    someKeySets = []
+    for aTool in requiredTools :
+      if aTool not in self.toolIndex : return set()
+      someKeySets.append(self.toolIndex[aTool])
+    if not someKeySets : return set()
+    someKeySets.sort(key=len)
+    capableKeys = set(someKeySets[0])
+    for someKeys in someKeySets[1:] : capableKeys &= someKeys
+    if someWorkerTypes :
+      capableKeys = {
+        aKey for aKey in capableKeys if aKey[0] in someWorkerTypes
+      }
+    return capableKeys
+
+  def hostsWithIdleWorkers(
+    self, someWorkerTypes, requiredTools=None, requiredPlatform=None
+  ) :
+    """
+    Return a dict (indexed by host name) of the (Host, list of workerTypes)
+    pairs for the Hosts which currently have an idle worker which can run a
+    task. 
+
+    The worker must be of one of the types `someWorkerTypes` and/or, if
+    `requiredTools` is given, must provide all of these tools. The host must
+    be of the `requiredPlatform`, if given.
+    """
+    someHosts = {}
+    def addIdleHost(aWorkerType, aHostName) :
+      if aWorkerType not in self.idleHosts : return
+      if aHostName not in self.idleHosts[aWorkerType] : return
+      aHost = self.idleHosts[aWorkerType][aHostName]
+      if requiredPlatform and \
+        (not aHost.platform or aHost.platform.name != requiredPlatform) :
+        return
+      if aHostName not in someHosts : someHosts[aHostName] = (aHost, [])
+      someHosts[aHostName][1].append(aWorkerType)
+
+    if requiredTools :
+      for aWorkerType, aHostName in \
+        self.capableWorkers(requiredTools, someWorkerTypes) :
+        addIdleHost(aWorkerType, aHostName)
+    else :
+      for aWorkerType in someWorkerTypes :
+        if aWorkerType not in self.idleHosts : continue
+        for aHostName in list(self.idleHosts[aWorkerType].keys()) :
+          addIdleHost(aWorkerType, aHostName)
+    return someHosts
+
+  def capableHosts(
+    self, someWorkerTypes, requiredTools=None, requiredPlatform=None
+  ) :
+    """
+    Return the list of the known Hosts which have (idle or busy) workers which
+    can run a task (see `hostsWithIdleWorkers`).
+    """
+    if requiredTools :
+      someKeys = self.capableWorkers(requiredTools, someWorkerTypes)
+    else :
+      someKeys = [
+        aKey for aKey in self.workerTools if aKey[0] in someWorkerTypes
+      ]
+    someHosts = {}
+    for _, aHostName in someKeys :
+      aHost = self.hosts.get(aHostName)
+      if aHost is None : continue
+      if requiredPlatform and \
+        (not aHost.platform or aHost.platform.name != requiredPlatform) :
+        continue
+      someHosts[aHostName] = aHost
+    return list(someHosts.values())
+
+  def allIdleWorkers(self) :
+    """
+    Return a list of all of the idle Workers.
+    """
+    someWorkers = []
+    for aHost in self.hosts.values() :
+      for aQueue in aHost.idleWorkers.values() :
+        someWorkers.extend(aQueue)
+    return someWorkers
+
+  def takeWorker(self, aHost, someWorkerTypes) :
+    """
+    Remove and return the first idle worker on the host `aHost` of one of the
+    types `someWorkerTypes` (or None if there is no such worker).
+    """
+    for aWorkerType in someWorkerTypes :
+      if aWorkerType in aHost.idleWorkers :
+        aWorker = aHost.idleWorkers[aWorkerType][0]
+        self.removeWorker(aWorker)
+        return aWorker
+    return None
+
+  ##########################################################################
+  # tasks
+
+  def newTaskId(self) :
+    """
+    Return a new unique task id.
+    """
+    return next(self.taskIds)
+
+  def addTask(self, aTask) :
+    """
+    Add the (pending) task `aTask` to the pending list of its required
+    platform (or of all known platforms if it has no required platform), and
+    count it as pending for its requester's host (its `client`).
+    """
+    self.tasks[aTask.taskId] = aTask
+    self.numPending += 1
+    self.clientPending[aTask.client] = \
+      self.clientPending.get(aTask.client, 0) + 1
+    if aTask.requiredPlatform :
+      somePlatforms = [ self.platforms[aTask.requiredPlatform] ]
+    else :
+      somePlatforms = list(self.platforms.values())
+    for aPlatform in somePlatforms :
+      aPlatform.pending[aTask] = True
+      aTask.platforms.append(aPlatform)
+
+  def startTask(self, aTask) :
+    """
+    Remove the task `aTask` from all of its pending lists and mark it as
+    started.
+    """
+    for aPlatform in aTask.platforms :
+      aPlatform.pending.pop(aTask, None)
+    aTask.platforms = []
+    if aTask.state == 'pending' :
+      self.numPending -= 1
+      self.clientPending[aTask.client] -= 1
+      if not self.clientPending[aTask.client] :
+        del self.clientPending[aTask.client]
+    aTask.state = 'started'
+
+  def shareTask(self, aTask, requestKey) :
+    """
+    Allow later taskRequests whose (canonical) hash is `requestKey` to follow
+    the (accepted) task `aTask` rather than being run themselves.
+    """
+    aTask.requestKey = requestKey
+    self.inFlight[requestKey] = aTask
+
+  def inFlightTask(self, requestKey) :
+    """
+    Return the shared (pending or running) task whose request's hash is
+    `requestKey` (or None).
+    """
+    return self.inFlight.get(requestKey)
+
+  def followTask(self, aLeader, aFollower) :
+    """
+    Add the task `aFollower` which shares the run of the (identical) task
+    `aLeader`. The follower's event is set once the leader has finished (when
+    the leader's `finalMessage` holds its results).
+    """
+    aFollower.state      = 'shared'
+    aFollower.sharedWith = aLeader.taskId
+    self.tasks[aFollower.taskId] = aFollower
+    aLeader.followers.append(aFollower)
+
+  def duplicateTask(self, aTask) :
+    """
+    Add (and return) a started speculative duplicate of the running task
+    `aTask`. The duplicate shares the original's request, and its taskId is
+    the original's taskId with a `.dup` suffix.
+    """
+    aDuplicate = Task(
+      f"{aTask.taskId}.dup", aTask.name, aTask.request, aTask.requestJson,
+      aTask.requiredPlatform, aTask.estimatedLoad, aTask.submitted,
+      cores=aTask.cores, memory=aTask.memory, costKey=aTask.costKey,
+      state='started', duplicateOf=aTask.taskId
+    )
+    self.tasks[aDuplicate.taskId] = aDuplicate
+    return aDuplicate
+
+  def assignTask(self, aTask, aWorker) :
+    """
+    Record that the task `aTask` is now running on the worker `aWorker`, and
+    reserve the task's estimated load, cores and memory on the worker's host.
+    The task's inputs (and affinity) are recorded as recently used on this
+    host.
+    """
+    aTask.state      = 'running'
+    aTask.workerType = aWorker.workerType
+    aTask.workerName = aWorker.workerName
+    aTask.host       = aWorker.host
+    aTask.started    = time.time()
+    aWorker.host.load           += aTask.estimatedLoad
+    aWorker.host.reservedCores  += aTask.cores
+    aWorker.host.reservedMemory += aTask.memory
+    aWorker.host.runningTasks   += 1
+    self.useInputs(aWorker.host, aTask.request.get('inputs'))
+    self.useAffinity(aWorker.host, aTask.request.get('affinity'))
+
+  def useInputs(self, aHost, someInputs) :
+    """
+    Record that the input files `someInputs` have been used on the host
+    `aHost`, forgetting the least recently used files once more than
+    `inputCacheSize` files are remembered.
+    """
+    if not someInputs : return
+    recentFiles = aHost.recentFiles
+    for anInput in someInputs :
+      if anInput in recentFiles : recentFiles.move_to_end(anInput)
+      else : recentFiles[anInput] = True
+    while self.inputCacheSize < len(recentFiles) :
+      recentFiles.popitem(last=False)
+
+  def useAffinity(self, aHost, anAffinity) :
+    """
+    Record that the affinity `anAffinity` has (most recently) been used on the
+    host `aHost`, forgetting the least recently used affinities once more than
+    `inputCacheSize` are remembered.
+    """
+    if not anAffinity : return
+    self.affinityHosts[anAffinity] = aHost.name
+    self.affinityHosts.move_to_end(anAffinity)
+    while self.inputCacheSize < len(self.affinityHosts) :
+      self.affinityHosts.popitem(last=False)
+
+  def affinityHost(self, aTask, someHosts) :
+    """
+    Return the host (dict) from the list `someHosts` which last ran a task with
+    the same `affinity` as the taskRequest `aTask`, so long as it is below its
+    maxLoad (or None).
+    """
+    hostName = self.affinityHosts.get(aTask.get('affinity'))
+    if hostName is None : return None
+    for aHost in someHosts :
+      if aHost['host'] == hostName and aHost['load'] < aHost['maxLoad'] :
+        return aHost
+    return None
+
+  def unassignTask(self, aTask) :
+    """
+    Release the estimated load, cores and memory reserved (on its host) by the
+    task `aTask` (for example, when its worker has died before the task could
+    be sent to it).
+    """
+    aHost = aTask.host
+    if not aHost : return
+    aHost.load           -= aTask.estimatedLoad
+    aHost.reservedCores  -= aTask.cores
+    aHost.reservedMemory -= aTask.memory
+    aHost.runningTasks   -= 1
+    aTask.state      = 'started'
+    aTask.workerType = None
+    aTask.workerName = None
+    aTask.host       = None
+    aTask.started    = None
+    self.capacityChanged.set()
+
+  def removeTask(self, aTask) :
+    """
+    Remove the (pending or finished) task `aTask`.
+    """
+    self.startTask(aTask)
+    self.tasks.pop(aTask.taskId, None)
+    if aTask.requestKey and self.inFlight.get(aTask.requestKey) is aTask :
+      del self.inFlight[aTask.requestKey]
+
+  def finishTask(self, aTask, returncode, resources=None) :
+    """
+    Remove the task `aTask` and record it (together with its returncode and
+    the resources it used, if reported by its worker) in the taskHistory,
+    releasing the cores and memory reserved by the task. A task whose worker
+    closed the connection without sending a returncode is recorded as `lost`.
+    """
+    self.removeTask(aTask)
+    if aTask.host :
+      aTask.host.reservedCores  -= aTask.cores
+      aTask.host.reservedMemory -= aTask.memory
+      aTask.host.runningTasks   -= 1
+      self.capacityChanged.set()
+    aRecord = aTask.summary()
+    aRecord['state']      = 'finished' if returncode is not None else 'lost'
+    aRecord['finished']   = time.time()
+    aRecord['returncode'] = returncode
+    if resources : aRecord['resources'] = resources
+    if aTask.started :
+      aRecord['waitTime'] = aTask.started - aTask.submitted
+      aRecord['runTime']  = aRecord['finished'] - aTask.started
+    self.taskHistory.add(aRecord)
+    return aRecord
+
+  def findTask(self, taskId) :
+    """
+    Return a (dict) record of the pending, running or recently finished task
+    `taskId` (or None if this task is not known).
+    """
+    if taskId in self.tasks : return self.tasks[taskId].summary()
+    return self.taskHistory.get(taskId)
+
+farmState = FarmState()
@@ -0,0 +1,142 @@
+"""
+Provide the taskManager's splitting of test suites into (parallel) shards.
+
+A client may submit a whole test suite (a `testSuite` request) rather than a
+single task. The suite's tests are split into shards, balanced by each test's
+predicted duration, and each shard is run as an ordinary task (on any of the
+suite's acceptable workers). Once all of the shards have finished, their
+results are merged into a single outcome.
+
+A test's duration is learned (by the `costModel`, under the signature
+`test:<suite>:<test>`) from the result lines which the suite's command prints:
+
+  cfTestResult <test> <passed|failed|skipped> <seconds>
+
+Tests which have not yet been observed are predicted to take the mean
+duration of the suite's known tests (or one second for a new suite).
+
+The tests are split using the "longest processing time first" heuristic: in
+decreasing order of duration, each test is given to the shard whose total
+predicted duration is (so far) the smallest.
+
+This "module" MUST be concatinated AFTER the `taskManager_2_costModel.py`
+"module".
+"""
+
+import heapq
+
+testResultMarker = 'cfTestResult'
+
+testOutcomes = ( 'passed', 'failed', 'skipped' )
+
+# the number of shards used if the suite does not ask for a number
+defaultTestShards = 4
+
+def testSignature(suiteName, aTest) :
+  """
+  Return the costModel signature of the test `aTest` of the suite `suiteName`.
+  """
+  return f"test:{suiteName}:{aTest}"
+
+def predictTestDurations(suiteName, someTests) :
+  """
+  Return a dict of the predicted (normalised) duration of each of the tests
+  `someTests` of the suite `suiteName`.
+  """
+  someDurations = {}
+  for aTest in someTests :
+    someStats = costModel.stats.get(testSignature(suiteName, aTest))
+    if someStats and someStats.duration is not None :
+      someDurations[aTest] = someStats.duration
+  default = 1.0
+  if someDurations :
+    default = sum(someDurations.values()) / len(someDurations)
+  return {
+    aTest : someDurations.get(aTest, default) for aTest in someTests
+  }
+
+def shardTests(someDurations, numShards) :
+  """
+  Split the tests (the keys of the dict `someDurations`) into (at most)
+  `numShards` shards with (roughly) equal total durations. Returns a list of
+  (total duration, list of tests) pairs, one for each non-empty shard.
+  """
+  numShards = max(1, min(numShards, len(someDurations)))
+  someShards = [ [] for _ in range(numShards) ]
+  totals = [ (0.0, anIndex) for anIndex in range(numShards) ]
+  for aTest in sorted(
+    someDurations, key=lambda aTest : (-someDurations[aTest], aTest)
+  ) :
+    total, anIndex = heapq.heappop(totals)
+    someShards[anIndex].append(aTest)
+    heapq.heappush(totals, (total + someDurations[aTest], anIndex))
+  shardTotals = { anIndex : total for total, anIndex in totals }
+  return [
+    ( shardTotals[anIndex], someShards[anIndex] )
+      for anIndex in range(numShards) if someShards[anIndex]
+  ]
+
+def shardCommand(someWords, someTests) :
+  """
+  Return the command words `someWords` with the (single word) placeholder
+  `{tests}` replaced by the shard's tests (which are appended if there is no
+  placeholder).
+  """
+  if '{tests}' not in someWords : return list(someWords) + list(someTests)
+  shardWords = []
+  for aWord in someWords :
+    if aWord == '{tests}' : shardWords.extend(someTests)
+    else                  : shardWords.append(aWord)
+  return shardWords
+
+def parseTestResult(aLine) :
+  """
+  Return the (test, outcome, seconds) of a test result line (or None).
+  """
+  markerStart = aLine.find(testResultMarker)
+  if markerStart < 0 : return None
+  someWords = aLine[markerStart:].split()
+  if len(someWords) < 3 or someWords[2] not in testOutcomes : return None
+  seconds = None
+  if 3 < len(someWords) :
+    try :
+      seconds = float(someWords[3])
+    except ValueError :
+      pass
+  return someWords[1], someWords[2], seconds
+
+class ShardWriter :
+  """
+  A stand in for a client's stream writer which keeps the (newline
+  terminated JSON) messages sent to a shard's "client".
+  """
+
+  __slots__ = ( 'buffer', 'messages' )
+
+  def __init__(self) :
+    self.buffer   = b''
+    self.messages = []
+
+  def write(self, someData) :
+    self.buffer += someData
+    while b"\n" in self.buffer :
+      aLine, self.buffer = self.buffer.split(b"\n", 1)
+      if aLine.strip() : self.messages.append(json.loads(aLine))
+
+  async def drain(self) :
+    pass
+
+  def close(self) :
+    pass
+
+  async def wait_closed(self) :
+    pass
+
+  def result(self) :
+    """
+    Return the shard's final (`returncode`) message (or None if the shard
+    could not be run).
+    """
+    for aMessage in reversed(self.messages) :
+      if 'returncode' in aMessage : return aMessage
+    return None
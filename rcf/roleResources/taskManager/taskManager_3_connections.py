@@ -4,49 +4,92 @@ tcpTaskServer.
 
 ------------------------------------------------------------------------------
 
-  The task manager, maintains four globals, `workerQueues`, `workerTypes`,
-  `hostLoads` and `hostTypes`.
+  The state of the computeFarm (the known platforms, hosts, idle workers and
+  pending or running tasks) is held by the `farmState` (see the
+  `taskManager_2_state` "module"). The connection handlers only change this
+  state using the `farmState` methods, which keep all of its cross-indexes
+  consistent.
 
-  - `workerQueues`  : is a dict of dicts indexed by `workerType`s and
-                      `workerHost`s. Each entry is a worker waiting for an
-                      appropriate task.
+  The task manager also maintains four further globals, `fileLocations`,
+  `schedulingPolicy`, `speculation` and `admission`.
 
-  - `workerTypes`   : is a dict indexed by `workerType`. Each entry is a list of
-                      the tools supported by this `workerType`.
+  - `fileLocations`    : is a dict containing the (sshfs) `orig` and `dest`
+                         paths.
 
-  - `hostLoads`     : is a dict indexed by `workerHost`. Each entry contains the
-                      latest scaled load average for use when choosing the next
-                      worker to be given a task.
+  - `schedulingPolicy` : decides which pending taskRequest to start next, and on
+                         which host (see the `schedulingPolicies` "module").
 
-  - `hostData`      : is a dict indexed by `workerHost`. Each entry is a dict
-                      containing the latest information obtained from the
-                      monitor process.
+  - `speculation`      : is a dict configuring the speculative duplication of
+                         idempotent straggler tasks (see `runTaskRequest`).
 
-  - `hostTypes`     : is a dict of dict indexed by `workerPlatform`-`workerCPU`.
-                      Each entry contains a set of known hosts of the
-                      appropriate platform and cpu type. 
-
-  - 'assignedTasks' : is a dict of currently assigned tasks (indexed by cfdoit
-                      taskNames). Each entry contains the 'state',
-                      'estimatedLoad' and details about which machine and worker
-                      has been assigned to this task.
+  - `admission`        : is a dict limiting the number of pending taskRequests
+                         (see `admissionRefusal`).
 """
 
-workerQueues   = {}
-workerTypes    = {}
-platformQueues = {}
-hostLoads      = {}
-hostData       = {}
-hostTypes      = {}
 fileLocations  = {}
-assignedTasks  = {}  
+
+schedulingPolicy = SchedulingPolicy()
+
+# an idempotent task is a straggler once it has run for `slowdown` times its
+# predicted duration (and at least `minDelay` seconds). If no host can take a
+# duplicate of a straggler, we try again every `interval` seconds.
+speculation = {
+  'enabled'  : False,
+  'slowdown' : 2.0,
+  'minDelay' : 10,
+  'interval' : 5
+}
+
+# a taskRequest is refused (and its requester asked to retry after
+# `retryAfter` seconds) once `maxPending` taskRequests, or `maxPendingPerClient`
+# taskRequests from the requester's host, are pending (a test suite counts as
+# one taskRequest per shard). Every `checkInterval` seconds the pending
+# taskRequests whose requesters have gone are dropped.
+admission = {
+  'maxPending'          : 10000,
+  'maxPendingPerClient' : 2000,
+  'retryAfter'          : 5,
+  'checkInterval'       : 1
+}
+
+async def recordHostLoad(aHost, jsonData) :
+  """
+  Merge the (possibly partial) load sample `jsonData` (from either a monitor
+  or a load reporting worker) into the previous samples of the host `aHost`
+  and then update the host's load.
+  """
+  samples = aHost.samples
+  samples.update(jsonData)
+  if 'numCpus' not in samples or 'scale' not in samples : return
+  workLoad = samples.get('wlNow', samples['wlOne'])
+  scaled   = workLoad/(samples['numCpus']*samples['scale'])
+  jsonData['name']   = 'monitor'
+  jsonData['level']  = 'debug'
+  jsonData['scaled'] = scaled
+  await cutelog(jsonData)
+  hostData = dict(samples)
+  hostData.pop('type', None)
+  hostData.pop('host', None)
+  hostData.pop('taskType', None)
+  hostData['maxLoad']  = aHost.maxLoad
+  hostData['wlScaled'] = scaled
+  farmState.updateLoad(aHost, hostData)
+  hostHistory.record(aHost)
 
 async def handleMonitorConnection(task, reader, writer) :
   """
   Handle a connection from a monitor.
 
-  We record the load average information provided for that machine and then
-  close the connection.
+  We record the load average information provided for that machine (until the
+  monitor closes the connection).
+
+  A monitor may send only those values which have changed since its last
+  report, so each message is merged into the host's previous messages (see
+  `recordHostLoad`). The host's scaled load uses the instantaneous work load (`wlNow`) when the
+  monitor provides it, otherwise the one minute load average (`wlOne`). The
+  host's load score (used by the `dispatcher` and to choose a worker's host)
+  combines this scaled load with the host's (optional) pressure stall, disk,
+  network and swap values (see `FarmState.hostScore`).
 
   The task dict MUST contain the following keys:
 
@@ -63,11 +106,20 @@ async def handleMonitorConnection(task, reader, writer) :
   - wlOne     : work load average over last minute
   - wlFive    : work load average over last five minutes (not currently used)
   - wlFifteen : work load average over last fifteen minutes (not currently used)
+
+  - wlNow     : (optional) the instantaneous work load
   
   - numCpus   : number of cpu/cores
+
+  - memTotal  : (optional) the total memory (MB) of this machine
+
+  - memAvailable : (optional) the memory (MB) currently available on this
+                   machine
   
   - scale     : a scale factor configured for this machine
 
+  (see the `hostMetrics` "module" for the other (optional) values)
+
   """
   if 'host' not in task or 'platform' not in task or 'cpuType' not in task :
     await cutelogDebug(f"new monitor without a host, platform, or cpuType... dropping the connection...")
@@ -83,12 +135,8 @@ async def handleMonitorConnection(task, reader, writer) :
   maxLoad = 2.0
   if 'maxLoad' in task : maxLoad = task['maxLoad']
 
-  if thePlatform not in hostTypes : hostTypes[thePlatform] = {}
-  if thePlatform not in platformQueues : 
-    platformQueues[thePlatform] = asyncio.Queue()
-
-  if monitoredHost not in hostTypes[thePlatform] :
-    hostTypes[thePlatform][monitoredHost] = maxLoad
+  theHost = farmState.addMonitor(monitoredHost, thePlatform, maxLoad)
+  theHost.samples.update({ 'platform' : mPlatform, 'cpuType' : mCpuType })
 
   await cutelogDebug(f"Got a new monitor connection from {monitoredHost}...")
   while not reader.at_eof() :
@@ -97,36 +145,13 @@ async def handleMonitorConnection(task, reader, writer) :
     except :
       await cutelogDebug(f"{task['host']} monitor close connection...")
       break
+    if not data : break
     message = data.decode()
-    jsonData = json.loads(message)
-    scaled   = jsonData['wlOne']/(jsonData['numCpus']*jsonData['scale'])
-    jsonData['name']   = 'monitor'
-    jsonData['level']  = 'debug'
-    jsonData['scaled'] = scaled
-    await cutelog(jsonData)
-    hostLoads[monitoredHost] = scaled
-    hostData[monitoredHost] = {
-      'numCpus'   : jsonData['numCpus'],
-      'maxLoad'   : maxLoad,
-      'platform'  : mPlatform,
-      'cpuType'   : mCpuType,
-      'scale'     : jsonData['scale'],
-      'wlScaled'  : scaled,
-      'wlOne'     : jsonData['wlOne'],
-      'wlFive'    : jsonData['wlFive'],
-      'wlFifteen' : jsonData['wlFifteen']
-    }
+    await recordHostLoad(theHost, json.loads(message))
 
-  # clean up the hostTypes and hostLoads global variables by removing this
-  # monitored host
-  if thePlatform in hostTypes :
-    if monitoredHost in hostTypes[thePlatform] :
-        del hostTypes[thePlatform][monitoredHost]
-        if not hostTypes[thePlatform] :
-          del hostTypes[thePlatform]
-
-  if monitoredHost in hostLoads :
-    del hostLoads[monitoredHost]
+  # this host is no longer monitored by this monitor (once it has no monitors
+  # its workers are only used as a last resort)
+  farmState.removeMonitor(theHost)
 
   await cutelogDebug(f"Closing monitor connection ...")
   writer.close()
@@ -144,12 +169,25 @@ async def handleWorkerConnection(task, addr, reader, writer) :
   - taskType       : used to choose the correct worker sub-queue
 
   - host           : the name of the worker's machine (use to match with
-                     hostLoads)
+                     the host's monitor)
 
   - workerName     : (optional) the name of this worker (for logging)
 
   - availableTools : (optional) a list of the tools that this worker can use
 
+  - heartbeat      : (optional) True if this worker answers `ping` messages
+                     (with `pong` messages) while it is idle
+
+  - reportLoad     : (optional) a dict (with the `platform`, `cpuType` and
+                     `maxLoad` keys of a monitor's initial message) if this
+                     worker reports its host's load (in place of a separate
+                     monitor). The worker then sends `load` messages (with the
+                     same keys as a monitor's messages) on this connection,
+                     both while it is idle and while it runs a task.
+
+  While the worker is idle, its connection is watched (by `watchIdleWorker`) so
+  that a worker which dies is removed immediately rather than being discovered
+  when a task is sent to it.
   """
   if 'host' not in task :
     await cutelogDebug(f"new worker without a host... dropping the connection...")
@@ -173,24 +211,107 @@ async def handleWorkerConnection(task, addr, reader, writer) :
 
   await cutelogDebug(f"Got a new worker connection...", name=taskType)
   await cutelogDebug(task, name=taskType)
-  if taskType not in workerQueues :
-    workerQueues[taskType] = {}
-  if taskType not in workerTypes :
-    workerTypes[taskType] = {}
-  if 'availableTools' in task :
-    for aTool in task['availableTools'] :
-      workerTypes[taskType][aTool] = True
-  if workerHost not in workerQueues[taskType] :
-    if workerHost not in hostLoads : hostLoads[workerHost] = 1000
-    workerQueues[taskType][workerHost] = asyncio.Queue()
+  someTools = []
+  if 'availableTools' in task : someTools = task['availableTools']
   await cutelogDebug(f"Queing {taskType!r} worker on {workerHost}")
-  await workerQueues[taskType][workerHost].put({
-    'taskType'   : taskType,
-    'workerName' : workerName,
-    'addr'       : addr,
-    'reader'     : reader,
-    'writer'     : writer
-  })
+  theHost     = farmState.getHost(workerHost)
+  reportsLoad = False
+  reportLoad  = task.get('reportLoad')
+  if isinstance(reportLoad, dict) and \
+    'platform' in reportLoad and 'cpuType' in reportLoad :
+    thePlatform = f"{reportLoad['platform'].lower()}-{reportLoad['cpuType'].lower()}"
+    theHost = farmState.addMonitor(
+      workerHost, thePlatform, reportLoad.get('maxLoad', 2.0)
+    )
+    theHost.samples.update({
+      'platform' : reportLoad['platform'],
+      'cpuType'  : reportLoad['cpuType']
+    })
+    reportsLoad = True
+  theWorker = Worker(
+    taskType, workerName, theHost, addr, reader, writer,
+    heartbeat=bool(task.get('heartbeat', False)), lastSeen=time.time(),
+    reportsLoad=reportsLoad
+  )
+  farmState.addWorker(theWorker, someTools)
+  theWorker.watcher = asyncio.create_task(watchIdleWorker(theWorker))
+
+async def dropIdleWorker(aWorker, reason) :
+  """
+  Remove the idle worker `aWorker` and close its connection.
+  """
+  if not farmState.removeWorker(aWorker) : return
+  releaseLoadReporter(aWorker)
+  await cutelogDebug(
+    f"Dropping the idle {aWorker.workerType} worker {aWorker.workerName} on {aWorker.host.name} ({reason})",
+    name=aWorker.workerType
+  )
+  try :
+    aWorker.writer.close()
+  except Exception :
+    pass
+
+def releaseLoadReporter(aWorker) :
+  """
+  Record that the worker `aWorker` no longer reports its host's load (since
+  its connection has closed).
+  """
+  if not aWorker.reportsLoad : return
+  aWorker.reportsLoad = False
+  farmState.removeMonitor(aWorker.host)
+
+async def watchIdleWorker(aWorker) :
+  """
+  Watch the connection of the idle worker `aWorker` until either the worker is
+  given a task (when this watcher is cancelled by `stopWatchingWorker`) or the
+  connection is closed (when the worker is dropped).
+
+  The only messages expected from an idle worker are `pong` replies to the
+  heartbeat `ping`s and (for load reporting workers) `load` messages.
+  """
+  while True :
+    try :
+      data = await aWorker.reader.readline()
+    except asyncio.CancelledError :
+      raise
+    except Exception :
+      data = None
+    if not data :
+      await dropIdleWorker(aWorker, "connection closed")
+      return
+    aWorker.lastSeen = time.time()
+    if data.startswith(b'{"type": "load"') :
+      await recordHostLoad(aWorker.host, json.loads(data))
+
+async def stopWatchingWorker(aWorker) :
+  """
+  Stop watching the (no longer idle) worker's connection so that the task
+  handler can read the worker's results.
+  """
+  if aWorker.watcher :
+    aWorker.watcher.cancel()
+    await asyncio.wait([ aWorker.watcher ])
+    aWorker.watcher = None
+
+async def workerHeartbeat(interval, timeout) :
+  """
+  Every `interval` seconds send a `ping` to each idle worker which supports
+  heartbeats, dropping any of these workers which have not been heard from in
+  the last `timeout` seconds.
+  """
+  pingJson = json.dumps({ 'type' : 'ping' }).encode() + b"\n"
+  while True :
+    await asyncio.sleep(interval)
+    timeNow = time.time()
+    for aWorker in farmState.allIdleWorkers() :
+      if not aWorker.heartbeat : continue
+      if timeout < timeNow - aWorker.lastSeen :
+        await dropIdleWorker(aWorker, f"no heartbeat for {timeout} seconds")
+        continue
+      try :
+        aWorker.writer.write(pingJson)
+      except Exception :
+        await dropIdleWorker(aWorker, "could not send heartbeat")
 
 async def handleQueryConnection(task, reader, writer) :
   """
@@ -214,6 +335,9 @@ async def handleQueryConnection(task, reader, writer) :
   - hostTypes : is a dict of "sets" indexed by the `platform`-`cpu` and
                 available workerTypes for that `platform`-`cpu` combination.
 
+  - actionCache : is a dict of the number of `entries` in the actionCache, and
+                  its `hits` and `misses`.
+
   The task dict MUST have the following keys:
 
   (none)
@@ -221,101 +345,836 @@ async def handleQueryConnection(task, reader, writer) :
   """
   await cutelogDebug(f"Got a worker query connection...", name='query')
 
-  # collect information about the platformQueues
+  # collect information about the pending tasks on each platform
   lPlatformQueues = {}
-  for aPlatform, aQueue in platformQueues.items() :
-    lPlatformQueues[aPlatform] = aQueue.empty()
+  for aPlatformName, aPlatform in farmState.platforms.items() :
+    lPlatformQueues[aPlatformName] = not aPlatform.pending
 
   # collect the host type information (platform, cpuType)
   lHostTypes = {}
-  for platformKey, platformValue in hostTypes.items() :
-    if platformKey not in lHostTypes : lHostTypes[platformKey] = {}
-    for aHost in platformValue.keys() :
-      for aWorkerType, someHosts in workerQueues.items() :
-        if aHost in someHosts : lHostTypes[platformKey][aWorkerType] = True
+  for aPlatformName, aPlatform in farmState.platforms.items() :
+    if not aPlatform.hosts : continue
+    lHostTypes[aPlatformName] = {}
+    for aHost in aPlatform.hosts.values() :
+      for aWorkerType in aHost.idleWorkers :
+        lHostTypes[aPlatformName][aWorkerType] = True
+
+  # collect information about the hosts
+  lHostLoads        = {}
+  lHostData         = {}
+  lHostReservations = {}
+  for aHostName, aHost in farmState.hosts.items() :
+    lHostLoads[aHostName] = aHost.load
+    if aHost.data : lHostData[aHostName] = aHost.data
+    lHostReservations[aHostName] = {
+      'cores'  : aHost.reservedCores,
+      'memory' : aHost.reservedMemory
+    }
 
-  # collect information about the current available workers and tools
+  # collect information about the known workers and tools
   lWorkers = {}
   lTools   = {}
-  for workerType in workerQueues :
-    if workerType not in lWorkers : lWorkers[workerType] = True
-    if workerType in workerTypes :
-      for aTool in workerTypes[workerType].keys() :
-        if aTool not in lTools : lTools[aTool] = {}
-        if workerType not in lTools[aTool] :
-          lTools[aTool][workerType] = True
-      
+  for workerType, someTools in farmState.workerTypes.items() :
+    lWorkers[workerType] = True
+    for aTool in someTools.keys() :
+      if aTool not in lTools : lTools[aTool] = {}
+      lTools[aTool][workerType] = True
+
+  lAssignedTasks = {}
+  for aTaskId, aTask in farmState.tasks.items() :
+    lAssignedTasks[aTaskId] = aTask.summary()
+
   # send worker information 
   print("Sending worker information to queryWorkers/cfdoit")
   writer.write(json.dumps({
     'type'                : 'workerQuery',
     'taskType'            : 'workerQuery',
     'hostTypes'           : lHostTypes,
-    'hostLoads'           : hostLoads,
-    'hostData'            : hostData,
+    'hostLoads'           : lHostLoads,
+    'hostData'            : lHostData,
+    'hostReservations'    : lHostReservations,
     'workers'             : lWorkers,
     'tools'               : lTools,
     'files'               : fileLocations,
     'platformQueuesEmpty' : lPlatformQueues,
-    'assignedTasks'       : assignedTasks
+    'assignedTasks'       : lAssignedTasks,
+    'actionCache'         : {
+      'entries' : len(actionCache.entries),
+      'hits'    : actionCache.hits,
+      'misses'  : actionCache.misses
+    }
   }).encode())
   await writer.drain()
   writer.write(b"\n")
   await writer.drain()
 
+async def handleTaskQueryConnection(task, reader, writer) :
+  """
+  Handle a taskQuery connection.
+
+  We return the record of the pending, running or recently finished task with
+  the `taskId` provided as a JSON dict with the following keys:
+
+  - found : True if the task is known
+
+  - task  : (if found) the task's record (its `taskId`, `taskName`, `state`,
+            `submitted` time, and, once assigned, its `worker`, `workerName`,
+            `host` and `started` time, and once finished, its `finished` time,
+            `waitTime`, `runTime` and `returncode`).
+
+  The task dict MUST have the following keys:
+
+  - taskId : the (server assigned) id of the task
+  """
+  await cutelogDebug(f"Got a task query connection...", name='query')
+
+  aRecord = None
+  if 'taskId' in task : aRecord = farmState.findTask(task['taskId'])
+
+  aReply = {
+    'type'     : 'taskQuery',
+    'taskType' : 'taskQuery',
+    'found'    : aRecord is not None
+  }
+  if aRecord : aReply['task'] = aRecord
+  writer.write(json.dumps(aReply).encode())
+  writer.write(b"\n")
+  await writer.drain()
+
+async def handleHostHistoryConnection(task, reader, writer) :
+  """
+  Handle a hostHistory connection.
+
+  We return the (downsampled) history of the load of one (or all) of the
+  hosts (see the `taskManager_2_metrics` "module") as a JSON dict with the
+  following keys:
+
+  - start   : the start of the window (unix time)
+
+  - end     : the end of the window (unix time)
+
+  - hosts   : a dict, indexed by host name, of each host's window (a dict of
+              lists: the `times` of each bucket and the mean of each metric in
+              that bucket)
+
+  The task dict MAY have the following keys:
+
+  - hostName : the host (default all hosts)
+
+  - window   : the length of the window in seconds (default 3600)
+
+  - end      : the end of the window (unix time, default now)
+
+  - points   : the (maximum) number of points in each window (default 60)
+
+  - metrics  : the list of metrics to return (default all)
+  """
+  await cutelogDebug(f"Got a host history connection...", name='query')
+
+  end    = float(task.get('end') or time.time())
+  start  = end - float(task.get('window') or 3600)
+  points = int(task.get('points') or 60)
+  someHosts = hostHistory.rings.keys()
+  if task.get('hostName') : someHosts = [ task['hostName'] ]
+
+  lHosts = {}
+  for aHostName in someHosts :
+    aWindow = hostHistory.window(
+      aHostName, start, end, points, task.get('metrics')
+    )
+    if aWindow is not None : lHosts[aHostName] = aWindow
+
+  writer.write(json.dumps({
+    'type'     : 'hostHistory',
+    'taskType' : 'hostHistory',
+    'start'    : start,
+    'end'      : end,
+    'hosts'    : lHosts
+  }).encode())
+  writer.write(b"\n")
+  await writer.drain()
+
+async def handleBlobConnection(task, reader, writer) :
+  """
+  Handle a connection to the blobStore (see the `taskManager_2_blobStore`
+  "module").
+
+  - blobHas : the task dict MUST have a `hashes` key (a list of blob hashes).
+              We return a JSON dict whose `missing` key lists those blobs which
+              are not in the store.
+
+  - blobPut : the task dict MUST have a `blobs` key (a list of [hash, size]
+              pairs). The contents of each blob (in the same order) follow the
+              task dict. We return a JSON dict whose `stored` key lists the
+              blobs which have been stored (a blob whose contents do not match
+              its hash is not stored).
+
+  - blobGet : the task dict MUST have a `hashes` key (a list of blob hashes).
+              We return, for each blob, a JSON header line (with the blob's
+              `hash` and `size`, -1 if the blob is missing) followed by the
+              blob's contents.
+  """
+  if not blobStore.path :
+    await cutelogDebug("No blob store has been configured... dropping the connection")
+    writer.close()
+    await writer.wait_closed()
+    return
+
+  if task['type'] == 'blobHas' :
+    writer.write(json.dumps({
+      'type'    : 'blobHas',
+      'missing' : [
+        aHash for aHash in task.get('hashes', []) if not blobStore.has(aHash)
+      ]
+    }).encode() + b"\n")
+
+  elif task['type'] == 'blobPut' :
+    someStored = []
+    for aHash, size in task.get('blobs', []) :
+      if not isBlobHash(aHash) or size < 0 : break
+      try :
+        if await blobStore.receive(reader, aHash, size) :
+          someStored.append(aHash)
+      except asyncio.IncompleteReadError :
+        await cutelogDebug("The blob uploader has gone", name='blobStore')
+        break
+    await cutelogDebug(f"Stored {len(someStored)} blobs", name='blobStore')
+    writer.write(json.dumps({
+      'type'   : 'blobPut',
+      'stored' : someStored
+    }).encode() + b"\n")
+
+  elif task['type'] == 'blobGet' :
+    for aHash in task.get('hashes', []) :
+      await blobStore.send(writer, aHash)
+
+  await writer.drain()
+  writer.close()
+  await writer.wait_closed()
+
+async def handleActionCacheConnection(task, reader, writer) :
+  """
+  Handle a connection to the actionCache (see the `taskManager_2_actionCache`
+  "module").
+
+  - cacheGet : the task dict MUST have a `key` key. We return a JSON dict whose
+               `found` key is True if there is an entry for this key (and
+               whose `entry` key is then that entry).
+
+  - cachePut : the task dict MUST have the `key` and `entry` keys. We return a
+               JSON dict whose `stored` key is True if the entry has been
+               stored.
+  """
+  aKey = str(task.get('key', ''))
+  if task['type'] == 'cacheGet' :
+    anEntry = actionCache.get(aKey) if aKey else None
+    aReply = {
+      'type'  : 'cacheGet',
+      'found' : anEntry is not None
+    }
+    if anEntry is not None : aReply['entry'] = anEntry
+  else :
+    aReply = {
+      'type'   : 'cachePut',
+      'stored' : bool(aKey) and actionCache.put(aKey, task.get('entry'))
+    }
+  await cutelogDebug(
+    f"{task['type']} {aKey} : {aReply.get('found', aReply.get('stored'))}",
+    name='actionCache'
+  )
+  writer.write(json.dumps(aReply).encode() + b"\n")
+  await writer.drain()
+  writer.close()
+  await writer.wait_closed()
+
+def hostView(aHost) :
+  """
+  Return the (dict) view of the Host `aHost` used by the schedulingPolicy.
+  The host's `recentFiles` are shared (not copied).
+  """
+  aView = {
+    'host'        : aHost.name,
+    'load'        : aHost.load,
+    'maxLoad'     : aHost.maxLoad,
+    'speed'       : aHost.speed,
+    'recentFiles' : aHost.recentFiles
+  }
+  freeCapacity = farmState.freeCapacity(aHost)
+  if freeCapacity :
+    aView['numCpus']    = aHost.numCpus
+    aView['maxMemory']  = farmState.maxMemory(aHost)
+    aView['freeCores']  = freeCapacity[0]
+    aView['freeMemory'] = freeCapacity[1]
+  return aView
+
+# the suffixes of the command words which are taken to be a task's input
+# files (when the taskRequest does not list its `inputs`)
+inputSuffixes = (
+  '.c', '.cc', '.cpp', '.cxx', '.c++', '.h', '.hh', '.hpp', '.hxx', '.i',
+  '.ii', '.s', '.S', '.smt', '.smt2', '.tex', '.mkiv', '.mkxl'
+)
+
+# the suffixes of the (ConTeXt) documents whose intermediate files are cached
+# by the workers (see the task's `affinity`)
+documentSuffixes = ( '.tex', '.mkiv', '.mkxl', '.mkvi' )
+
+def inferTaskInputs(aTaskRequest) :
+  """
+  Return the (normalised) paths of the input files named on the command lines
+  of the taskRequest `aTaskRequest`: the words ending in one of the
+  `inputSuffixes` which are not options (or the output of a `-o` option).
+  Relative paths are taken relative to the task's `dir`.
+  """
+  taskDir = aTaskRequest.get('dir') or ''
+  someInputs = []
+  for anAction in aTaskRequest.get('actions') or [] :
+    isOutput = False
+    for aWord in ' '.join(anAction).split() :
+      if isOutput :
+        isOutput = False
+        continue
+      if aWord == '-o' :
+        isOutput = True
+        continue
+      if aWord.startswith('-') or not aWord.endswith(inputSuffixes) : continue
+      anInput = os.path.normpath(os.path.join(taskDir, aWord))
+      if anInput not in someInputs : someInputs.append(anInput)
+  return someInputs
+
+# the taskRequest keys which determine what a task does (in-flight requests
+# which agree on all of these keys share a single run, see `taskRequestKey`)
+requestKeyFields = (
+  'workers', 'requiredTools', 'requiredPlatform', 'actions', 'env', 'dir',
+  'aliases', 'inputBlobs', 'inlineInputs', 'outputs'
+)
+
+def taskRequestKey(aTaskRequest) :
+  """
+  Return the canonical hash of the taskRequest `aTaskRequest`: the hash of
+  its `requestKeyFields` (with the actions joined into command lines, the
+  workers and tools sorted, and the dicts' keys in order).
+  """
+  someFields = {
+    aKey : aTaskRequest[aKey] for aKey in requestKeyFields
+      if aTaskRequest.get(aKey)
+  }
+  if 'actions' in someFields :
+    someFields['actions'] = [
+      ' '.join(anAction) if isinstance(anAction, list) else anAction
+        for anAction in someFields['actions']
+    ]
+  for aKey in ( 'workers', 'requiredTools' ) :
+    if aKey in someFields : someFields[aKey] = sorted(someFields[aKey])
+  if 'dir' in someFields :
+    someFields['dir'] = os.path.normpath(someFields['dir'])
+  return hashlib.sha256(json.dumps(
+    someFields, sort_keys=True, separators=(',', ':')
+  ).encode()).hexdigest()
+
 async def dispatcher() :
   """
-  Manages the dispatch of paused taskRequest handlers contained in the
-  platformQueues.
+  Manages the dispatch of the (compact) Tasks pending on the farmState's
+  platforms.
   
-  Each paused taskRequest handler is waiting on a event contained in the
-  appropriate platformQueue.
-
-  We only dispatch a new taskRequest handler from a given platformQueue when the
-  load on at least one host of the given type drops below its assigned maxLoad.
+  A pending Task holds its request and its requester's connection, but no
+  coroutine. Once dispatched, the task is run by its own `runTask` coroutine.
+
+  We only dispatch a new Task from a given platform when the load score of at
+  least one host of the given type drops below its assigned maxLoad, and then
+  only a taskRequest whose cores and memory fit into that host's free
+  capacity (or, for a taskRequest which fits into none of the platform's
+  hosts, an empty host, see `hostsForTask`). The schedulingPolicy decides the order in which the platforms are
+  scanned as well as which of the (fitting) pending taskRequests is started.
   """
   while True :
     taskFound = False
 
-    if platformQueues :
-      shuffledPlatforms = list(platformQueues.keys())
-      random.shuffle(shuffledPlatforms)
-      #await cutelogDebug(
-      #  { 'shuffledPlatforms' : shuffledPlatforms},
-      #  name="dispatcher"
-      #)
-      for aPlatform in shuffledPlatforms :
-        aPlatformQueue = platformQueues[aPlatform]
-        #await cutelogDebug(
-        #  f"checking for taskRequests queued on the {aPlatform} queue",
-        #  name='dispatcher'
-        #)
-        for aHost, aMaxScaledLoad in hostTypes[aPlatform].items() :
-          if hostLoads[aHost] < aMaxScaledLoad :
-            if not aPlatformQueue.empty() :
-              nextTaskEvent = await aPlatformQueue.get()
-              aPlatformQueue.task_done()
-              if not nextTaskEvent.is_set() :
-                nextTaskEvent.set()  # tell this task to start running....
-                taskFound = True
-                await cutelogDebug(
-                  f"found a taskRequest on the {aPlatform}({aHost}) queue with {hostLoads[aHost]} < {aMaxScaledLoad}",
-                  name='dispatcher'
-                )
-                break  # only start one task per platform durring one scan
+    platforms = farmState.platforms
+    for aPlatformName in schedulingPolicy.orderPlatforms(platforms.keys()) :
+      aPlatform = platforms[aPlatformName]
+      if not aPlatform.pending : continue
+      platformViews = [ hostView(aHost) for aHost in aPlatform.hosts.values() ]
+      for aHostView in platformViews :
+        aHost = aPlatform.hosts[aHostView['host']]
+        if aHost.maxLoad <= aHost.load : continue
+        pendingTasks = [
+          aTask for aTask in aPlatform.pending
+            if hostsForTask(aTask.request, [ aHostView ], platformViews)
+        ]
+        taskIndex = schedulingPolicy.selectTask(
+          [ aTask.request for aTask in pendingTasks ], aHostView
+        )
+        if taskIndex is None : continue
+        nextTask = pendingTasks[taskIndex]
+        # a task without a requiredPlatform is pending on all platforms
+        farmState.startTask(nextTask)
+        nextTask.runner = asyncio.create_task(runTask(nextTask))
+        taskFound = True
+        await cutelogDebug(
+          f"found a taskRequest on the {aPlatformName}({aHost.name}) queue with {aHost.load} < {aHost.maxLoad}",
+          name='dispatcher'
+        )
+        break  # only start one task per platform durring one scan
     if not taskFound :
       # if no tasks found during last scan pause
       await cutelogDebug(f"sleeping", name="dispatcher")
       await asyncio.sleep(1)
 
-async def handleTaskRequestConnection(task, taskJson, addr, reader, writer) :
+async def replayCachedTask(task, taskName, anEntry, writer) :
+  """
+  Answer the taskRequest `task` from its actionCache entry `anEntry` without
+  dispatching it to a worker.
+
+  We send the usual `taskAccepted` message, replay the entry's log to the
+  cuteLogActions GUI, and send a final (`returncode`) message marked as
+  `cached`. The final message's `outputBlobs` are the entry's outputs (only
+  those listed in the task's `outputs`, if it has any), which the task
+  originator fetches from the blobStore.
+  """
+  taskId = farmState.newTaskId()
+  now    = time.time()
+  someOutputs = anEntry['outputs']
+  if task.get('outputs') :
+    someOutputs = {
+      aPath : aHash for aPath, aHash in someOutputs.items()
+        if aPath in task['outputs']
+    }
+  try :
+    writer.write(json.dumps({
+      'type'     : 'taskAccepted',
+      'taskId'   : taskId,
+      'taskName' : taskName
+    }).encode() + b"\n")
+    for aLogMsg in anEntry['log'] :
+      if isinstance(aLogMsg, str) :
+        aLogMsg = { 'level' : 'info', 'msg' : aLogMsg }
+      await cutelog(dict(aLogMsg, name=taskName, time=now))
+    aResult = {
+      'name'       : taskName,
+      'msg'        : f"Task competed: {anEntry['returncode']}",
+      'returncode' : anEntry['returncode'],
+      'cached'     : True,
+      'taskId'     : taskId
+    }
+    if someOutputs : aResult['outputBlobs'] = someOutputs
+    writer.write(json.dumps(aResult).encode() + b"\n")
+    await writer.drain()
+  except Exception :
+    await cutelogDebug(f"task {taskName} ({taskId}) requester has gone", name="dispatcher")
+  try :
+    writer.close()
+    await writer.wait_closed()
+  except Exception :
+    pass
+
+  aRecord = Task(
+    taskId, taskName, task, None, task.get('requiredPlatform'),
+    task.get('estimatedLoad', 0.5), now
+  ).summary()
+  aRecord['state']      = 'finished'
+  aRecord['finished']   = now
+  aRecord['returncode'] = anEntry['returncode']
+  aRecord['cached']     = True
+  farmState.taskHistory.add(aRecord)
+  await cutelogDebug(f"answered {taskName} ({taskId}) from the actionCache", name="dispatcher")
+
+async def acquireWorker(aTask, stragglerHost=None) :
+  """
+  Assign the (started) task `aTask` to an idle worker, on a host with enough
+  free capacity (see `hostsForTask`), and send the task's request to this worker. Returns the
+  Worker.
+
+  We wait for a suitable worker to become idle, unless a `stragglerHost` is
+  given. In this case `aTask` is a speculative duplicate of a task running
+  (too slowly) on the `stragglerHost`, and we only use an idle worker on a
+  host which is below its maxLoad, whose speed adjusted load is lower than
+  the stragglerHost's, and only if no other tasks are pending (otherwise we
+  return None).
+  """
+  task     = aTask.request
+  taskName = aTask.name
+  someWorkerTypes = task.get('workers') or []
+  requiredTools   = task.get('requiredTools') or []
+  while True :
+    await cutelogDebug({ 
+      'msg'  : taskName,
+      'task' : task
+    }, name="dispatcher")
+
+    # (from the snapshot of the idle workers, to either the assignment of a
+    # worker or the wait for a change in capacity, we MUST NOT yield to any
+    # other taskRequest handler. The capacityChanged event is cleared before
+    # the snapshot so that no change made after the snapshot is missed)
+    farmState.capacityChanged.clear()
+    potentialHosts = farmState.hostsWithIdleWorkers(
+      someWorkerTypes, requiredTools, aTask.requiredPlatform
+    )
+    hostViews = [ hostView(aHost) for aHost, _ in potentialHosts.values() ]
+    fittingHosts = hostsForTask(task, hostViews, [
+      hostView(aHost) for aHost in farmState.capableHosts(
+        someWorkerTypes, requiredTools, aTask.requiredPlatform
+      )
+    ])
+
+    if stragglerHost :
+      if any(aPlatform.pending for aPlatform in farmState.platforms.values()) :
+        return None
+      stragglerLoad = speedLoad(hostView(stragglerHost))
+      fittingHosts = [
+        aView for aView in fittingHosts
+          if aView['host'] != stragglerHost.name and
+            aView['load'] < aView['maxLoad'] and
+            speedLoad(aView) < stragglerLoad
+      ]
+      if not fittingHosts : return None
+
+    if not fittingHosts :
+      # wait for a suitable worker to (re)register or for a running task to
+      # release its cores and memory
+      await farmState.capacityChanged.wait()
+      await cutelogDebug(f"task {taskName} was waiting for an idle worker with enough capacity", name='dispatcher')
+      continue
+
+    # (a host which holds the local caches of the task's affinity is
+    # preferred, whatever the scheduling policy)
+    selectedHost = None
+    if not stragglerHost :
+      selectedHost = farmState.affinityHost(task, fittingHosts)
+    if not selectedHost :
+      selectedHost = schedulingPolicy.selectHost(task, fittingHosts)
+    leastLoadedHost, hostWorkerTypes = potentialHosts[selectedHost['host']]
+    taskWorker = farmState.takeWorker(leastLoadedHost, hostWorkerTypes)
+    if taskWorker is None : continue
+
+    # add a small fudge factor (the task's estimatedLoad) to the
+    # leastLoadedHost's current load to ensure we don't keep choosing and hence
+    # over load it (and reserve the task's cores and memory on this host).
+    #
+    # This MUST be done before we next yield to any other taskRequest
+    # handler.
+    #
+    farmState.assignTask(aTask, taskWorker)
+
+    await stopWatchingWorker(taskWorker)
+    if taskWorker.reader.at_eof() :
+      await cutelogDebug("The assigned worker has died.... so we are trying the next")
+      farmState.unassignTask(aTask)
+      releaseLoadReporter(taskWorker)
+      continue
+    await cutelogDebug(
+      f"assigned task {taskName} ({taskWorker.workerType}) to host {leastLoadedHost.name} with current load {leastLoadedHost.load}",
+      name='dispatcher'
+    )
+
+    try :
+      # Send this worker our task request
+      taskWorker.writer.write(aTask.requestJson)
+      await taskWorker.writer.drain()
+      taskWorker.writer.write(b"\n")
+      await taskWorker.writer.drain()
+    except (ConnectionResetError, BrokenPipeError) :
+      await cutelogDebug("The assigned worker has died.... so we are trying the next")
+      farmState.unassignTask(aTask)
+      releaseLoadReporter(taskWorker)
+      continue
+    # We have found a live worker...
+    return taskWorker
+
+async def echoWorkerMessages(aWorker, addr, logSink=None, followers=()) :
+  """
+  Echo the messages of the worker `aWorker` to the cuteLogActions GUI (and to
+  the `logSink`, if given) until the worker sends its final (`returncode`)
+  message. Returns this final message (or None if the worker closed its
+  connection without sending one).
+
+  The messages are also echoed to the GUI under the name of each of the
+  (differently named) tasks in the (live) list `followers` which share this
+  run.
+  """
+  workerLogName = f"{aWorker.workerType}.{aWorker.workerName}.{aWorker.host.name}"
+  workerReader  = aWorker.reader
+  while not workerReader.at_eof() :
+    try :
+      data = await workerReader.readuntil()
+    except asyncio.CancelledError :
+      raise
+    except :
+      await cutelogDebug(
+        f"Worker {aWorker.addr!r} closed connection", name=workerLogName
+      )
+      break
+
+    message = data.decode()
+    if message.startswith('{"type": "pong"') : continue  # a late heartbeat
+    if message.startswith('{"type": "load"') :
+      await recordHostLoad(aWorker.host, json.loads(message))
+      continue
+    await cutelogDebug(
+      f"Received [{message!r}] from {aWorker.addr!r}", name=workerLogName
+    )
+    await cutelogDebug(
+      f"Echoing: [{message!r}] to {addr!r}", name=workerLogName
+    )
+    await cutelog(message)
+    if followers :
+      aLogMsg = json.loads(message)
+      for aFollower in followers :
+        if aFollower.name != aLogMsg.get('name') :
+          await cutelog(dict(aLogMsg, name=aFollower.name))
+    if logSink : logSink(message, aWorker.host)
+    if 'returncode' in message :
+      jsonData = json.loads(message)
+      if 'returncode' not in jsonData : continue
+      return jsonData
+  return None
+
+def closeWorker(aWorker) :
+  """
+  Close the connection to the (no longer idle) worker `aWorker`.
+  """
+  try :
+    aWorker.writer.close()
+  except Exception :
+    pass
+  releaseLoadReporter(aWorker)
+
+def stragglerDeadline(aTask) :
+  """
+  Return the time after which the running task `aTask` is taken to be a
+  straggler (or None if the task may not be speculatively duplicated).
+  """
+  if not speculation['enabled'] or not aTask.request.get('idempotent') :
+    return None
+  estimatedDuration = aTask.request.get('estimatedDuration')
+  if estimatedDuration is None : return None
+  # (the estimatedDuration is normalised to a host with a speed of 1.0)
+  expectedDuration = estimatedDuration / (aTask.host.speed or 1.0)
+  return aTask.started + max(
+    speculation['minDelay'], speculation['slowdown'] * expectedDuration
+  )
+
+async def runTaskRequest(thisTask, taskWorker, addr, logSink=None) :
+  """
+  Run the task `thisTask` on the worker `taskWorker` (to which its request has
+  been sent), echoing the worker's messages (see `echoWorkerMessages`).
+
+  If the task is idempotent and runs well beyond its predicted duration (see
+  `stragglerDeadline`) we speculatively start a duplicate of it on a faster
+  host with an idle worker (see `acquireWorker`). The first of these runs to
+  send its final message wins, and the other run is abandoned: we close the
+  connection to its worker, which kills the task's process. The `logSink` of
+  a task which may be duplicated is only given the winning run's messages
+  (once it has finished).
+
+  Returns the winning run's Task (`thisTask` or its duplicate) and final
+  message (or None, None if every worker closed its connection without
+  sending a final message). The duplicate (if any) is finished here, while
+  `thisTask` is left for the caller to finish.
+  """
+  deadline     = stragglerDeadline(thisTask)
+  sinkMessages = {}
+  someRuns     = {}
+  def startRun(aTask, aWorker) :
+    aSink = logSink
+    if deadline and logSink :
+      sinkMessages[aTask] = []
+      aSink = lambda message, aHost : sinkMessages[aTask].append((message, aHost))
+    aRun = asyncio.create_task(
+      echoWorkerMessages(aWorker, addr, aSink, thisTask.followers)
+    )
+    someRuns[aRun] = (aTask, aWorker)
+
+  startRun(thisTask, taskWorker)
+  winningTask  = None
+  finalMessage = None
+  while someRuns and not winningTask :
+    timeout = None
+    if deadline : timeout = max(0, deadline - time.time())
+    doneRuns, _ = await asyncio.wait(
+      someRuns, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+    )
+    for aRun in doneRuns :
+      aTask, aWorker = someRuns.pop(aRun)
+      closeWorker(aWorker)
+      aMessage = aRun.result()
+      if aMessage is not None and not winningTask :
+        winningTask, finalMessage = aTask, aMessage
+      if aTask is not thisTask :
+        aMessage = aMessage or {}
+        farmState.finishTask(
+          aTask, aMessage.get('returncode'), aMessage.get('resources')
+        )
+    if winningTask or doneRuns or not deadline : continue
+
+    # the task is a straggler... try to duplicate it (once)
+    aDuplicate = farmState.duplicateTask(thisTask)
+    dupWorker  = await acquireWorker(aDuplicate, stragglerHost=thisTask.host)
+    if dupWorker :
+      deadline = None
+      await cutelogInfo(
+        f"task {thisTask.name} ({thisTask.taskId}) is a straggler on {thisTask.host.name}, speculatively duplicated on {dupWorker.host.name}",
+        name="dispatcher"
+      )
+      startRun(aDuplicate, dupWorker)
+    else :
+      # (there is no idle capacity yet... try again later)
+      farmState.removeTask(aDuplicate)
+      deadline = time.time() + speculation['interval']
+
+  for aRun, (aTask, aWorker) in someRuns.items() :
+    # abandon the losing run (its worker kills the task's process once its
+    # connection has been closed)
+    aRun.cancel()
+    await asyncio.wait([ aRun ])
+    closeWorker(aWorker)
+    await cutelogInfo(
+      f"abandoned the run of {aTask.name} ({aTask.taskId}) on {aTask.host.name}",
+      name="dispatcher"
+    )
+    if aTask is not thisTask :
+      aRecord = farmState.finishTask(aTask, None)
+      aRecord['state'] = 'abandoned'
+
+  if logSink and winningTask in sinkMessages :
+    for message, aHost in sinkMessages[winningTask] :
+      logSink(message, aHost)
+  return winningTask, finalMessage
+
+def admissionRefusal(client, numTasks=1) :
+  """
+  Return the reason for refusing `numTasks` new taskRequests from the host
+  `client` (or None if the taskRequests may be queued), given the `admission`
+  limits on the number of pending taskRequests.
+  """
+  if admission['maxPending'] < farmState.numPending + numTasks :
+    return f"{farmState.numPending} tasks are pending"
+  clientPending = farmState.clientPending.get(client, 0)
+  if admission['maxPendingPerClient'] < clientPending + numTasks :
+    return f"{clientPending} tasks from {client} are pending"
+  return None
+
+async def refuseTask(taskName, reason, writer) :
+  """
+  Refuse the taskRequest `taskName` by sending a `retryAfter` message (with
+  the number of seconds after which the requester should try again, and the
+  `reason` for the refusal) and closing the connection.
+  """
+  await cutelogInfo(
+    f"refused task {taskName} since {reason}", name="dispatcher"
+  )
+  try :
+    writer.write(json.dumps({
+      'type'       : 'retryAfter',
+      'taskName'   : taskName,
+      'retryAfter' : admission['retryAfter'],
+      'reason'     : reason
+    }).encode() + b"\n")
+    await writer.drain()
+    writer.close()
+    await writer.wait_closed()
+  except Exception :
+    await cutelogDebug(f"task {taskName} requester has gone", name="dispatcher")
+
+async def dropAbandonedTasks(interval) :
+  """
+  Every `interval` seconds drop the pending tasks whose requesters have closed
+  their connections (so that these tasks no longer count against the
+  `admission` limits). Tasks whose runs are shared by the (identical) requests
+  which follow them are kept.
+
+  (A pending task holds no coroutine to read its requester's connection, but
+  the connection's reader is told of the requester's EOF regardless.)
+  """
+  while True :
+    await asyncio.sleep(interval)
+    someTasks = [
+      aTask for aTask in farmState.tasks.values()
+        if aTask.state == 'pending' and aTask.reader and
+          aTask.reader.at_eof() and not aTask.followers
+    ]
+    for aTask in someTasks :
+      aRecord = farmState.finishTask(aTask, None)
+      aRecord['state'] = 'abandoned'
+      try :
+        aTask.writer.close()
+      except Exception :
+        pass
+      aTask.reader = None
+      aTask.writer = None
+    for aTask in someTasks :
+      await cutelogDebug(f"task {aTask.name} ({aTask.taskId}) requester has gone... dropped the task", name="dispatcher")
+
+async def followSharedTask(aLeader, task, taskName, writer) :
+  """
+  Answer the taskRequest `task` with the results of the identical, and already
+  accepted, task `aLeader` (rather than running it again).
+
+  We send the usual `taskAccepted` message (with our own `taskId`, and the
+  leader's taskId as `sharedWith`), wait for the leader to finish, and send
+  the leader's final message (with our taskId and taskName). In the meantime,
+  the leader's messages are also echoed to the cuteLogActions GUI under our
+  taskName (see `echoWorkerMessages`).
+  """
+  taskId = farmState.newTaskId()
+  task['taskId']    = taskId
+  task['submitted'] = time.time()
+  aFollower = Task(
+    taskId, taskName, task, None, aLeader.requiredPlatform, 0,
+    task['submitted'], event=asyncio.Event()
+  )
+  farmState.followTask(aLeader, aFollower)
+  try :
+    writer.write(json.dumps({
+      'type'       : 'taskAccepted',
+      'taskId'     : taskId,
+      'taskName'   : taskName,
+      'sharedWith' : aLeader.taskId
+    }).encode() + b"\n")
+    await writer.drain()
+  except Exception :
+    await cutelogDebug(f"task {taskName} ({taskId}) requester has gone... dropping the task", name="dispatcher")
+    farmState.removeTask(aFollower)
+    return
+  await cutelogInfo(
+    f"task {taskName} ({taskId}) shares the run of the identical task {aLeader.name} ({aLeader.taskId})",
+    name="dispatcher"
+  )
+
+  await aFollower.event.wait()
+
+  returncode   = None
+  finalMessage = aLeader.finalMessage
+  if finalMessage is not None :
+    returncode = finalMessage['returncode']
+    try :
+      writer.write(json.dumps(dict(
+        finalMessage, name=taskName, taskId=taskId, sharedWith=aLeader.taskId
+      )).encode() + b"\n")
+      await writer.drain()
+    except Exception :
+      await cutelogDebug(f"task {taskName} ({taskId}) requester has gone", name="dispatcher")
+  try :
+    writer.close()
+    await writer.wait_closed()
+  except Exception :
+    pass
+  farmState.finishTask(aFollower, returncode)
+
+async def handleTaskRequestConnection(
+  task, taskJson, addr, reader, writer, logSink=None
+) :
   """
   Handle a taskRequest connection.
 
-  We find an existing worker/connection which matches one of the requested
-  workers, forward the task request onto the worker, and then echo the resulting
-  "stream" of "log" messages back to both the task originator as well as the
-  cuteLogActions GUI. When the worker finishes, we close this connection.
+  We queue the (compact) Task on its platforms' pending lists and return it.
+  Once the `dispatcher` starts the task, `runTask` finds an existing
+  worker/connection which matches one of the requested workers, forwards the
+  task request onto the worker, and then echoes the resulting "stream" of "log"
+  messages back to both the task originator as well as the cuteLogActions GUI.
+  When the worker finishes, we close this connection.
+
+  If a `logSink` is given, it is also called with each of the worker's (JSON)
+  messages and the Host running the task (see `handleTestSuiteConnection`).
 
   The task dict (and taskJson) MUST have the following keys:
 
@@ -325,7 +1184,12 @@ async def handleTaskRequestConnection(task, taskJson, addr, reader, writer) :
   - requiredPlatform : (optional) if provided, the type of host (OS-CPU) that
                        MUST be use to run this task.
   
-  - workers          : a list of acceptable workers
+  - workers          : a list of acceptable workers (optional if
+                       requiredTools is provided)
+
+  - requiredTools    : (optional) a list of tools. If provided, the task may
+                       be run by any worker (of one of the acceptable
+                       workers, if given) which provides all of these tools
 
   - actions          : a list of lists of strings which when joined provides the
                        the commands (to be run one after the other)
@@ -341,13 +1205,125 @@ async def handleTaskRequestConnection(task, taskJson, addr, reader, writer) :
   - estimatedLoad    : a (scaled) estimate of the load associated with this
                        task. This is added to the hostLoad of the host assigned
                        to this task (default: 0.5)
+
+  - cores            : the number of cores required by this task (default:
+                       predicted by the costModel, otherwise 1)
+
+  - memory           : the memory (MB) required by this task (default:
+                       predicted by the costModel, otherwise 0)
+
+  - estimatedDuration : (optional) the estimated duration of this task on a
+                        host with a speed of 1.0 (default: predicted by the
+                        costModel)
+
+  - costKey          : (optional) the key used by the costModel to learn the
+                       cost of this (type of) task (default: the workers and
+                       the first word of the command)
+
+  - inputs           : (optional) the list of (sshfs mounted) files read by
+                       this task (default: the hashes of the task's
+                       inputBlobs, otherwise inferred from the command words,
+                       see `inferTaskInputs`). The (locality aware)
+                       schedulingPolicy prefers hosts which have recently used
+                       these files.
+
+  - inputBlobs       : (optional) a dict of the (relative) paths, and blob
+                       hashes, of the inputs which the worker materialises (from
+                       the blobStore) in the task's scratch directory
+
+  - inlineInputs     : (optional) a dict of the (relative) paths, and the
+                       (compressed, base64 encoded) contents, of the small
+                       inputs which the worker writes into the task's scratch
+                       directory
+
+  - outputs          : (optional) a list of the (relative) paths of the outputs
+                       which the worker returns. Small outputs are returned in
+                       the `inlineOutputs` of the final message, others are
+                       uploaded to the blobStore (and their hashes are returned
+                       in the `outputBlobs` of the final message)
+
+  - affinity         : (optional) a key (for example a document's path) whose
+                       intermediate files the workers cache locally (default:
+                       the first of the task's inferred inputs which is a
+                       ConTeXt document). The task is preferably sent back to
+                       the host which last ran a task with the same affinity
+                       (unless that host is at its maxLoad)
+
+  - shareable        : (optional) if true, the task may share the run of an
+                       identical task which is already pending or running,
+                       rather than being run again (default: the task's
+                       idempotent flag, see below)
+
+  - idempotent       : (optional) if true, the task may be run more than once
+                       (at the same time) without harm. If speculation is
+                       enabled, a duplicate of an idempotent task which runs
+                       well beyond its predicted duration is started on a
+                       faster host, and the result of whichever run finishes
+                       first is used (see `runTaskRequest`)
+
+  - cacheKey         : (optional) the task's actionCache key, computed by the
+                       task originator using the same taskCache plugin as the
+                       workers. If the actionCache holds an entry for this key,
+                       the task is answered from the cache without being
+                       dispatched to a worker (see `replayCachedTask`)
+
+  The task is only run on a host whose unreserved cores and memory can hold the
+  task's cores and memory. These are reserved while the task is running.
+
+  A (shareable) taskRequest which is identical to an already accepted, pending
+  or running, task (that is, whose `taskRequestKey` is the same) is not run
+  again. Instead it follows the existing task and is sent that task's results
+  (see `followSharedTask`). Requests with a `logSink` are always run.
+
+  A new taskRequest (which does not follow an existing task) is refused once
+  the `admission` limits on the number of pending taskRequests (in total, or
+  from the requester's host) have been reached. Rather than a `taskAccepted`
+  message, the requester is sent a `retryAfter` message (with the number of
+  seconds to wait before trying again, and the reason) and the connection is
+  closed. Requests with a `logSink` (the shards of an accepted test suite,
+  which was admitted for its number of shards) are never refused. A pending
+  taskRequest whose requester closes its connection is dropped (see
+  `dropAbandonedTasks`).
+
+  Once the task has been accepted, we send a `taskAccepted` message (containing
+  the server assigned `taskId`) back to the task originator. The `taskId` is
+  also added to the taskRequest sent to the worker and to the final
+  (`returncode`) message echoed back to the task originator. This final message
+  also contains the `resources` (wall time, CPU time, peak RSS, block I/O and
+  context switches) used by the task, which are recorded in the taskHistory
+  (and so can be queried) and used to train the costModel (unless the task's
+  results were replayed from the actionCache). If the final message is that of
+  a speculative duplicate it is marked as `speculative`.
   """
   taskName = "unknown"
   if 'taskName' in task : taskName = task['taskName']
   await cutelogDebug({ 'msg' : f"new task: {taskName}", 'task' : task }, name="dispatcher")
 
-  if 'workers' not in task or len(task['workers']) < 1 :
-    await cutelogDebug("new task request without any workers... dropping the connection")
+  if task.get('cacheKey') :
+    anEntry = actionCache.get(str(task['cacheKey']))
+    if anEntry is not None :
+      await replayCachedTask(task, taskName, anEntry, writer)
+      return
+
+  requestKey = None
+  if task.get('shareable', bool(task.get('idempotent'))) :
+    requestKey = taskRequestKey(task)
+    aLeader    = farmState.inFlightTask(requestKey)
+    if aLeader is not None and not logSink :
+      await followSharedTask(aLeader, task, taskName, writer)
+      return
+
+  client = addr[0] if addr else None
+  if not logSink :
+    reason = admissionRefusal(client)
+    if reason :
+      await refuseTask(taskName, reason, writer)
+      return
+
+  someWorkerTypes = task.get('workers') or []
+  requiredTools   = task.get('requiredTools') or []
+  if not someWorkerTypes and not requiredTools :
+    await cutelogDebug("new task request without any workers or tools... dropping the connection")
     await cutelogDebug(task)
     writer.close()
     await writer.wait_closed()
@@ -356,141 +1332,313 @@ async def handleTaskRequestConnection(task, taskJson, addr, reader, writer) :
   requiredPlatform = None
   if 'requiredPlatform' in task :
     requiredPlatform = task['requiredPlatform']
-  if requiredPlatform and requiredPlatform not in hostTypes :
+  if requiredPlatform and (
+    requiredPlatform not in farmState.platforms or
+    not farmState.platforms[requiredPlatform].hosts
+  ) :
     await cutelogDebug(f"No platform found for the task request... dropping the connection")
     await cutelogDebug(task)
     writer.close()
     await writer.wait_closed()
     return
 
+  if requiredTools :
+    hasWorkers = bool(farmState.capableWorkers(requiredTools, someWorkerTypes))
+  else :
+    hasWorkers = any(aType in farmState.workerTypes for aType in someWorkerTypes)
+  if not hasWorkers :
+    await cutelogDebug(f"No specialist workers found for this task... dropping the connection", name="dispatcher")
+    await cutelogDebug(task)
+    writer.close()
+    await writer.wait_closed()
+    return
+
+  costKey = costModel.predict(task)
+  if 'inputs' not in task :
+    if task.get('inputBlobs') :
+      # the worker's local blob cache is warm for these inputs
+      someInputs = sorted(set(task['inputBlobs'].values()))
+    else :
+      someInputs = inferTaskInputs(task)
+    if someInputs : task['inputs'] = someInputs
+  if 'affinity' in task :
+    task['affinity'] = str(task['affinity'])
+  else :
+    someDocuments = [
+      anInput for anInput in inferTaskInputs(task)
+        if anInput.endswith(documentSuffixes)
+    ]
+    if someDocuments : task['affinity'] = someDocuments[0]
   estimatedLoad = 0.5
   if 'estimatedLoad' in task : estimatedLoad = task['estimatedLoad']
+  cores  = taskCores(task)
+  memory = taskMemory(task)
+
+  taskId = farmState.newTaskId()
+  task['taskId']    = taskId
+  task['submitted'] = time.time()
+  thisTask = Task(
+    taskId, taskName, task, None, requiredPlatform, estimatedLoad,
+    task['submitted'], cores=cores, memory=memory, costKey=costKey,
+    client=client, reader=reader, writer=writer, addr=addr, logSink=logSink,
+    event=asyncio.Event() if logSink else None
+  )
+  farmState.addTask(thisTask)
+  try :
+    writer.write(json.dumps({
+      'type'     : 'taskAccepted',
+      'taskId'   : taskId,
+      'taskName' : taskName
+    }).encode())
+    writer.write(b"\n")
+    await writer.drain()
+  except Exception :
+    await cutelogDebug(f"task {taskName} ({taskId}) requester has gone... dropping the task", name="dispatcher")
+    farmState.removeTask(thisTask)
+    return
+  if requestKey : farmState.shareTask(thisTask, requestKey)
+  await cutelogDebug(
+    f"queued task {taskName} ({taskId}) with {farmState.numPending} tasks pending",
+    name="dispatcher"
+  )
+  return thisTask
+
+async def runTask(thisTask) :
+  """
+  Run the (dispatched) task `thisTask`.
 
-  assignedTasks[taskName] = { 
-    'state' : 'pending',
-    'estimatedLoad' : estimatedLoad
-  }
+  We send the task's request to a worker (see `acquireWorker`), echo the
+  worker's messages back to the task's requester (see `runTaskRequest`), send
+  the final message and close the requester's connection. Then we record the
+  task's results (in the taskHistory and costModel) and release any followers
+  of the task.
+  """
+  task     = thisTask.request
+  taskName = thisTask.name
+  taskId   = thisTask.taskId
+  writer   = thisTask.writer
+  addr     = thisTask.addr
+  await cutelogDebug(f"task {taskName} started", name="dispatcher")
+  thisTask.requestJson = json.dumps(task).encode()
+
+  taskWorker = await acquireWorker(thisTask)
+  winningTask, finalMessage = await runTaskRequest(
+    thisTask, taskWorker, addr, thisTask.logSink
+  )
+
+  returncode = None
+  resources  = None
+  cached     = False
+  if finalMessage is not None :
+    returncode = finalMessage['returncode']
+    resources  = finalMessage.get('resources')
+    cached     = bool(finalMessage.get('cached'))
+    finalMessage['taskId'] = taskId
+    if winningTask is not thisTask : finalMessage['speculative'] = True
+    try :
+      writer.write(json.dumps(finalMessage).encode())
+      writer.write(b"\n")
+      await writer.drain()
+    except Exception :
+      await cutelogDebug(f"task {taskName} ({taskId}) requester has gone", name="dispatcher")
 
-  thisTaskEvent = asyncio.Event() # starts with the event cleared
+  await cutelogDebug(f"Closing the connection to {addr!r}")
+  try :
+    writer.close()
+    await writer.wait_closed()
+  except Exception :
+    pass
+  thisTask.reader  = None
+  thisTask.writer  = None
+  thisTask.logSink = None
+  await cutelogDebug(f"finished {taskName} ({taskId})", name="dispatcher")
+  thisTask.finalMessage = finalMessage
+  aRecord = farmState.finishTask(thisTask, returncode, resources)
+  for aFollower in thisTask.followers :
+    # (the followers' requests are identical, so share the results)
+    aFollower.event.set()
+  if thisTask.event : thisTask.event.set()
+  if winningTask and winningTask is not thisTask :
+    # (the results are those of the task's speculative duplicate)
+    aRecord['winner'] = winningTask.taskId
+  if cached :
+    # (the results were replayed from the actionCache, so the task's run time
+    # says nothing about the cost of running the task)
+    aRecord['cached'] = True
+  elif returncode == 0 and winningTask.started :
+    # (the costModel's times are normalised to a host with a speed of 1.0)
+    hostSpeed = winningTask.host.speed
+    runTime   = aRecord['finished'] - winningTask.started
+    if resources :
+      costModel.observe(
+        thisTask.costKey, resources.get('wallTime', runTime) * hostSpeed,
+        (resources.get('userTime', 0) + resources.get('sysTime', 0)) * hostSpeed,
+        resources.get('maxRss')
+      )
+    else :
+      costModel.observe(thisTask.costKey, runTime * hostSpeed)
 
-  if requiredPlatform :
-    await cutelogDebug(f"stored task event for {taskName} on {requiredPlatform} queue", name="dispatcher")
-    await platformQueues[requiredPlatform].put(thisTaskEvent)
-  else :
-    # if there is no requiredPlatform... place this task into all queues...
-    for aPlatform, aQueue in platformQueues.items() :
-      await cutelogDebug(f"stored task event for {taskName} on {aPlatform} queue", name="dispatcher")
-      await aQueue.put(thisTaskEvent)
+async def handleTestSuiteConnection(task, addr, reader, writer) :
+  """
+  Handle a testSuite connection (see the `taskManager_2_testSuites` "module").
 
+  The task dict MUST have the following keys:
 
-  # wait for this task to be dispatched...
-  await cutelogDebug(f"task {taskName} waiting for thisTaskEvent ({type(thisTaskEvent)})", name="dispatcher")
-  await thisTaskEvent.wait()
-  await cutelogDebug(f"task {taskName} started", name="dispatcher")
+  - taskName : the name of the suite's (merged) task
 
-  potentialWorkerHosts = []
-  for aTaskType in task['workers'] :
-    if aTaskType not in workerQueues or len(workerQueues[aTaskType]) < 1 : 
-      continue
-    for aWorkerHost in workerQueues[aTaskType] :
-      if requiredPlatform and aWorkerHost not in hostTypes[requiredPlatform] :
-        continue
-      potentialWorkerHosts.append(( aTaskType, aWorkerHost ))
+  - tests    : the list of the suite's tests
 
-  await cutelogDebug({ 
-    'msg'         : taskName,
-    'task'        : task,
-    'workerHosts' : potentialWorkerHosts
-  }, name="dispatcher")
+  - command  : the list of the words of the command which runs some of the
+               tests (the word `{tests}` is replaced by the shard's tests)
 
-  if not potentialWorkerHosts :
-    await cutelogDebug(f"No specialist workers or hosts found for this task... dropping the connection", name="dispatcher")
-    await cutelogDebug(task)
-    writer.close()
-    await writer.wait_closed()
-    return
+  and MAY have the following keys:
 
-  while True :
-    leastLoadedTaskType, leastLoadedHost = potentialWorkerHosts[0]
-    await cutelogDebug(f"task {taskName} looking for worker ({leastLoadedTaskType}, {leastLoadedHost})", name='dispatcher')
-    for aPotentialWorkerHost in potentialWorkerHosts :
-      aTaskType, aHost = aPotentialWorkerHost
-      if hostLoads[aHost] < hostLoads[leastLoadedHost] :
-        leastLoadedHost     = aHost
-        leaseLoadedTaskType = aTaskType
-    await cutelogDebug(
-      f"assigned task {taskName} ({leastLoadedTaskType}) to host {leastLoadedHost} with current load {hostLoads[leastLoadedHost]}",
-      name='dispatcher'
-    )
-    taskWorker = await workerQueues[leastLoadedTaskType][leastLoadedHost].get()
-    workerQueues[leastLoadedTaskType][leastLoadedHost].task_done()
+  - suite    : the name under which the tests' durations are learned
+               (default: the taskName)
 
-    try :
-      workerName   = taskWorker['workerName']
-      workerAddr   = taskWorker['addr']
-      workerReader = taskWorker['reader']
-      workerWriter = taskWorker['writer']
+  - shards   : the number of shards (default: `defaultTestShards`)
 
-      # Send this worker our task request
-      workerWriter.write(taskJson)
-      await workerWriter.drain()
-      workerWriter.write(b"\n")
-      await workerWriter.drain()
-    except ConnectionResetError :
-      await cutelogDebug("The assigned worker has died.... so we are trying the next")
-      continue
-    # We have found a live worker...
-    break
+  Any other keys (for example `workers`, `requiredTools`, `dir`, `env` or
+  `timeOut`) are passed on to each shard's taskRequest.
 
-  assignedTasks[taskName]['state']      = 'running'
-  assignedTasks[taskName]['worker']     = leastLoadedTaskType
-  assignedTasks[taskName]['workerName'] = workerName
-  assignedTasks[taskName]['host']       = leastLoadedHost
+  Like a taskRequest, a test suite is refused (with a `retryAfter` message)
+  if its shards would exceed the `admission` limits (see `refuseTask`).
 
-  # add a small fudge factor to the leastLoadedHost's current load to
-  # ensure we don't keep choosing and hence over load it
-  #
-  estimatedLoad = 0.5
-  if 'estimatedLoad' in task : estimatedLoad = task['estimatedLoad']
+  We send a `taskAccepted` message (containing the suite's `taskId`), run the
+  shards concurrently (as ordinary taskRequests named `<taskName>.shard<n>`),
+  and then send a single final message containing:
 
-  hostLoads[leastLoadedHost] += estimatedLoad
+  - returncode : 0 if every shard succeeded and no test failed
 
-  while not workerReader.at_eof() :
-    try :
-      data = await workerReader.readuntil()
-    except :
-      await cutelogDebug(
-        f"Worker {workerAddr!r} closed connection",
-        name=f"{leastLoadedTaskType}.{workerName}.{leastLoadedHost}"
-      )
-      break
+  - tests      : the number of `passed` and `skipped` tests, together with
+                 the lists of the `failed` tests and of the `missing` tests
+                 (those which did not report a result)
 
-    message = data.decode()
-    await cutelogDebug(
-      f"Received [{message!r}] from {workerAddr!r}",
-      name=f"{leastLoadedTaskType}.{workerName}.{leastLoadedHost}"
-    )
-    await cutelogDebug(
-      f"Echoing: [{message!r}] to {addr!r}",
-      name=f"{leastLoadedTaskType}.{workerName}.{leastLoadedHost}"
-    )
-    await cutelog(message)
-    if 'returncode' in message :
-      writer.write(data)
-      #writer.write(b"\n")
-      await writer.drain()
+  - shards     : the taskName, taskId, number of tests, (predicted)
+                 estimatedDuration and returncode of each shard
+  """
+  taskName  = str(task.get('taskName') or 'unknown')
+  suiteName = str(task.get('suite') or taskName)
+  someTests = list(dict.fromkeys(str(aTest) for aTest in task.get('tests') or []))
+  someWords = [ str(aWord) for aWord in task.get('command') or [] ]
+  if not someTests or not someWords :
+    await cutelogDebug(f"test suite {taskName} without any tests or command... dropping the connection", name="dispatcher")
+    writer.close()
+    await writer.wait_closed()
+    return
+  # (each shard counts against the admission limits, so a suite may not use
+  # more shards than these limits allow)
+  numShards = min(
+    int(task.get('shards') or defaultTestShards),
+    admission['maxPending'], admission['maxPendingPerClient']
+  )
+  someShards = shardTests(
+    predictTestDurations(suiteName, someTests), numShards
+  )
+  reason = admissionRefusal(addr[0] if addr else None, len(someShards))
+  if reason :
+    await refuseTask(taskName, reason, writer)
+    return
+  suiteId = farmState.newTaskId()
+  try :
+    writer.write(json.dumps({
+      'type'     : 'taskAccepted',
+      'taskId'   : suiteId,
+      'taskName' : taskName,
+      'shards'   : len(someShards)
+    }).encode() + b"\n")
+    await writer.drain()
+  except Exception :
+    await cutelogDebug(f"test suite {taskName} ({suiteId}) requester has gone... dropping the suite", name="dispatcher")
+    return
+  await cutelogInfo(
+    f"test suite {taskName} split into {len(someShards)} shards", name="dispatcher"
+  )
 
-  await cutelogDebug(f"Closing the connection to {addr!r}")
-  writer.close()
-  await writer.wait_closed()
-  await cutelogDebug(f"finished {taskName}", name="dispatcher")
-  del assignedTasks[taskName]
+  testResults = {}
+  def recordResult(message, aHost) :
+    if testResultMarker not in message : return
+    try :
+      aResult = parseTestResult(str(json.loads(message).get('msg', '')))
+    except ValueError :
+      return
+    if aResult is None : return
+    aTest, outcome, seconds = aResult
+    testResults[aTest] = outcome
+    if seconds is not None and outcome != 'skipped' :
+      # (the costModel's times are normalised to a host with a speed of 1.0)
+      costModel.observe(testSignature(suiteName, aTest), seconds * aHost.speed)
+
+  shardRequests = []
+  for anIndex, (total, shardTestList) in enumerate(someShards) :
+    shardTask = {
+      aKey : aValue for aKey, aValue in task.items()
+        if aKey not in ( 'type', 'tests', 'command', 'suite', 'shards' )
+    }
+    shardTask['type']              = 'taskRequest'
+    shardTask['taskName']          = f"{taskName}.shard{anIndex}"
+    shardTask['actions']           = [ shardCommand(someWords, shardTestList) ]
+    shardTask['estimatedDuration'] = round(total, 3)
+    shardTask['costKey']           = f"testShard:{suiteName}"
+    shardRequests.append((shardTask, ShardWriter(), shardTestList, total))
+  someShardTasks = await asyncio.gather(*[
+    handleTaskRequestConnection(
+      shardTask, None, addr, None, shardWriter, logSink=recordResult
+    ) for shardTask, shardWriter, _, _ in shardRequests
+  ])
+  for aShardTask in someShardTasks :
+    if aShardTask : await aShardTask.event.wait()
+
+  someShardResults = []
+  returncode = 0
+  for shardTask, shardWriter, shardTestList, total in shardRequests :
+    aResult = shardWriter.result() or {}
+    shardReturncode = aResult.get('returncode')
+    if shardReturncode != 0 : returncode = 1
+    someShardResults.append({
+      'taskName'          : shardTask['taskName'],
+      'taskId'            : aResult.get('taskId'),
+      'tests'             : len(shardTestList),
+      'estimatedDuration' : round(total, 3),
+      'returncode'        : shardReturncode
+    })
+  failed  = [ aTest for aTest in someTests if testResults.get(aTest) == 'failed' ]
+  missing = [ aTest for aTest in someTests if aTest not in testResults ]
+  passed  = sum(1 for outcome in testResults.values() if outcome == 'passed')
+  skipped = sum(1 for outcome in testResults.values() if outcome == 'skipped')
+  if failed : returncode = 1
+  summary = f"Test suite {suiteName}: {passed} passed, {len(failed)} failed, {skipped} skipped, {len(missing)} missing"
+  await cutelog({
+    'name'  : taskName,
+    'level' : 'info' if returncode == 0 else 'error',
+    'msg'   : summary,
+    'time'  : time.time()
+  })
+  try :
+    writer.write(json.dumps({
+      'name'       : taskName,
+      'msg'        : summary,
+      'returncode' : returncode,
+      'taskId'     : suiteId,
+      'tests'      : {
+        'passed'  : passed,
+        'skipped' : skipped,
+        'failed'  : failed,
+        'missing' : missing
+      },
+      'shards'     : someShardResults
+    }).encode() + b"\n")
+    await writer.drain()
+    writer.close()
+    await writer.wait_closed()
+  except Exception :
+    await cutelogDebug(f"test suite {taskName} ({suiteId}) requester has gone", name="dispatcher")
 
 async def handleConnection(reader, writer) :
   """
   Handle one connection ...
 
-  There are four types of JSON task messages:
+  There are nine types of JSON task messages:
 
   - monitor load information  : handled by `handleMonitorConnection`
 
@@ -498,11 +1646,23 @@ async def handleConnection(reader, writer) :
 
   - worker query              : handled by `handleQueryConnection`
 
+  - task query                : handled by `handleTaskQueryConnection`
+
+  - host history query        : handled by `handleHostHistoryConnection`
+
+  - blob store requests       : handled by `handleBlobConnection`
+
+  - action cache requests     : handled by `handleActionCacheConnection`
+
   - new task request          : handled by `handleTaskRequestConnection`
 
+  - test suite request        : handled by `handleTestSuiteConnection`
+
   For each JSON task message, the `type` key MUST exist:
 
-    - type      (one of `monitor`, `worker`, `workerQuery`, `taskRequest`)
+    - type      (one of `monitor`, `worker`, `workerQuery`, `taskQuery`,
+                 `hostHistory`, `blobHas`, `blobPut`, `blobGet`,
+                 `cacheGet`, `cachePut`, `taskRequest`, `testSuite`)
 
   """
   addr = writer.get_extra_info('peername')
@@ -529,8 +1689,28 @@ async def handleConnection(reader, writer) :
       # ELSE IF task is a query about types of workers... check the worker queue
       await handleQueryConnection(task, reader, writer)
 
+    elif task['type'] == 'taskQuery' :
+      # ELSE IF task is a query about a task... check the tasks and history
+      await handleTaskQueryConnection(task, reader, writer)
+
+    elif task['type'] == 'hostHistory' :
+      # ELSE IF task is a query about the hosts' load... check the history
+      await handleHostHistoryConnection(task, reader, writer)
+
+    elif task['type'] in ('blobHas', 'blobPut', 'blobGet') :
+      # ELSE IF task is a blob transfer... use the blob store
+      await handleBlobConnection(task, reader, writer)
+
+    elif task['type'] in ('cacheGet', 'cachePut') :
+      # ELSE IF task is about a cached task result... use the action cache
+      await handleActionCacheConnection(task, reader, writer)
+
     elif task['type'] == 'taskRequest' :
-      # ELSE task is a request... get a worker and echo the results
+      # ELSE task is a request... queue it (the dispatcher runs it)
       await handleTaskRequestConnection(task, taskJson, addr, reader, writer)
 
+    elif task['type'] == 'testSuite' :
+      # ELSE IF task is a test suite... run its shards and merge the results
+      await handleTestSuiteConnection(task, addr, reader, writer)
+
   await cutelogDebug("Waiting for a new connection...")
@@ -30,6 +30,9 @@ async def tcpTaskServer(config) :
   - Set up signal handling (to gracefully deal with the SIGHUP, SIGTERM, and
     SIGINT signals) 
 
+  - Start the taskRequest `dispatcher`, the `costModelSaver`, the
+    `actionCacheSaver` (and, if configured, the idle `workerHeartbeat`).
+
   - Start the asynchronous tcp server using the `handleConnection` method to
     handle new connections.
 
@@ -51,6 +54,9 @@ async def tcpTaskServer(config) :
     if cutelogActionsWriter :
       print("Closing connection to cutelogActions")
       cutelogActionsWriter.close()
+    costModel.save()
+    hostHistory.save()
+    actionCache.save()
     print("Sutting down")
     loop.stop()
 
@@ -61,9 +67,32 @@ async def tcpTaskServer(config) :
   # start the taskRequest dispatcher... (and run forever)
   dispatcherTask = asyncio.create_task(dispatcher())
 
+  # start persisting the learned task costs... (and run forever)
+  saverTask = asyncio.create_task(
+    costModelSaver(config['costModel']['saveInterval'])
+  )
+
+  # start persisting the action cache... (and run forever)
+  cacheSaverTask = asyncio.create_task(
+    actionCacheSaver(config['actionCache']['saveInterval'])
+  )
+
+  # start dropping the abandoned pending tasks... (and run forever)
+  abandonedTask = asyncio.create_task(
+    dropAbandonedTasks(admission['checkInterval'])
+  )
+
+  # start the (optional) idle worker heartbeat... (and run forever)
+  heartbeat = config['heartbeat']
+  if 0 < heartbeat['interval'] :
+    heartbeatTask = asyncio.create_task(
+      workerHeartbeat(heartbeat['interval'], heartbeat['timeout'])
+    )
+
   taskManager = config['taskManager']
   server = await asyncio.start_server(
-    handleConnection, taskManager['interface'], taskManager['port']
+    handleConnection, taskManager['interface'], taskManager['port'],
+    limit=taskManager['maxMessageSize']
   )
 
   addrs = ', '.join(str(sock.getsockname()) for sock in server.sockets)
@@ -103,6 +132,94 @@ def runTaskManager() :
     taskManager['interface'] = "0.0.0.0"
   if 'port' not in taskManager :
     taskManager['port'] = 8888
+  # (taskRequests and final messages may carry inline files)
+  if 'maxMessageSize' not in taskManager :
+    taskManager['maxMessageSize'] = 16 * 1024 * 1024
+
+  if 'history' not in config :
+    config['history'] = {}
+  if 'size' not in config['history'] :
+    config['history']['size'] = 1000
+  farmState.taskHistory = TaskHistory(config['history']['size'])
+
+  if 'resources' not in config :
+    config['resources'] = {}
+  if 'memoryFraction' not in config['resources'] :
+    config['resources']['memoryFraction'] = maxMemoryFraction
+  farmState.memoryFraction = config['resources']['memoryFraction']
+
+  if 'costModel' not in config :
+    config['costModel'] = {}
+  costConfig = config['costModel']
+  if 'path' not in costConfig :
+    costConfig['path'] = os.path.join(
+      os.path.dirname(os.path.abspath(configFile)), 'taskCosts.json'
+    )
+  if 'saveInterval' not in costConfig :
+    costConfig['saveInterval'] = 60
+  costModel.path = os.path.expanduser(costConfig['path'])
+  if 'alpha' in costConfig : costModel.alpha = costConfig['alpha']
+  if 'maxEntries' in costConfig : costModel.maxEntries = costConfig['maxEntries']
+  costModel.load()
+
+  if 'hostHistory' not in config :
+    config['hostHistory'] = {}
+  historyConfig = config['hostHistory']
+  if 'size' not in historyConfig :
+    historyConfig['size'] = 8640
+  if 'interval' not in historyConfig :
+    historyConfig['interval'] = 10
+  hostHistory.size     = historyConfig['size']
+  hostHistory.interval = historyConfig['interval']
+  if historyConfig.get('path') :
+    hostHistory.path = os.path.expanduser(historyConfig['path'])
+  hostHistory.load()
+
+  if 'blobStore' not in config :
+    config['blobStore'] = {}
+  blobConfig = config['blobStore']
+  if 'path' not in blobConfig :
+    blobConfig['path'] = os.path.join(
+      os.path.dirname(os.path.abspath(configFile)), 'blobs'
+    )
+  if 'maxSize' not in blobConfig :
+    blobConfig['maxSize'] = 10240
+  blobStore.path     = os.path.expanduser(blobConfig['path'])
+  blobStore.maxBytes = blobConfig['maxSize'] * 1024 * 1024
+  blobStore.load()
+
+  if 'actionCache' not in config :
+    config['actionCache'] = {}
+  cacheConfig = config['actionCache']
+  if 'path' not in cacheConfig :
+    cacheConfig['path'] = os.path.join(
+      os.path.dirname(os.path.abspath(configFile)), 'actionCache.json'
+    )
+  if 'saveInterval' not in cacheConfig :
+    cacheConfig['saveInterval'] = 60
+  actionCache.path = os.path.expanduser(cacheConfig['path'])
+  if 'maxEntries' in cacheConfig :
+    actionCache.maxEntries = cacheConfig['maxEntries']
+  actionCache.load()
+
+  if 'heartbeat' not in config :
+    config['heartbeat'] = {}
+  heartbeat = config['heartbeat']
+  if 'interval' not in heartbeat :
+    heartbeat['interval'] = 0
+  if 'timeout' not in heartbeat :
+    heartbeat['timeout'] = 3 * heartbeat['interval']
+
+  if 'speculation' not in config :
+    config['speculation'] = {}
+  speculation.update(config['speculation'])
+  if speculation['enabled'] :
+    print(f"Speculatively duplicating idempotent stragglers {speculation}")
+
+  if 'admission' not in config :
+    config['admission'] = {}
+  admission.update(config['admission'])
+  print(f"Admitting at most {admission['maxPending']} pending tasks ({admission['maxPendingPerClient']} per client)")
 
   if 'cutelogActions' in config :
     cutelogActions = config['cutelogActions']
@@ -111,6 +228,23 @@ def runTaskManager() :
     if 'port' not in cutelogActions :
       cutelogActions['port'] = 19996
 
+  global schedulingPolicy
+  if 'scheduling' in config and 'policy' in config['scheduling'] :
+    policyName = config['scheduling']['policy']
+    schedulingPolicy = getSchedulingPolicy(policyName)
+    if not schedulingPolicy :
+      print(f"Unknown scheduling policy [{policyName}]")
+      print(f"  (known policies: {', '.join(schedulingPolicies.keys())})")
+      sys.exit(1)
+  print(f"Using the {schedulingPolicy.name} scheduling policy")
+
+  if 'scheduling' in config and 'inputCacheSize' in config['scheduling'] :
+    farmState.inputCacheSize = config['scheduling']['inputCacheSize']
+
+  if 'scheduling' in config and 'hostScore' in config['scheduling'] :
+    farmState.scoreWeights = dict(config['scheduling']['hostScore'])
+  print(f"Using the host score weights {farmState.scoreWeights}")
+
   if 'files' in config :
     if 'orig' in config['files'] :
       fileLocations['orig'] = config['files']['orig']
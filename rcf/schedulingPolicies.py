@@ -0,0 +1,288 @@
+"""
+This "module" provides the (pluggable) scheduling policies used to decide which
+pending taskRequest is started next, and on which host it is run.
+
+It is used both by the taskManager (into which it is concatinated) and by the
+`rcf simulate` command (which compares policies offline against a task trace and
+a host model).
+
+To keep the two users interchangeable, a policy only ever sees:
+
+- pending tasks : as taskRequest dicts. The keys used by the policies below are
+                  `submitted`, `estimatedDuration`, `criticalPath`, `inputs`,
+                  `cores` and `memory` (all optional).
+
+- hosts         : as dicts containing (at least) the keys `host`, `load` and
+                  `maxLoad`. The (optional) `recentFiles` key is a collection
+                  of the files recently used on that host. The (optional)
+                  `numCpus` and `maxMemory` (MB) keys describe the host's
+                  total capacity, and the `freeCores` and `freeMemory` (MB)
+                  keys the capacity which has not been reserved by running
+                  tasks. The (optional) `speed` key is the (calibrated) speed
+                  of one of the host's cores (default 1.0).
+
+This "module" MUST be concatinated AFTER the `taskManager_1_header.py` "module".
+"""
+
+import random
+
+class SchedulingPolicy :
+  """
+  The default policy reproduces the original taskManager behaviour: platforms
+  are scanned in a random order, pending tasks are started in the order in
+  which they were submitted, and each task is given to its least loaded
+  candidate host (where the load is divided by the host's speed, so that
+  faster hosts get proportionally more work).
+  """
+
+  name = 'fifo'
+
+  def orderPlatforms(self, somePlatforms) :
+    """
+    Return the order in which the platform queues should be scanned.
+    """
+    shuffledPlatforms = list(somePlatforms)
+    random.shuffle(shuffledPlatforms)
+    return shuffledPlatforms
+
+  def selectTask(self, pendingTasks, aHost) :
+    """
+    Return the index (into `pendingTasks`) of the task which should be started
+    now that the host `aHost` has spare capacity (or None if no task should be
+    started).
+
+    The `pendingTasks` list is always in submission order.
+    """
+    if not pendingTasks : return None
+    return 0
+
+  def selectHost(self, aTask, someHosts) :
+    """
+    Return the host (dict) from the (non-empty) list `someHosts` which should
+    run the task `aTask`.
+    """
+    return min(someHosts, key=speedLoad)
+
+def hostSpeed(aHost) :
+  """
+  Return the (calibrated) speed of the host `aHost` (default 1.0).
+  """
+  return aHost.get('speed') or 1.0
+
+def speedLoad(aHost) :
+  """
+  Return the sort key which orders hosts by their speed adjusted load (and
+  then by their speed, so that of two idle hosts the faster is chosen).
+  """
+  return (aHost['load'] / hostSpeed(aHost), -hostSpeed(aHost))
+
+def taskCores(aTask) :
+  """
+  Return the number of cores required by the task `aTask` (default 1).
+  """
+  return aTask.get('cores', 1)
+
+def taskMemory(aTask) :
+  """
+  Return the memory (MB) required by the task `aTask` (default 0).
+  """
+  return aTask.get('memory', 0)
+
+def taskFits(aTask, aHost) :
+  """
+  Return True if the task's required cores and memory fit into the host's
+  free (unreserved) capacity.
+
+  A host whose capacity is unknown accepts any task.
+  """
+  if 'freeCores' not in aHost : return True
+  return taskCores(aTask) <= aHost['freeCores'] and \
+    taskMemory(aTask) <= aHost['freeMemory']
+
+def taskFitsEmpty(aTask, aHost) :
+  """
+  Return True if the task's required cores and memory fit into the host's
+  total capacity (that is, once none of its capacity is reserved).
+
+  A host whose capacity is unknown accepts any task.
+  """
+  if 'freeCores' not in aHost : return True
+  return taskCores(aTask) <= aHost['numCpus'] and \
+    taskMemory(aTask) <= aHost['maxMemory']
+
+def hostIsEmpty(aHost) :
+  """
+  Return True if none of the host's cores are reserved by running tasks.
+  """
+  return 'freeCores' in aHost and aHost['numCpus'] <= aHost['freeCores']
+
+def hostsForTask(aTask, someHosts, allHosts=None) :
+  """
+  Return the list of the hosts, of `someHosts`, which may run the task
+  `aTask` now.
+
+  These are the hosts into whose free capacity the task fits. Only when this
+  list is empty, and the task is larger than the total capacity of every one
+  of the `allHosts` (by default the `someHosts`), are the empty hosts (those
+  without any reserved cores) returned instead, so that such a task can still
+  be run, alone, somewhere. Otherwise the task waits for capacity to be
+  released on a host which is large enough.
+  """
+  fittingHosts = [ aHost for aHost in someHosts if taskFits(aTask, aHost) ]
+  if fittingHosts : return fittingHosts
+  if allHosts is None : allHosts = someHosts
+  if any(taskFitsEmpty(aTask, aHost) for aHost in allHosts) : return []
+  return [ aHost for aHost in someHosts if hostIsEmpty(aHost) ]
+
+def taskDuration(aTask, default=None) :
+  """
+  Return the client's estimate of the duration (in seconds) of the task
+  `aTask`, or `default` if no estimate was provided.
+  """
+  if 'estimatedDuration' in aTask : return aTask['estimatedDuration']
+  return default
+
+class ShortestJobFirstPolicy(SchedulingPolicy) :
+  """
+  Start the pending task with the shortest estimated duration first. Tasks
+  without an estimate are started after all of those which have one (in
+  submission order).
+  """
+
+  name = 'sjf'
+
+  def selectTask(self, pendingTasks, aHost) :
+    if not pendingTasks : return None
+    return min(
+      range(len(pendingTasks)),
+      key=lambda anIndex : (
+        taskDuration(pendingTasks[anIndex], float('inf')), anIndex
+      )
+    )
+
+class LongestJobFirstPolicy(SchedulingPolicy) :
+  """
+  Start the pending task with the longest estimated duration first (so that
+  long tasks do not end up alone at the end of a build). Tasks without an
+  estimate are started after all of those which have one (in submission
+  order).
+  """
+
+  name = 'longestFirst'
+
+  def selectTask(self, pendingTasks, aHost) :
+    if not pendingTasks : return None
+    return min(
+      range(len(pendingTasks)),
+      key=lambda anIndex : (
+        -taskDuration(pendingTasks[anIndex], -1), anIndex
+      )
+    )
+
+class CriticalPathFirstPolicy(SchedulingPolicy) :
+  """
+  Start the pending task with the longest remaining critical path first, and
+  give it to the fastest candidate host (which is not overloaded).
+
+  The client provides the `criticalPath` (the estimated time from the start of
+  this task to the end of the build). Tasks without a critical path fall back
+  to their estimated duration.
+  """
+
+  name = 'criticalPath'
+
+  def selectHost(self, aTask, someHosts) :
+    someHosts = [
+      aHost for aHost in someHosts if aHost['load'] < aHost['maxLoad']
+    ] or someHosts
+    return min(
+      someHosts, key=lambda aHost : (-hostSpeed(aHost), aHost['load'])
+    )
+
+  def selectTask(self, pendingTasks, aHost) :
+    if not pendingTasks : return None
+    def criticalPath(anIndex) :
+      aTask = pendingTasks[anIndex]
+      if 'criticalPath' in aTask : return (-aTask['criticalPath'], anIndex)
+      return (-taskDuration(aTask, 0), anIndex)
+    return min(range(len(pendingTasks)), key=criticalPath)
+
+def inputOverlap(aTask, aHost) :
+  """
+  Return the number of the task's `inputs` which have recently been used on
+  the host `aHost`.
+  """
+  if 'inputs' not in aTask or not aHost.get('recentFiles') : return 0
+  recentFiles = aHost['recentFiles']
+  return sum(1 for anInput in aTask['inputs'] if anInput in recentFiles)
+
+class LocalityAwarePolicy(SchedulingPolicy) :
+  """
+  Prefer to run tasks on hosts which have recently used the task's inputs (and
+  so are likely to have warm file caches).
+
+  Ties are broken in submission order (for tasks) and by load (for hosts).
+  A warm cache is not worth an overloaded host, so hosts at (or above) their
+  maxLoad are only chosen if every candidate host is.
+  """
+
+  name = 'locality'
+
+  def selectTask(self, pendingTasks, aHost) :
+    if not pendingTasks : return None
+    return min(
+      range(len(pendingTasks)),
+      key=lambda anIndex : (
+        -inputOverlap(pendingTasks[anIndex], aHost), anIndex
+      )
+    )
+
+  def selectHost(self, aTask, someHosts) :
+    someHosts = [
+      aHost for aHost in someHosts if aHost['load'] < aHost['maxLoad']
+    ] or someHosts
+    return min(
+      someHosts,
+      key=lambda aHost : (-inputOverlap(aTask, aHost), speedLoad(aHost))
+    )
+
+class BestFitPolicy(SchedulingPolicy) :
+  """
+  Bin-pack tasks onto hosts: start the pending tasks in submission order, but
+  give each task to the host on which it leaves the fewest free cores (and
+  then the least free memory), so that large hosts are kept free for large
+  tasks. A task which is larger than every (idle) host is given to the
+  largest host.
+  """
+
+  name = 'bestFit'
+
+  def selectHost(self, aTask, someHosts) :
+    def leftOver(aHost) :
+      if 'freeCores' not in aHost :
+        return (0, float('inf'), 0, speedLoad(aHost))
+      freeCores  = aHost['freeCores'] - taskCores(aTask)
+      freeMemory = aHost['freeMemory'] - taskMemory(aTask)
+      if freeCores < 0 or freeMemory < 0 :
+        # (the task does not fit, so it is only given to this host if it fits
+        # on none of the hosts, and then the largest host is preferred)
+        return (1, -aHost['freeCores'], -aHost['freeMemory'], speedLoad(aHost))
+      return (0, freeCores, freeMemory, speedLoad(aHost))
+    return min(someHosts, key=leftOver)
+
+schedulingPolicies = {
+  SchedulingPolicy.name        : SchedulingPolicy,
+  ShortestJobFirstPolicy.name  : ShortestJobFirstPolicy,
+  LongestJobFirstPolicy.name   : LongestJobFirstPolicy,
+  CriticalPathFirstPolicy.name : CriticalPathFirstPolicy,
+  LocalityAwarePolicy.name     : LocalityAwarePolicy,
+  BestFitPolicy.name           : BestFitPolicy
+}
+
+def getSchedulingPolicy(policyName) :
+  """
+  Return a new instance of the scheduling policy named `policyName` (or None if
+  there is no such policy).
+  """
+  if policyName not in schedulingPolicies : return None
+  return schedulingPolicies[policyName]()
@@ -88,12 +88,26 @@ def jinjaFile(fromTemplate, toPath, config, secrets, logFile) :
     print(yaml.dump(env))
     print("==========================================================")
 
+def configValue(config, aKeyPath) :
+  """
+  Return the value of the (dotted) key path `aKeyPath` (for example
+  `monitor.inWorkers`) in the configuration (or None if it is not set).
+  """
+  aValue = config
+  for aKey in aKeyPath.split('.') :
+    if not isinstance(aValue, dict) or aKey not in aValue : return None
+    aValue = aValue[aKey]
+  return aValue
+
 def createRunCommandFor(
   aRole, rCmds, rVars, theTargetFile,
   aHost, aDir, config, secrets, logFile
 ) :
   """
   Create a run command (shell script) for (eventual) use on a remote computer.
+
+  A command with an `unless` key (the dotted key path of a configuration
+  value) is left out if this configuration value is set (and true).
   """
   cmdTemplate = """#!/bin/sh
 
@@ -109,6 +123,10 @@ def createRunCommandFor(
   echo "---------------------------------------------------------"
   {% endfor %}
 """
+  rCmds = [
+    aCmd for aCmd in rCmds
+      if not ('unless' in aCmd and configValue(config, aCmd['unless']))
+  ]
   for aCmd in rCmds :
     for aKey, aValue in aCmd.items() :
       aCmd[aKey] = aValue.format_map(rVars)
@@ -0,0 +1,432 @@
+"""
+The click command to simulate (offline) how a computeFarm would schedule a
+trace of tasks using one or more of the scheduling policies.
+
+This command expects a host model and a task trace (both YAML files) and
+reports the makespan, the mean and p99 task wait times and the utilisation of
+each host for each requested policy.
+
+No sockets, workers or monitors are used. Instead a simple discrete-event
+simulation replays the task trace against the host model:
+
+- the load of a host is the number of cores used by its running tasks divided
+  by (`numCpus` * `scale`) (which is what its monitor would report),
+
+- a task is started (by the same platform scan used by the taskManager's
+  `dispatcher`) when a host of an acceptable platform is below its `maxLoad`,
+  a worker of an acceptable type is free and the task's `cores` and `memory`
+  fit into the host's unreserved cores and memory,
+
+- running tasks share their host's cpus, progressing at the host's `speed`
+  when they use no more cores than the host has cpus,
+
+- each of a task's `inputs` which has not recently been used on its host adds
+  `coldInputCost` seconds to the task.
+
+The host model YAML file contains a list of hosts:
+
+  hosts:
+    - host: aHostName
+      platform: linux-x86_64  (the platform-cpu of this host)
+      numCpus: 4
+      maxLoad: 1.0            (default 1.0)
+      scale: 1.0              (default 1.0)
+      speed: 1.0              (relative speed of one cpu, default 1.0)
+      workers:                (the number of workers of each type)
+        gcc: 4
+      memTotal: 8192          (MB available to tasks, default unlimited)
+      coldInputCost: 0.0      (default 0.0 seconds per cold input)
+      inputCacheSize: 1000    (default 1000 recently used inputs)
+
+The task trace YAML file contains a list of tasks:
+
+  tasks:
+    - taskName: aTaskName     (MUST be unique)
+      submitted: 0.0          (default 0.0 seconds)
+      duration: 10.0          (seconds on a host with speed 1.0)
+      workers: [ gcc ]        (the acceptable worker types)
+      requiredPlatform: ...   (optional)
+      estimatedDuration: ...  (the client's estimate, default: duration)
+      criticalPath: ...       (optional, default: computed from dependsOn)
+      dependsOn: [ ... ]      (taskNames which must finish first)
+      inputs: [ ... ]         (the files read by this task)
+      cores: 1                (the cores used by this task, default 1)
+      memory: 0               (the memory (MB) used by this task, default 0)
+
+A task which depends upon other tasks is submitted once all of those tasks have
+finished (or at its `submitted` time if that is later).
+"""
+
+import click
+from collections import OrderedDict
+import heapq
+import math
+import random
+import sys
+import yaml
+
+from rcf.schedulingPolicies import (
+  schedulingPolicies, getSchedulingPolicy, taskCores, taskMemory, hostsForTask
+)
+
+def loadYamlFile(aPath, aKey) :
+  """
+  Load the list `aKey` from the YAML file `aPath`.
+  """
+  try :
+    with open(aPath) as yamlFile :
+      yamlData = yaml.safe_load(yamlFile.read())
+  except FileNotFoundError :
+    print(f"Could not load the {aPath}")
+    sys.exit(1)
+  if not isinstance(yamlData, dict) or aKey not in yamlData :
+    print(f"The {aPath} MUST contain a list of {aKey}")
+    sys.exit(1)
+  return yamlData[aKey]
+
+def initializeHosts(hostModel) :
+  """
+  Create the (simulated) host dicts from the host model.
+
+  Raises a click.ClickException if a host has less than one cpu, or a scale
+  or speed which is not positive.
+  """
+  hosts = []
+  for aHostModel in hostModel :
+    aName   = aHostModel.get('host')
+    numCpus = aHostModel.get('numCpus', 1)
+    if not isinstance(numCpus, int) or numCpus < 1 :
+      raise click.ClickException(
+        f"The numCpus of the host {aName} MUST be at least 1 (not {numCpus})"
+      )
+    for aKey in ( 'scale', 'speed' ) :
+      aValue = aHostModel.get(aKey, 1.0)
+      if not isinstance(aValue, (int, float)) or aValue <= 0 :
+        raise click.ClickException(
+          f"The {aKey} of the host {aName} MUST be positive (not {aValue})"
+        )
+    hosts.append({
+      'host'           : aHostModel['host'],
+      'platform'       : aHostModel['platform'],
+      'numCpus'        : numCpus,
+      'maxLoad'        : aHostModel.get('maxLoad', 1.0),
+      'scale'          : aHostModel.get('scale', 1.0),
+      'speed'          : aHostModel.get('speed', 1.0),
+      'coldInputCost'  : aHostModel.get('coldInputCost', 0.0),
+      'inputCacheSize' : aHostModel.get('inputCacheSize', 1000),
+      'freeWorkers'    : dict(aHostModel.get('workers', {})),
+      'recentFiles'    : OrderedDict(),
+      'running'        : [],
+      'load'           : 0.0,
+      'busyTime'       : 0.0,
+      'usedCores'      : 0
+    })
+    hosts[-1]['freeCores']  = hosts[-1]['numCpus']
+    hosts[-1]['maxMemory']  = aHostModel.get('memTotal', math.inf)
+    hosts[-1]['freeMemory'] = hosts[-1]['maxMemory']
+  return hosts
+
+def computeCriticalPaths(tasks) :
+  """
+  Add a `criticalPath` (the estimated time from the start of a task to the end
+  of the trace) to every task which does not already have one.
+
+  Raises a click.ClickException if a task depends upon an unknown task, or
+  (indirectly) upon itself.
+  """
+  dependents = { aName : [] for aName in tasks }
+  for aName, aTask in tasks.items() :
+    for aDependency in aTask['dependsOn'] :
+      if aDependency not in dependents :
+        raise click.ClickException(
+          f"The task {aName} depends upon the unknown task {aDependency}"
+        )
+      dependents[aDependency].append(aName)
+
+  # walk the tasks in reverse topological order (all dependents first)
+  criticalPaths = {}
+  entered       = set()  # (a task entered but not finished is on the path)
+  toVisit = [ (aName, False) for aName in tasks ]
+  while toVisit :
+    aName, dependentsDone = toVisit.pop()
+    if aName in criticalPaths : continue
+    if not dependentsDone :
+      if aName in entered :
+        raise click.ClickException(
+          f"The dependsOn of the task {aName} form a cycle"
+        )
+      entered.add(aName)
+      toVisit.append((aName, True))
+      for aDependent in dependents[aName] :
+        if aDependent not in criticalPaths :
+          toVisit.append((aDependent, False))
+      continue
+    longestDependent = 0
+    for aDependent in dependents[aName] :
+      longestDependent = max(longestDependent, criticalPaths[aDependent])
+    criticalPaths[aName] = tasks[aName]['estimatedDuration'] + longestDependent
+
+  for aName, aTask in tasks.items() :
+    if 'criticalPath' not in aTask :
+      aTask['criticalPath'] = criticalPaths[aName]
+
+def initializeTasks(taskTrace) :
+  """
+  Create the (simulated) taskRequest dicts from the task trace.
+  """
+  tasks = {}
+  for aTaskTrace in taskTrace :
+    aTask = dict(aTaskTrace)
+    aName = aTask['taskName']
+    if aName in tasks :
+      print(f"The task trace contains more than one {aName} task")
+      sys.exit(1)
+    if 'submitted' not in aTask : aTask['submitted'] = 0.0
+    if 'dependsOn' not in aTask : aTask['dependsOn'] = []
+    if 'estimatedDuration' not in aTask :
+      aTask['estimatedDuration'] = aTask['duration']
+    tasks[aName] = aTask
+  computeCriticalPaths(tasks)
+  return tasks
+
+def percentile(someValues, aPercentile) :
+  """
+  Return the (nearest rank) percentile of the list `someValues`.
+  """
+  if not someValues : return 0.0
+  sortedValues = sorted(someValues)
+  aRank = math.ceil(aPercentile / 100 * len(sortedValues))
+  return sortedValues[max(aRank, 1) - 1]
+
+def simulateTrace(policy, hostModel, taskTrace) :
+  """
+  Simulate the scheduling of the task trace on the host model using the
+  scheduling policy `policy` and return a dict of the resulting statistics.
+  """
+  hosts = initializeHosts(hostModel)
+  tasks = initializeTasks(taskTrace)
+
+  platforms = {}
+  for aHost in hosts :
+    if aHost['platform'] not in platforms : platforms[aHost['platform']] = []
+    platforms[aHost['platform']].append(aHost)
+
+  # the heap of (time, sequence, taskName) submissions
+  submissions    = []
+  waitingOn      = {}
+  dependents     = { aName : [] for aName in tasks }
+  for aName, aTask in tasks.items() :
+    waitingOn[aName] = len(aTask['dependsOn'])
+    for aDependency in aTask['dependsOn'] :
+      dependents[aDependency].append(aName)
+    if not aTask['dependsOn'] :
+      heapq.heappush(submissions, (aTask['submitted'], len(submissions), aName))
+
+  pending  = []
+  waits    = []
+  finished = {}
+  firstSubmitted = None
+  now = 0.0
+
+  def updateLoad(aHost) :
+    aHost['load'] = aHost['usedCores'] / (aHost['numCpus'] * aHost['scale'])
+
+  def hostRate(aHost) :
+    if aHost['usedCores'] <= aHost['numCpus'] : return aHost['speed']
+    return aHost['speed'] * aHost['numCpus'] / aHost['usedCores']
+
+  def reserve(aTask, aHost, aSign) :
+    aHost['usedCores']  += aSign * taskCores(aTask)
+    aHost['freeCores']  -= aSign * taskCores(aTask)
+    aHost['freeMemory'] -= aSign * taskMemory(aTask)
+
+  def platformHosts(aTask) :
+    if 'requiredPlatform' not in aTask : return hosts
+    return [ h for h in hosts if h['platform'] == aTask['requiredPlatform'] ]
+
+  def freeWorkerType(aTask, aHost) :
+    for aWorkerType in aTask['workers'] :
+      if 0 < aHost['freeWorkers'].get(aWorkerType, 0) : return aWorkerType
+    return None
+
+  def candidateHosts(aTask) :
+    someHosts = platformHosts(aTask)
+    return hostsForTask(aTask, [
+      h for h in someHosts if freeWorkerType(aTask, h) is not None
+    ], someHosts)
+
+  def startTask(aTask, aHost, aWorkerType) :
+    pending.remove(aTask)
+    aHost['freeWorkers'][aWorkerType] -= 1
+    coldInputs = 0
+    recentFiles = aHost['recentFiles']
+    for anInput in aTask.get('inputs', []) :
+      if anInput in recentFiles : recentFiles.move_to_end(anInput)
+      else :
+        coldInputs += 1
+        recentFiles[anInput] = True
+      while aHost['inputCacheSize'] < len(recentFiles) :
+        recentFiles.popitem(last=False)
+    aTask['started']    = now
+    aTask['workerType'] = aWorkerType
+    aTask['remaining']  = \
+      aTask['duration'] + coldInputs * aHost['coldInputCost']
+    aHost['running'].append(aTask)
+    reserve(aTask, aHost, 1)
+    updateLoad(aHost)
+    waits.append(now - aTask['ready'])
+
+  def dispatch() :
+    taskStarted = True
+    while taskStarted :
+      taskStarted = False
+      for aPlatform in policy.orderPlatforms(platforms.keys()) :
+        for aHost in platforms[aPlatform] :
+          if aHost['maxLoad'] <= aHost['load'] : continue
+          # only tasks which could start now (on some host) are considered
+          runnableTasks = []
+          for aTask in pending :
+            if 'requiredPlatform' in aTask and \
+              aTask['requiredPlatform'] != aPlatform : continue
+            if not hostsForTask(aTask, [ aHost ], platformHosts(aTask)) :
+              continue
+            if not candidateHosts(aTask) : continue
+            runnableTasks.append(aTask)
+          taskIndex = policy.selectTask(runnableTasks, aHost)
+          if taskIndex is None : continue
+          aTask = runnableTasks[taskIndex]
+          chosenHost = policy.selectHost(aTask, candidateHosts(aTask))
+          startTask(aTask, chosenHost, freeWorkerType(aTask, chosenHost))
+          taskStarted = True
+          break  # only start one task per platform durring one scan
+
+  while submissions or pending or any(h['running'] for h in hosts) :
+    # find the time of the next event (submission or task completion)
+    nextTime = math.inf
+    if submissions : nextTime = submissions[0][0]
+    for aHost in hosts :
+      aRate = hostRate(aHost)
+      for aTask in aHost['running'] :
+        nextTime = min(nextTime, now + aTask['remaining'] / aRate)
+    if nextTime == math.inf :
+      break  # the remaining pending tasks can never be started
+
+    # advance all running tasks to the next event
+    elapsed = max(nextTime - now, 0.0)
+    for aHost in hosts :
+      aRate = hostRate(aHost)
+      aHost['busyTime'] += min(aHost['usedCores'], aHost['numCpus']) * elapsed
+      for aTask in aHost['running'] :
+        aTask['remaining'] -= aRate * elapsed
+    now = nextTime
+
+    # retire the finished tasks (and submit their newly ready dependents)
+    for aHost in hosts :
+      for aTask in list(aHost['running']) :
+        if 1e-9 < aTask['remaining'] : continue
+        aHost['running'].remove(aTask)
+        aHost['freeWorkers'][aTask['workerType']] += 1
+        reserve(aTask, aHost, -1)
+        updateLoad(aHost)
+        aTask['finished'] = now
+        finished[aTask['taskName']] = aTask
+        for aDependent in dependents[aTask['taskName']] :
+          waitingOn[aDependent] -= 1
+          if waitingOn[aDependent] == 0 :
+            heapq.heappush(submissions, (
+              max(now, tasks[aDependent]['submitted']),
+              len(tasks) + len(finished),
+              aDependent
+            ))
+
+    while submissions and submissions[0][0] <= now :
+      submitTime, aSequence, aName = heapq.heappop(submissions)
+      tasks[aName]['ready'] = submitTime
+      if firstSubmitted is None : firstSubmitted = submitTime
+      pending.append(tasks[aName])
+
+    dispatch()
+
+  makespan = 0.0
+  if finished :
+    makespan = max(t['finished'] for t in finished.values()) - firstSubmitted
+  hostUtilisation = {}
+  for aHost in hosts :
+    utilisation = 0.0
+    if 0 < makespan :
+      utilisation = aHost['busyTime'] / (aHost['numCpus'] * makespan)
+    hostUtilisation[aHost['host']] = round(utilisation, 4)
+
+  return {
+    'policy'          : policy.name,
+    'tasks'           : len(tasks),
+    'unscheduled'     : len(tasks) - len(finished),
+    'makespan'        : round(makespan, 4),
+    'meanWait'        : round(sum(waits) / len(waits), 4) if waits else 0.0,
+    'p99Wait'         : round(percentile(waits, 99), 4),
+    'hostUtilisation' : hostUtilisation
+  }
+
+def printResults(results) :
+  """
+  Print a simple table comparing the results of each simulated policy.
+  """
+  policyWidth = max([ len('policy') ] + [ len(r['policy']) for r in results ])
+  print("")
+  print(f"{'policy'.ljust(policyWidth)} {'makespan':>12} {'meanWait':>12} {'p99Wait':>12} {'unscheduled':>12}")
+  for aResult in results :
+    print(f"{aResult['policy'].ljust(policyWidth)} {aResult['makespan']:12.2f} {aResult['meanWait']:12.2f} {aResult['p99Wait']:12.2f} {aResult['unscheduled']:12d}")
+
+  hostNames = list(results[0]['hostUtilisation'].keys()) if results else []
+  hostWidth = max([ len('host') ] + [ len(h) for h in hostNames ])
+  print("")
+  print("Host utilisation:")
+  print(" ".join(
+    [ 'host'.ljust(hostWidth) ] +
+    [ r['policy'].rjust(12) for r in results ]
+  ))
+  for aHost in hostNames :
+    print(" ".join(
+      [ aHost.ljust(hostWidth) ] +
+      [ f"{r['hostUtilisation'][aHost]:12.1%}" for r in results ]
+    ))
+  print("")
+
+@click.command()
+@click.argument('hostmodel')
+@click.argument('tasktrace')
+@click.option('-p', '--policy', 'policies', multiple=True,
+  help=f"A scheduling policy to simulate (may be repeated; default: all of {', '.join(schedulingPolicies.keys())})"
+)
+@click.option('-s', '--seed', default=0, show_default=True,
+  help="The random seed used by the simulation"
+)
+@click.option('-o', '--output', default=None,
+  help="Also write the results (as YAML) to this file"
+)
+@click.pass_context
+def simulate(ctx, hostmodel, tasktrace, policies, seed, output) :
+  """Simulate scheduling TASKTRACE on the hosts in HOSTMODEL.
+
+  Each scheduling policy is simulated in turn and the resulting makespan,
+  mean and p99 wait times and per host utilisation are compared.
+  """
+  hostModel = loadYamlFile(hostmodel, 'hosts')
+  taskTrace = loadYamlFile(tasktrace, 'tasks')
+
+  if not policies : policies = list(schedulingPolicies.keys())
+
+  results = []
+  for aPolicyName in policies :
+    policy = getSchedulingPolicy(aPolicyName)
+    if not policy :
+      print(f"Unknown scheduling policy [{aPolicyName}]")
+      sys.exit(1)
+    random.seed(seed)
+    results.append(simulateTrace(policy, hostModel, taskTrace))
+
+  printResults(results)
+
+  if output :
+    with open(output, 'w') as outputFile :
+      outputFile.write(yaml.dump(results))
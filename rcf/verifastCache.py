@@ -0,0 +1,191 @@
+
+# This is the taskCache plugin for the VeriFast Worker (it is also used by the
+# `newTask` tool, see its `--cache` option, so that the taskManager can answer
+# a cached task without dispatching it to a worker at all)
+#
+# A task is cacheable if it consists of a single run of verifast on one or
+# more source files.
+#
+# The cache key is the hash of:
+#
+#  - VeriFast's identity (the resolved path, size and modification time of
+#    the verifast executable together with its version banner; the specs in
+#    VeriFast's own `bin` directory are part of its release),
+#
+#  - verifast's options (in order),
+#
+#  - the (relative) path and contents of each source file,
+#
+#  - for Java, the path and contents of the files which each `.jarsrc` or
+#    `.jarspec` lists (and of the `.jarspec` of each listed jar, unless the
+#    jar is VeriFast's own), together with the `.javaspec` which shares each
+#    `.java` file's name (and the `.jarspec` which shares a `.jarsrc`'s name),
+#
+#  - the path and contents of each (C or ghost) header which these sources
+#    include, directly or indirectly, together with the headers which share
+#    a source's name (`x.h` and `x.gh` for `x.c`). A task which includes a
+#    `"..."` header which can not be found is not cacheable (`<...>` headers
+#    which can not be found are VeriFast's own).
+#
+# VeriFast verifies each file as a whole, so the results are cached per task
+# (that is per file, for the usual one file tasks) rather than per function.
+#
+# The cached results are the task's parsed log messages (see the worker) so
+# the verifastLogParser's results are replayed identically on a hit. Only
+# successful verifications are cached.
+
+import hashlib
+import os
+import re
+import shlex
+import shutil
+import subprocess
+
+verifierNames = ( 'verifast', 'verifast.exe' )
+
+sourceSuffixes = ( '.c', '.java', '.javaspec', '.jarsrc', '.jarspec' )
+
+includeRE = re.compile(r'#\s*include\s*(["<])([^">]+)[">]')
+
+verifierIdentities = {}
+
+def verifierIdentity(aVerifier, taskEnv) :
+  """
+  Return (and remember) a string which identifies the verifast executable
+  `aVerifier` (as found on the task's PATH).
+
+  The identities are remembered by the executable's resolved path, size and
+  modification time (rather than by its name), since tasks may have
+  different PATHs and VeriFast may be upgraded in place.
+  """
+  thePath = shutil.which(aVerifier, path=(taskEnv or os.environ).get('PATH'))
+  if not thePath : return None
+  thePath = os.path.realpath(thePath)
+  aStat   = os.stat(thePath)
+  aKey    = (thePath, aStat.st_size, aStat.st_mtime_ns)
+  if aKey in verifierIdentities : return verifierIdentities[aKey]
+  someOutput = subprocess.run(
+    [ thePath ], capture_output=True, env=taskEnv
+  )
+  someLines = (someOutput.stdout + someOutput.stderr).decode().splitlines()
+  theBanner = next(
+    (aLine for aLine in someLines if 'verifast' in aLine.lower()), ''
+  )
+  theIdentity = f"{thePath}:{aStat.st_size}:{aStat.st_mtime_ns}:{theBanner}"
+  verifierIdentities[aKey] = theIdentity
+  return theIdentity
+
+def includedFiles(aPath, includeDirs, someFiles) :
+  """
+  Add the file `aPath`, and (recursively) the headers which it includes
+  (found relative to `aPath` or in the `includeDirs`), to the list
+  `someFiles`. A `<...>` header which can not be found is assumed to be
+  VeriFast's own, while a missing `"..."` header raises FileNotFoundError
+  (the task is not cacheable).
+  """
+  if aPath in someFiles : return
+  someFiles.append(aPath)
+  with open(aPath, 'rb') as aFile :
+    someText = aFile.read().decode('utf8', errors='replace')
+  for aQuote, aName in includeRE.findall(someText) :
+    for aDir in [ os.path.dirname(aPath) ] + includeDirs :
+      aHeader = os.path.normpath(os.path.join(aDir, aName))
+      if os.path.isfile(aHeader) :
+        includedFiles(aHeader, includeDirs, someFiles)
+        break
+    else :
+      if aQuote == '"' : raise FileNotFoundError(aName)
+
+def listedFiles(aPath, someFiles) :
+  """
+  Add the Java file `aPath` (a `.java`, `.javaspec`, `.jarsrc` or `.jarspec`
+  file) and (recursively) the files on which it depends to the list
+  `someFiles`.
+
+  These are the `.javaspec` which shares a `.java` file's name, the
+  `.jarspec` which shares a `.jarsrc`'s name, and the files listed (one per
+  line, relative to the list) in a `.jarsrc` or `.jarspec`. A listed jar
+  which can not be found is assumed to be VeriFast's own, while any other
+  missing file raises FileNotFoundError (the task is not cacheable).
+  """
+  if aPath in someFiles : return
+  if not os.path.isfile(aPath) : raise FileNotFoundError(aPath)
+  someFiles.append(aPath)
+  stem, suffix = os.path.splitext(aPath)
+  if suffix == '.java' and os.path.isfile(stem + '.javaspec') :
+    listedFiles(stem + '.javaspec', someFiles)
+  if suffix == '.jarsrc' and os.path.isfile(stem + '.jarspec') :
+    listedFiles(stem + '.jarspec', someFiles)
+  if suffix not in ( '.jarsrc', '.jarspec' ) : return
+  with open(aPath, 'rb') as aFile :
+    someLines = aFile.read().decode('utf8', errors='replace').splitlines()
+  for aLine in someLines :
+    aLine = aLine.strip()
+    anEntry = os.path.normpath(os.path.join(os.path.dirname(aPath), aLine))
+    if aLine.endswith(( '.java', '.javaspec' )) :
+      listedFiles(anEntry, someFiles)
+    elif aLine.endswith('.jar') :
+      aJarSpec = os.path.splitext(anEntry)[0] + '.jarspec'
+      if os.path.isfile(anEntry) : listedFiles(anEntry, someFiles)
+      if os.path.isfile(aJarSpec) : listedFiles(aJarSpec, someFiles)
+
+def cacheKey(taskRequest, taskDir, taskEnv) :
+  """
+  Return the (cache key, list of outputs) of a cacheable verifast task (or
+  None).
+  """
+  someActions = taskRequest.get('actions') or []
+  if len(someActions) != 1 : return None
+  anAction = someActions[0]
+  if isinstance(anAction, list) : anAction = ' '.join(anAction)
+  try :
+    someWords = shlex.split(anAction)
+  except ValueError :
+    return None
+  if not someWords : return None
+
+  someAliases = taskRequest.get('aliases') or {}
+  aVerifier   = someWords[0]
+  if aVerifier in someAliases : aVerifier = someAliases[aVerifier]
+  if os.path.basename(aVerifier) not in verifierNames : return None
+
+  someOptions = []
+  someSources = []
+  includeDirs = []
+  someWords   = someWords[1:]
+  for i, aWord in enumerate(someWords) :
+    if aWord in ( '<', '>', '|', '&&', ';' ) : return None
+    if aWord.endswith(sourceSuffixes) and not aWord.startswith('-') :
+      someSources.append(aWord)
+    else :
+      someOptions.append(aWord)
+      if aWord == '-I' and i+1 < len(someWords) :
+        includeDirs.append(os.path.join(taskDir, someWords[i+1]))
+  if not someSources : return None
+
+  theIdentity = verifierIdentity(aVerifier, taskEnv)
+  if not theIdentity : return None
+
+  someFiles = []
+  try :
+    for aSource in someSources :
+      aPath = os.path.normpath(os.path.join(taskDir, aSource))
+      if not aPath.endswith('.c') :
+        listedFiles(aPath, someFiles)
+        continue
+      stem  = os.path.splitext(aPath)[0]
+      for aHeader in ( stem + '.h', stem + '.gh' ) :
+        if os.path.isfile(aHeader) :
+          includedFiles(aHeader, includeDirs, someFiles)
+      includedFiles(aPath, includeDirs, someFiles)
+    theHash = hashlib.sha256()
+    theHash.update(theIdentity.encode())
+    theHash.update(b'\0')
+    theHash.update('\0'.join(someOptions).encode())
+    for aPath in sorted(someFiles) :
+      theHash.update(f"\0{os.path.relpath(aPath, taskDir)}\0".encode())
+      with open(aPath, 'rb') as aFile :
+        theHash.update(hashlib.sha256(aFile.read()).digest())
+  except OSError :
+    return None
+  return f"verifast:{theHash.hexdigest()}", []
@@ -0,0 +1,190 @@
+
+# This is the taskCache plugin for the z3 Worker (it is also used by the
+# `newTask` tool, see its `--cache` option, so that the taskManager can answer
+# a cached task without dispatching it to a worker at all)
+#
+# A task is cacheable if it consists of a single run of z3 on one SMT-LIB
+# (`.smt2`) file.
+#
+# The cache key is the hash of:
+#
+#  - z3's version (so the key can only be computed where z3 is installed),
+#
+#  - z3's options (in order, including any timeouts),
+#
+#  - the normalised SMT-LIB problem.
+#
+# The problem is normalised by removing its comments, `set-info` commands and
+# layout, and (unless the problem asks for output which names its symbols,
+# for example `get-model`) by renaming its declared sorts, constants and
+# functions in the order in which they are declared. So identical, and
+# alpha-equivalent, problems share a key.
+#
+# The cached results are z3's output (sat/unsat/unknown together with any
+# model or proof) which is replayed as the task's log. Only successful runs
+# are cached (z3 exits with a non-zero returncode if the problem contains an
+# error).
+
+import hashlib
+import os
+import shlex
+import shutil
+import subprocess
+
+solverNames = ( 'z3', 'z3.exe' )
+
+# commands which introduce a (renameable) symbol
+declaringCommands = ( 'declare-fun', 'declare-const', 'define-fun',
+  'define-fun-rec', 'declare-sort', 'define-sort' )
+
+# commands whose output names the problem's symbols
+namingCommands = ( 'get-model', 'get-value', 'get-proof', 'get-unsat-core',
+  'get-assignment', 'get-assertions', 'eval', 'echo', 'display', 'simplify' )
+
+solverVersions = {}
+
+def solverVersion(aSolver, taskEnv) :
+  """
+  Return (and remember) the version of the z3 executable `aSolver` (as found
+  on the task's PATH).
+
+  The versions are remembered by the executable's resolved path, size and
+  modification time (rather than by its name), since tasks may have
+  different PATHs and z3 may be upgraded in place.
+  """
+  thePath = shutil.which(aSolver, path=(taskEnv or os.environ).get('PATH'))
+  if not thePath : return None
+  thePath = os.path.realpath(thePath)
+  aStat   = os.stat(thePath)
+  aKey    = (thePath, aStat.st_size, aStat.st_mtime_ns)
+  if aKey in solverVersions : return solverVersions[aKey]
+  theVersion = subprocess.run(
+    [ thePath, '--version' ], capture_output=True, env=taskEnv
+  ).stdout.decode().strip()
+  if not theVersion : return None
+  solverVersions[aKey] = theVersion
+  return theVersion
+
+def isSimpleSymbol(aWord) :
+  return bool(aWord) and not aWord[0].isdigit() and all(
+    aChar.isalnum() or aChar in "~!@$%^&*_-+=<>.?/" for aChar in aWord
+  )
+
+def smtTokens(someText) :
+  """
+  Split the SMT-LIB text `someText` into its tokens (parentheses, strings,
+  quoted symbols and atoms), dropping comments and layout.
+  """
+  someTokens = []
+  i = 0
+  end = len(someText)
+  while i < end :
+    aChar = someText[i]
+    if aChar.isspace() :
+      i += 1
+    elif aChar == ';' :
+      i = someText.find('\n', i)
+      if i < 0 : i = end
+    elif aChar in '()' :
+      someTokens.append(aChar)
+      i += 1
+    elif aChar == '"' :
+      j = i + 1
+      while j < end :
+        if someText[j] == '"' :
+          if someText[j+1:j+2] != '"' : break
+          j += 1  # an escaped ("") quote
+        j += 1
+      someTokens.append(someText[i:j+1])
+      i = j + 1
+    elif aChar == '|' :
+      j = someText.find('|', i + 1)
+      if j < 0 : j = end
+      aSymbol = someText[i+1:j]
+      someTokens.append(aSymbol if isSimpleSymbol(aSymbol) else someText[i:j+1])
+      i = j + 1
+    else :
+      j = i
+      while j < end and not someText[j].isspace() and someText[j] not in '();"|' :
+        j += 1
+      someTokens.append(someText[i:j])
+      i = j
+  return someTokens
+
+def normaliseSmt(someText) :
+  """
+  Return the normalised (see above) form of the SMT-LIB text `someText`.
+  """
+  someTokens = smtTokens(someText)
+
+  # drop the (top level) set-info commands
+  keptTokens = []
+  depth = 0
+  skipping = False
+  for i, aToken in enumerate(someTokens) :
+    if depth == 0 and aToken == '(' and \
+      someTokens[i+1:i+2] == [ 'set-info' ] :
+      skipping = True
+    if aToken == '(' : depth += 1
+    elif aToken == ')' : depth -= 1
+    if not skipping : keptTokens.append(aToken)
+    if skipping and depth == 0 : skipping = False
+  someTokens = keptTokens
+
+  commands = set(
+    someTokens[i+1] for i, aToken in enumerate(someTokens[:-1])
+      if aToken == '('
+  )
+  if commands.isdisjoint(namingCommands) :
+    # (the renamed tokens are not valid SMT-LIB, so can not clash with the
+    # problem's own tokens)
+    newNames = {}
+    for i, aToken in enumerate(someTokens[:-2]) :
+      if aToken == '(' and someTokens[i+1] in declaringCommands :
+        aName = someTokens[i+2]
+        if aName not in newNames : newNames[aName] = f"\0{len(newNames)}"
+    someTokens = [ newNames.get(aToken, aToken) for aToken in someTokens ]
+  return ' '.join(someTokens)
+
+def cacheKey(taskRequest, taskDir, taskEnv) :
+  """
+  Return the (cache key, list of outputs) of a cacheable z3 task (or None).
+  """
+  someActions = taskRequest.get('actions') or []
+  if len(someActions) != 1 : return None
+  anAction = someActions[0]
+  if isinstance(anAction, list) : anAction = ' '.join(anAction)
+  try :
+    someWords = shlex.split(anAction)
+  except ValueError :
+    return None
+  if not someWords : return None
+
+  someAliases = taskRequest.get('aliases') or {}
+  aSolver     = someWords[0]
+  if aSolver in someAliases : aSolver = someAliases[aSolver]
+  if os.path.basename(aSolver) not in solverNames : return None
+
+  someOptions = []
+  someFiles   = []
+  for aWord in someWords[1:] :
+    if aWord in ( '-in', '<', '>', '|', '&&', ';' ) : return None
+    if aWord.startswith('-') or '=' in aWord : someOptions.append(aWord)
+    else                                     : someFiles.append(aWord)
+  if len(someFiles) != 1 or not someFiles[0].endswith('.smt2') : return None
+
+  theVersion = solverVersion(aSolver, taskEnv)
+  if not theVersion : return None
+  try :
+    with open(os.path.join(taskDir, someFiles[0]), encoding='utf8') as smtFile :
+      someText = smtFile.read()
+  except (OSError, UnicodeDecodeError) :
+    return None
+
+  theHash = hashlib.sha256()
+  theHash.update(theVersion.encode())
+  theHash.update(b'\0')
+  theHash.update('\0'.join(someOptions).encode())
+  theHash.update(b'\0')
+  theHash.update(normaliseSmt(someText).encode())
+  return f"z3:{theHash.hexdigest()}", []